@@ -9,6 +9,7 @@ from __future__ import print_function
 
 from datasets.imdb import imdb
 import datasets.ds_utils as ds_utils
+from datasets.columnar_roidb import ColumnarRoidb
 from model.config import cfg
 import os.path as osp
 import sys
@@ -105,6 +106,11 @@ class coco(imdb):
     Return the database of ground-truth regions of interest.
     This function loads/saves from/to a cache file to speed up future calls.
     """
+    if cfg.COLUMNAR_ROIDB:
+      return self._columnar_gt_roidb(
+        lambda: [self._load_coco_annotation(index)
+                 for index in self._image_index])
+
     cache_file = osp.join(self.cache_path, self.name + '_gt_roidb.pkl')
     if osp.exists(cache_file):
       with open(cache_file, 'rb') as fid:
@@ -179,11 +185,14 @@ class coco(imdb):
             'seg_areas': seg_areas}
 
   def _get_widths(self):
+    if isinstance(self.roidb, ColumnarRoidb):
+      return self.roidb.image_column('width')
     return [r['width'] for r in self.roidb]
 
   def append_flipped_images(self):
     num_images = self.num_images
     widths = self._get_widths()
+    entries = []
     for i in range(num_images):
       boxes = self.roidb[i]['boxes'].copy()
       oldx1 = boxes[:, 0].copy()
@@ -199,7 +208,8 @@ class coco(imdb):
                'flipped': True,
                'seg_areas': self.roidb[i]['seg_areas']}
 
-      self.roidb.append(entry)
+      entries.append(entry)
+    self.roidb.extend(entries)
     self._image_index = self._image_index * 2
 
   def _get_box_file(self, index):
@@ -0,0 +1,291 @@
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""A roidb stored as a few flat arrays instead of a list of dicts.
+
+Per-box fields (boxes, gt_classes, seg_areas, max_classes, max_overlaps) are
+concatenated over all the images, with the boxes of image i in rows
+offsets[i]:offsets[i + 1]. The gt_overlaps of all the boxes form a single
+csr matrix. Per-image fields (image, width, height, flipped) are flat arrays.
+
+roidb[i] returns a dict-like view of image i, so that code written for the
+list-of-dicts roidb keeps working, and writes through it go to the columns.
+A columnar roidb is saved as a directory of .npy files and memory-mapped back,
+so that forked workers share its pages instead of copying many small objects.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import os.path as osp
+import numpy as np
+import scipy.sparse
+
+PER_IMAGE_KEYS = ('image', 'width', 'height', 'flipped')
+OVERLAP_PARTS = ('data', 'indices', 'indptr')
+
+
+class RoidbEntry(object):
+  """Dict-like view of one image of a ColumnarRoidb."""
+
+  def __init__(self, roidb, i):
+    self._roidb = roidb
+    self._i = i
+
+  def __getitem__(self, key):
+    return self._roidb._get(self._i, key)
+
+  def __setitem__(self, key, value):
+    self._roidb._set(self._i, key, value)
+
+  def __contains__(self, key):
+    return self._roidb._has(self._i, key)
+
+  def get(self, key, default=None):
+    return self[key] if key in self else default
+
+  def keys(self):
+    return [key for key in self._roidb.keys() if key in self]
+
+  def copy(self):
+    return dict((key, self[key]) for key in self.keys())
+
+
+class ColumnarRoidb(object):
+  """Array-backed roidb, see the module docstring."""
+
+  def __init__(self, num_classes):
+    self._num_classes = num_classes
+    self._offsets = np.zeros((1,), dtype=np.int64)
+    self._box_columns = {}
+    self._image_columns = {}
+    self._overlaps = scipy.sparse.csr_matrix((0, num_classes),
+                                             dtype=np.float32)
+    # Fields that are neither per-box arrays nor per-image scalars
+    self._extra = {}
+
+  @classmethod
+  def from_list(cls, roidb, num_classes=None):
+    """Build a columnar roidb from a list of roidb dicts."""
+    if num_classes is None:
+      num_classes = roidb[0]['gt_overlaps'].shape[1]
+    columnar = cls(num_classes)
+    columnar.extend(roidb)
+    return columnar
+
+  def to_list(self):
+    """Return the roidb as a list of dicts."""
+    return [entry.copy() for entry in self]
+
+  def __len__(self):
+    return len(self._offsets) - 1
+
+  def __getitem__(self, i):
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError('roidb index out of range')
+    return RoidbEntry(self, i)
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield RoidbEntry(self, i)
+
+  @property
+  def num_boxes(self):
+    return int(self._offsets[-1])
+
+  @property
+  def overlaps(self):
+    """The gt_overlaps of all the boxes, as one csr matrix."""
+    return self._overlaps
+
+  def keys(self):
+    keys = ['gt_overlaps']
+    keys.extend(self._box_columns.keys())
+    keys.extend(self._image_columns.keys())
+    for extra in self._extra.values():
+      keys.extend(k for k in extra.keys() if k not in keys)
+    return keys
+
+  def box_column(self, key):
+    """Return the per-box column key, concatenated over all the images."""
+    return self._box_columns[key]
+
+  def image_column(self, key):
+    """Return the per-image column key."""
+    return self._image_columns[key]
+
+  def set_box_column(self, key, values):
+    assert len(values) == self.num_boxes
+    self._box_columns[key] = np.asarray(values)
+
+  def set_image_column(self, key, values):
+    assert len(values) == len(self)
+    self._image_columns[key] = np.asarray(values)
+
+  def _rows(self, i):
+    return int(self._offsets[i]), int(self._offsets[i + 1])
+
+  def _has(self, i, key):
+    return (key == 'gt_overlaps' or key in self._box_columns or
+            key in self._image_columns or key in self._extra.get(i, {}))
+
+  def _get(self, i, key):
+    start, end = self._rows(i)
+    if key == 'gt_overlaps':
+      return self._overlaps[start:end]
+    if key in self._box_columns:
+      return self._box_columns[key][start:end]
+    if key in self._image_columns:
+      value = self._image_columns[key][i]
+      # Hand out python scalars, like the list-of-dicts roidb does
+      return value.item() if isinstance(value, np.generic) else value
+    if key in self._extra.get(i, {}):
+      return self._extra[i][key]
+    raise KeyError(key)
+
+  def _writable(self, columns, key):
+    # Columns memory-mapped from the cache are read-only
+    column = columns[key]
+    if not column.flags.writeable:
+      column = columns[key] = np.array(column)
+    return column
+
+  def _set(self, i, key, value):
+    start, end = self._rows(i)
+    if key == 'gt_overlaps':
+      raise ValueError('gt_overlaps of a columnar roidb cannot be assigned')
+    if key in PER_IMAGE_KEYS:
+      dtype = np.asarray(value).dtype
+      if key not in self._image_columns:
+        self._image_columns[key] = np.zeros((len(self),), dtype=dtype)
+      elif (dtype.kind == 'U' and
+            dtype.itemsize > self._image_columns[key].dtype.itemsize):
+        # Widen the string column to fit the new value
+        self._image_columns[key] = self._image_columns[key].astype(dtype)
+      self._writable(self._image_columns, key)[i] = value
+    elif isinstance(value, np.ndarray) and len(value) == end - start:
+      if key not in self._box_columns:
+        self._box_columns[key] = np.zeros((self.num_boxes,) + value.shape[1:],
+                                          dtype=value.dtype)
+      self._writable(self._box_columns, key)[start:end] = value
+    else:
+      self._extra.setdefault(i, {})[key] = value
+
+  def append(self, entry):
+    self.extend([entry])
+
+  def extend(self, roidb):
+    """Append the entries of a list of roidb dicts or of a ColumnarRoidb."""
+    if not isinstance(roidb, ColumnarRoidb):
+      roidb = self._columns_from_list(roidb)
+    if len(roidb) == 0:
+      return
+    num_images = len(self)
+    num_boxes = self.num_boxes
+    self._offsets = np.concatenate((self._offsets[:-1],
+                                    roidb._offsets + num_boxes))
+    self._box_columns = self._concat_columns(
+      self._box_columns, roidb._box_columns, num_boxes, roidb.num_boxes)
+    self._image_columns = self._concat_columns(
+      self._image_columns, roidb._image_columns, num_images, len(roidb))
+    self._overlaps = scipy.sparse.vstack(
+      [self._overlaps, roidb._overlaps], format='csr', dtype=np.float32)
+    for i, extra in roidb._extra.items():
+      self._extra[num_images + i] = extra
+
+  @staticmethod
+  def _concat_columns(columns, other, size, other_size):
+    concat = {}
+    for key in set(columns) | set(other):
+      ref = columns[key] if key in columns else other[key]
+      a = columns.get(key, np.zeros((size,) + ref.shape[1:], dtype=ref.dtype))
+      b = other.get(key, np.zeros((other_size,) + ref.shape[1:],
+                                  dtype=ref.dtype))
+      concat[key] = np.concatenate((a, b))
+    return concat
+
+  def _columns_from_list(self, roidb):
+    columnar = ColumnarRoidb(self._num_classes)
+    if len(roidb) == 0:
+      return columnar
+    counts = [len(entry['boxes']) for entry in roidb]
+    columnar._offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    columnar._overlaps = scipy.sparse.vstack(
+      [entry['gt_overlaps'] for entry in roidb], format='csr', dtype=np.float32)
+    for key in roidb[0].keys():
+      if key == 'gt_overlaps':
+        continue
+      values = [entry[key] for entry in roidb]
+      if key in PER_IMAGE_KEYS:
+        columnar._image_columns[key] = np.array(values)
+      elif isinstance(values[0], np.ndarray) and len(values[0]) == counts[0]:
+        columnar._box_columns[key] = np.concatenate(values)
+      else:
+        for i, value in enumerate(values):
+          columnar._extra.setdefault(i, {})[key] = value
+    return columnar
+
+  def take(self, inds):
+    """Return a new columnar roidb made of the images inds."""
+    inds = np.asarray(inds, dtype=np.int64)
+    starts = self._offsets[inds]
+    counts = self._offsets[inds + 1] - starts
+    rows = (np.repeat(starts - np.cumsum(counts) + counts, counts) +
+            np.arange(counts.sum(), dtype=np.int64))
+    taken = ColumnarRoidb(self._num_classes)
+    taken._offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    taken._box_columns = dict((key, column[rows])
+                              for key, column in self._box_columns.items())
+    taken._image_columns = dict((key, column[inds])
+                                for key, column in self._image_columns.items())
+    taken._overlaps = self._overlaps[rows]
+    for j, i in enumerate(inds):
+      if i in self._extra:
+        taken._extra[j] = self._extra[i]
+    return taken
+
+  def save(self, cache_dir):
+    """Save the columns as .npy files under cache_dir."""
+    assert not self._extra, 'Only array fields can be saved'
+    if not osp.exists(cache_dir):
+      os.makedirs(cache_dir)
+    arrays = {'offsets': self._offsets,
+              'num_classes': np.array([self._num_classes])}
+    for part in OVERLAP_PARTS:
+      arrays['overlaps.' + part] = getattr(self._overlaps, part)
+    for key, column in self._box_columns.items():
+      arrays['box.' + key] = column
+    for key, column in self._image_columns.items():
+      arrays['image.' + key] = column
+    for name, array in arrays.items():
+      np.save(osp.join(cache_dir, name + '.npy'), array)
+
+  @classmethod
+  def load(cls, cache_dir, mmap_mode='r'):
+    """Load a columnar roidb saved with save, memory-mapping its columns."""
+    arrays = {}
+    for filename in os.listdir(cache_dir):
+      if filename.endswith('.npy'):
+        arrays[filename[:-len('.npy')]] = np.load(
+          osp.join(cache_dir, filename), mmap_mode=mmap_mode)
+    roidb = cls(int(arrays.pop('num_classes')[0]))
+    roidb._offsets = arrays.pop('offsets')
+    roidb._overlaps = scipy.sparse.csr_matrix(
+      tuple(arrays.pop('overlaps.' + part) for part in OVERLAP_PARTS),
+      shape=(int(roidb._offsets[-1]), roidb._num_classes))
+    for name, array in arrays.items():
+      kind, key = name.split('.', 1)
+      if kind == 'box':
+        roidb._box_columns[key] = array
+      else:
+        roidb._image_columns[key] = array
+    return roidb
+
+  @staticmethod
+  def exists(cache_dir):
+    return osp.exists(osp.join(cache_dir, 'offsets.npy'))
@@ -0,0 +1,63 @@
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Index of image sizes, cached on disk and invalidated by file mtime."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+from multiprocessing.pool import ThreadPool
+import PIL.Image
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+
+# Header reads are I/O bound, threads are enough to overlap them
+NUM_THREADS = 16
+
+
+def _probe(args):
+  path, cached = args
+  mtime = os.path.getmtime(path)
+  if cached is not None and cached[0] == mtime:
+    return cached
+  # Opening an image only parses its header, the pixels are not decoded
+  with PIL.Image.open(path) as im:
+    return mtime, im.size
+
+
+def get_image_sizes(paths, cache_file):
+  """Return the (width, height) of each image of paths.
+
+  Sizes are read from cache_file when the image has not been modified since
+  they were recorded, and probed in parallel otherwise.
+  """
+  index = {}
+  if os.path.exists(cache_file):
+    with open(cache_file, 'rb') as f:
+      index = pickle.load(f)
+
+  unique_paths = list(set(paths))
+  pool = ThreadPool(NUM_THREADS)
+  try:
+    entries = pool.map(_probe, [(path, index.get(path))
+                                for path in unique_paths])
+  finally:
+    pool.close()
+    pool.join()
+
+  updated = dict(zip(unique_paths, entries))
+  if any(index.get(path) != entry for path, entry in updated.items()):
+    index.update(updated)
+    # Write then rename, so that a concurrent run never reads a partial file
+    tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    with open(tmp_file, 'wb') as f:
+      pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_file, cache_file)
+    print('wrote image sizes to {}'.format(cache_file))
+
+  return [updated[path][1] for path in paths]
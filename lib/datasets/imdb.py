@@ -10,8 +10,9 @@ from __future__ import print_function
 
 import os
 import os.path as osp
-import PIL
-from utils.bbox import bbox_overlaps
+from utils.bbox import bbox_overlaps, bbox_overlaps_max
+from datasets.columnar_roidb import ColumnarRoidb
+from datasets.image_sizes import get_image_sizes
 import numpy as np
 import scipy.sparse
 from model.config import cfg
@@ -31,6 +32,7 @@ class imdb(object):
     self._obj_proposer = 'gt'
     self._roidb = None
     self._roidb_handler = self.default_roidb
+    self._image_sizes = None
     # Use this dict for storing dataset specific config options
     self.config = {}
 
@@ -88,9 +90,37 @@ class imdb(object):
   def image_path_at(self, i):
     raise NotImplementedError
 
+  def image_size_at(self, i):
+    """Return the (width, height) of image i.
+
+    Sizes of all the images are loaded at once from an index cached next to
+    the gt roidb.
+    """
+    if self._image_sizes is None or len(self._image_sizes) != self.num_images:
+      cache_file = osp.join(self.cache_path, self.name + '_image_sizes.pkl')
+      self._image_sizes = get_image_sizes(
+        [self.image_path_at(j) for j in range(self.num_images)], cache_file)
+    return self._image_sizes[i]
+
   def default_roidb(self):
     raise NotImplementedError
 
+  def _columnar_gt_roidb(self, load_gt_roidb):
+    """Return the gt roidb as a ColumnarRoidb memory-mapped from the cache.
+
+    load_gt_roidb builds the list-of-dicts gt roidb on a cache miss.
+    """
+    cache_dir = osp.join(self.cache_path, self.name + '_gt_roidb')
+    if ColumnarRoidb.exists(cache_dir):
+      roidb = ColumnarRoidb.load(cache_dir)
+      print('{} gt roidb loaded from {}'.format(self.name, cache_dir))
+      return roidb
+
+    roidb = ColumnarRoidb.from_list(load_gt_roidb(), self.num_classes)
+    roidb.save(cache_dir)
+    print('wrote gt roidb to {}'.format(cache_dir))
+    return ColumnarRoidb.load(cache_dir)
+
   def evaluate_detections(self, all_boxes, output_dir=None):
     """
     all_boxes is a list of length number-of-classes.
@@ -103,12 +133,12 @@ class imdb(object):
     raise NotImplementedError
 
   def _get_widths(self):
-    return [PIL.Image.open(self.image_path_at(i)).size[0]
-            for i in range(self.num_images)]
+    return [self.image_size_at(i)[0] for i in range(self.num_images)]
 
   def append_flipped_images(self):
     num_images = self.num_images
     widths = self._get_widths()
+    entries = []
     for i in range(num_images):
       boxes = self.roidb[i]['boxes'].copy()
       oldx1 = boxes[:, 0].copy()
@@ -120,7 +150,9 @@ class imdb(object):
                'gt_overlaps': self.roidb[i]['gt_overlaps'],
                'gt_classes': self.roidb[i]['gt_classes'],
                'flipped': True}
-      self.roidb.append(entry)
+      entries.append(entry)
+    # Append all at once, a columnar roidb concatenates its arrays on extend
+    self.roidb.extend(entries)
     self._image_index = self._image_index * 2
 
   def evaluate_recall(self, candidate_boxes=None, thresholds=None,
@@ -176,8 +208,8 @@ class imdb(object):
       if limit is not None and boxes.shape[0] > limit:
         boxes = boxes[:limit, :]
 
-      overlaps = bbox_overlaps(boxes.astype(np.float),
-                               gt_boxes.astype(np.float))
+      overlaps = bbox_overlaps(boxes.astype(np.float32),
+                               gt_boxes.astype(np.float32))
 
       _gt_overlaps = np.zeros((gt_boxes.shape[0]))
       for j in range(gt_boxes.shape[0]):
@@ -225,10 +257,8 @@ class imdb(object):
       if gt_roidb is not None and gt_roidb[i]['boxes'].size > 0:
         gt_boxes = gt_roidb[i]['boxes']
         gt_classes = gt_roidb[i]['gt_classes']
-        gt_overlaps = bbox_overlaps(boxes.astype(np.float),
-                                    gt_boxes.astype(np.float))
-        argmaxes = gt_overlaps.argmax(axis=1)
-        maxes = gt_overlaps.max(axis=1)
+        maxes, argmaxes = bbox_overlaps_max(boxes.astype(np.float32),
+                                            gt_boxes.astype(np.float32))
         I = np.where(maxes > 0)[0]
         overlaps[I, gt_classes[argmaxes[I]]] = maxes[I]
 
@@ -245,6 +275,8 @@ class imdb(object):
   @staticmethod
   def merge_roidbs(a, b):
     assert len(a) == len(b)
+    if isinstance(a, ColumnarRoidb):
+      return ColumnarRoidb.from_list(imdb.merge_roidbs(a.to_list(), b))
     for i in range(len(a)):
       a[i]['boxes'] = np.vstack((a[i]['boxes'], b[i]['boxes']))
       a[i]['gt_classes'] = np.hstack((a[i]['gt_classes'],
@@ -18,10 +18,55 @@ import scipy.io as sio
 import pickle
 import subprocess
 import uuid
+from multiprocessing import Pool, cpu_count
 from .voc_eval import voc_eval
 from model.config import cfg
 
 
+def _parse_pascal_annotation(args):
+  """Parse the PASCAL VOC XML file filename into a roidb entry."""
+  filename, class_to_ind, num_classes, use_diff = args
+  tree = ET.parse(filename)
+  objs = tree.findall('object')
+  if not use_diff:
+    # Exclude the samples labeled as difficult
+    non_diff_objs = [
+      obj for obj in objs if int(obj.find('difficult').text) == 0]
+    # if len(non_diff_objs) != len(objs):
+    #     print 'Removed {} difficult objects'.format(
+    #         len(objs) - len(non_diff_objs))
+    objs = non_diff_objs
+  num_objs = len(objs)
+
+  boxes = np.zeros((num_objs, 4), dtype=np.uint16)
+  gt_classes = np.zeros((num_objs), dtype=np.int32)
+  overlaps = np.zeros((num_objs, num_classes), dtype=np.float32)
+  # "Seg" area for pascal is just the box area
+  seg_areas = np.zeros((num_objs), dtype=np.float32)
+
+  # Load object bounding boxes into a data frame.
+  for ix, obj in enumerate(objs):
+    bbox = obj.find('bndbox')
+    # Make pixel indexes 0-based
+    x1 = float(bbox.find('xmin').text) - 1
+    y1 = float(bbox.find('ymin').text) - 1
+    x2 = float(bbox.find('xmax').text) - 1
+    y2 = float(bbox.find('ymax').text) - 1
+    cls = class_to_ind[obj.find('name').text.lower().strip()]
+    boxes[ix, :] = [x1, y1, x2, y2]
+    gt_classes[ix] = cls
+    overlaps[ix, cls] = 1.0
+    seg_areas[ix] = (x2 - x1 + 1) * (y2 - y1 + 1)
+
+  overlaps = scipy.sparse.csr_matrix(overlaps)
+
+  return {'boxes': boxes,
+          'gt_classes': gt_classes,
+          'gt_overlaps': overlaps,
+          'flipped': False,
+          'seg_areas': seg_areas}
+
+
 class pascal_voc(imdb):
   def __init__(self, image_set, year, use_diff=False):
     name = 'voc_' + year + '_' + image_set
@@ -101,23 +146,10 @@ class pascal_voc(imdb):
 
     This function loads/saves from/to a cache file to speed up future calls.
     """
-    cache_file = os.path.join(self.cache_path, self.name + '_gt_roidb.pkl')
-    if os.path.exists(cache_file):
-      with open(cache_file, 'rb') as fid:
-        try:
-          roidb = pickle.load(fid)
-        except:
-          roidb = pickle.load(fid, encoding='bytes')
-      print('{} gt roidb loaded from {}'.format(self.name, cache_file))
-      return roidb
+    if cfg.COLUMNAR_ROIDB:
+      return self._columnar_gt_roidb(self._load_pascal_annotations)
 
-    gt_roidb = [self._load_pascal_annotation(index)
-                for index in self.image_index]
-    with open(cache_file, 'wb') as fid:
-      pickle.dump(gt_roidb, fid, pickle.HIGHEST_PROTOCOL)
-    print('wrote gt roidb to {}'.format(cache_file))
-
-    return gt_roidb
+    return self._load_pascal_annotations()
 
   def rpn_roidb(self):
     if int(self._year) == 2007 or self._image_set != 'test':
@@ -138,51 +170,61 @@ class pascal_voc(imdb):
       box_list = pickle.load(f)
     return self.create_roidb_from_box_list(box_list, gt_roidb)
 
+  def _annotation_path(self, index):
+    return os.path.join(self._data_path, 'Annotations', index + '.xml')
+
+  def _load_pascal_annotations(self):
+    """
+    Load the annotations of all the images.
+
+    Parsed annotations are cached per XML file along with its mtime, so that
+    only new or modified files are parsed, in a pool of processes.
+    """
+    # The cache is shared by all the image sets of a year
+    cache_name = 'voc_' + self._year + ('_diff' if self.config['use_diff'] else '')
+    cache_file = os.path.join(self.cache_path,
+                              cache_name + '_annotations.pkl')
+    cache = {}
+    if os.path.exists(cache_file):
+      with open(cache_file, 'rb') as fid:
+        cache = pickle.load(fid)
+
+    filenames = [self._annotation_path(index) for index in self.image_index]
+    mtimes = dict((f, os.path.getmtime(f)) for f in set(filenames))
+    stale = [f for f, mtime in mtimes.items()
+             if f not in cache or cache[f][0] != mtime]
+    if len(stale) > 0:
+      print('{} parsing {} of {} annotation files'.format(
+        self.name, len(stale), len(mtimes)))
+      jobs = [(f, self._class_to_ind, self.num_classes,
+               self.config['use_diff']) for f in stale]
+      pool = Pool(min(cpu_count(), len(jobs)))
+      try:
+        entries = pool.map(_parse_pascal_annotation, jobs, chunksize=64)
+      finally:
+        pool.close()
+        pool.join()
+      for f, entry in zip(stale, entries):
+        cache[f] = (mtimes[f], entry)
+      tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+      with open(tmp_file, 'wb') as fid:
+        pickle.dump(cache, fid, pickle.HIGHEST_PROTOCOL)
+      os.rename(tmp_file, cache_file)
+      print('wrote annotations to {}'.format(cache_file))
+    else:
+      print('{} annotations loaded from {}'.format(self.name, cache_file))
+
+    # Entries are copied, callers of gt_roidb may modify them in place
+    return [dict(cache[f][1]) for f in filenames]
+
   def _load_pascal_annotation(self, index):
     """
     Load image and bounding boxes info from XML file in the PASCAL VOC
     format.
     """
-    filename = os.path.join(self._data_path, 'Annotations', index + '.xml')
-    tree = ET.parse(filename)
-    objs = tree.findall('object')
-    if not self.config['use_diff']:
-      # Exclude the samples labeled as difficult
-      non_diff_objs = [
-        obj for obj in objs if int(obj.find('difficult').text) == 0]
-      # if len(non_diff_objs) != len(objs):
-      #     print 'Removed {} difficult objects'.format(
-      #         len(objs) - len(non_diff_objs))
-      objs = non_diff_objs
-    num_objs = len(objs)
-
-    boxes = np.zeros((num_objs, 4), dtype=np.uint16)
-    gt_classes = np.zeros((num_objs), dtype=np.int32)
-    overlaps = np.zeros((num_objs, self.num_classes), dtype=np.float32)
-    # "Seg" area for pascal is just the box area
-    seg_areas = np.zeros((num_objs), dtype=np.float32)
-
-    # Load object bounding boxes into a data frame.
-    for ix, obj in enumerate(objs):
-      bbox = obj.find('bndbox')
-      # Make pixel indexes 0-based
-      x1 = float(bbox.find('xmin').text) - 1
-      y1 = float(bbox.find('ymin').text) - 1
-      x2 = float(bbox.find('xmax').text) - 1
-      y2 = float(bbox.find('ymax').text) - 1
-      cls = self._class_to_ind[obj.find('name').text.lower().strip()]
-      boxes[ix, :] = [x1, y1, x2, y2]
-      gt_classes[ix] = cls
-      overlaps[ix, cls] = 1.0
-      seg_areas[ix] = (x2 - x1 + 1) * (y2 - y1 + 1)
-
-    overlaps = scipy.sparse.csr_matrix(overlaps)
-
-    return {'boxes': boxes,
-            'gt_classes': gt_classes,
-            'gt_overlaps': overlaps,
-            'flipped': False,
-            'seg_areas': seg_areas}
+    return _parse_pascal_annotation((self._annotation_path(index),
+                                     self._class_to_ind, self.num_classes,
+                                     self.config['use_diff']))
 
   def _get_comp_id(self):
     comp_id = (self._comp_id + '_' + self._salt if self.config['use_salt']
@@ -16,38 +16,76 @@ from utils.bbox import bbox_overlaps
 from model.bbox_transform import bbox_transform
 import torch
 
-def anchor_target_layer(rpn_cls_score, gt_boxes, im_info, _feat_stride, all_anchors, num_anchors):
+def anchor_target_layer(rpn_cls_score, gt_boxes, im_info, _feat_stride, all_anchors, num_anchors,
+                        inds_inside=None):
   """Same as the anchor target layer in original Fast/er RCNN """
-  A = num_anchors
+  # map of shape (..., H, W)
+  height, width = rpn_cls_score.shape[1:3]
+  return anchor_targets(height, width, gt_boxes, im_info, all_anchors, num_anchors,
+                        inds_inside)
+
+
+def anchor_targets(height, width, gt_boxes, im_info, all_anchors, num_anchors,
+                   inds_inside=None):
+  """Compute the anchor targets for a feature map of size (height, width).
+
+  Only needs numpy inputs, so that it can also run in the data layer.
+  inds_inside are the indices of the anchors inside the image, as given by
+  AnchorGrid.inds_inside, computed here if None.
+  """
+  return anchor_targets_sets(height, width, [gt_boxes], im_info, all_anchors,
+                             num_anchors, inds_inside)
+
+
+def anchor_targets_sets(height, width, gt_sets, im_info, all_anchors, num_anchors,
+                        inds_inside=None):
+  """Compute the anchor targets of several gt sets of the same image.
+
+  The inside anchors and their overlaps with the boxes of all the sets are
+  computed once. The targets of the sets are stacked along the first axis,
+  in the order of gt_sets.
+  """
   total_anchors = all_anchors.shape[0]
-  K = total_anchors / num_anchors
 
   # allow boxes to sit over the edge by a small amount
   _allowed_border = 0
 
-  # map of shape (..., H, W)
-  height, width = rpn_cls_score.shape[1:3]
-
   # only keep anchors inside the image
-  inds_inside = np.where(
-    (all_anchors[:, 0] >= -_allowed_border) &
-    (all_anchors[:, 1] >= -_allowed_border) &
-    (all_anchors[:, 2] < im_info[1] + _allowed_border) &  # width
-    (all_anchors[:, 3] < im_info[0] + _allowed_border)  # height
-  )[0]
+  if inds_inside is None:
+    inds_inside = np.where(
+      (all_anchors[:, 0] >= -_allowed_border) &
+      (all_anchors[:, 1] >= -_allowed_border) &
+      (all_anchors[:, 2] < im_info[1] + _allowed_border) &  # width
+      (all_anchors[:, 3] < im_info[0] + _allowed_border)  # height
+    )[0]
 
   # keep only inside anchors
   anchors = all_anchors[inds_inside, :]
 
+  # overlaps between the anchors and the gt boxes of all the sets
+  # overlaps (ex, gt)
+  overlaps = bbox_overlaps(
+    np.ascontiguousarray(anchors, dtype=np.float32),
+    np.ascontiguousarray(np.concatenate(gt_sets)[:, :4], dtype=np.float32))
+  offsets = np.cumsum([0] + [len(gt_boxes) for gt_boxes in gt_sets])
+
+  set_targets = [_gt_set_targets(height, width, anchors, inds_inside, total_anchors, num_anchors,
+                                 gt_boxes, overlaps[:, offsets[i]:offsets[i + 1]])
+                 for i, gt_boxes in enumerate(gt_sets)]
+  if len(set_targets) == 1:
+    return set_targets[0]
+  return tuple(np.concatenate(targets) for targets in zip(*set_targets))
+
+
+def _gt_set_targets(height, width, anchors, inds_inside, total_anchors, num_anchors,
+                    gt_boxes, overlaps):
+  """The anchor targets of one gt set, given its overlaps with the inside anchors."""
+  A = num_anchors
+
   # label: 1 is positive, 0 is negative, -1 is dont care
   labels = np.empty((len(inds_inside),), dtype=np.float32)
   labels.fill(-1)
 
-  # overlaps between the anchors and the gt boxes
-  # overlaps (ex, gt)
-  overlaps = bbox_overlaps(
-    np.ascontiguousarray(anchors, dtype=np.float),
-    np.ascontiguousarray(gt_boxes, dtype=np.float))
   argmax_overlaps = overlaps.argmax(axis=1)
   max_overlaps = overlaps[np.arange(len(inds_inside)), argmax_overlaps]
   gt_argmax_overlaps = overlaps.argmax(axis=0)
@@ -160,4 +198,127 @@ def _compute_targets(ex_rois, gt_rois):
   assert ex_rois.shape[1] == 4
   assert gt_rois.shape[1] == 5
 
-  return bbox_transform(torch.from_numpy(ex_rois), torch.from_numpy(gt_rois[:, :4])).numpy()
\ No newline at end of file
+  return bbox_transform(torch.from_numpy(ex_rois), torch.from_numpy(gt_rois[:, :4])).numpy()
+
+
+def anchor_targets_torch(height, width, gt_boxes, im_info, all_anchors, num_anchors,
+                         inds_inside=None):
+  """Torch version of anchor_targets, on the device of all_anchors.
+
+  gt_boxes and all_anchors are tensors, inds_inside a LongTensor on the same
+  device if given. The math is float32 and the fg/bg subsampling uses the
+  torch RNG; without subsampling, the targets equal those of anchor_targets.
+  The inside values are written straight into the full size outputs.
+  """
+  return anchor_targets_torch_sets(height, width, [gt_boxes], im_info, all_anchors,
+                                   num_anchors, inds_inside)
+
+
+def anchor_targets_torch_sets(height, width, gt_sets, im_info, all_anchors, num_anchors,
+                              inds_inside=None, sparse=False):
+  """Torch version of anchor_targets_sets, on the device of all_anchors.
+
+  If sparse, only the anchors sampled for the loss are kept: a list with, for
+  each gt set, their indices in all_anchors, labels, bbox targets, and inside
+  and outside weights, instead of the dense maps.
+  """
+  total_anchors = all_anchors.size(0)
+  if inds_inside is None:
+    inds_inside = ((all_anchors[:, 0] >= 0) &
+                   (all_anchors[:, 1] >= 0) &
+                   (all_anchors[:, 2] < float(im_info[1])) &  # width
+                   (all_anchors[:, 3] < float(im_info[0]))  # height
+                   ).nonzero().view(-1)
+  anchors = all_anchors[inds_inside]
+
+  # overlaps (ex, gt) with the gt boxes of all the sets
+  gt_sets = [gt_boxes.float() for gt_boxes in gt_sets]
+  overlaps = bbox_overlaps(anchors, torch.cat(gt_sets, 0)[:, :4])
+  set_overlaps = overlaps.split([gt_boxes.size(0) for gt_boxes in gt_sets], 1)
+
+  set_targets = [_gt_set_targets_torch(height, width, anchors, inds_inside, total_anchors, num_anchors,
+                                       gt_boxes, set_overlaps[i], sparse)
+                 for i, gt_boxes in enumerate(gt_sets)]
+  if sparse:
+    return set_targets
+  if len(set_targets) == 1:
+    return set_targets[0]
+  return tuple(torch.cat(targets, 0) for targets in zip(*set_targets))
+
+
+def _gt_set_targets_torch(height, width, anchors, inds_inside, total_anchors, num_anchors,
+                          gt_boxes, overlaps, sparse=False):
+  """Torch version of _gt_set_targets, or its sampled anchors only if sparse."""
+  A = num_anchors
+  max_overlaps, _ = overlaps.max(1)
+  # First gt reaching the max, like np.argmax
+  gt_range = torch.arange(gt_boxes.size(0), dtype=torch.long, device=overlaps.device)
+  argmax_overlaps = torch.where(overlaps == max_overlaps.unsqueeze(1), gt_range,
+                                gt_range.new_full((1,), gt_boxes.size(0))).min(1)[0]
+  gt_max_overlaps, _ = overlaps.max(0)
+  is_gt_argmax = (overlaps == gt_max_overlaps.unsqueeze(0)).any(1)
+
+  # label: 1 is positive, 0 is negative, -1 is dont care
+  labels = anchors.new_full((anchors.size(0),), -1)
+  negative = max_overlaps < cfg.TRAIN.RPN_NEGATIVE_OVERLAP
+  if not cfg.TRAIN.RPN_CLOBBER_POSITIVES:
+    labels[negative] = 0
+  labels[is_gt_argmax] = 1
+  labels[max_overlaps >= cfg.TRAIN.RPN_POSITIVE_OVERLAP] = 1
+  if cfg.TRAIN.RPN_CLOBBER_POSITIVES:
+    labels[negative] = 0
+
+  # subsample positive labels if we have too many
+  num_fg = int(cfg.TRAIN.RPN_FG_FRACTION * cfg.TRAIN.RPN_BATCHSIZE)
+  fg_inds = (labels == 1).nonzero().view(-1)
+  if fg_inds.numel() > num_fg:
+    disable = torch.randperm(fg_inds.numel(), device=labels.device)[:fg_inds.numel() - num_fg]
+    labels[fg_inds[disable]] = -1
+
+  # subsample negative labels if we have too many
+  num_bg = cfg.TRAIN.RPN_BATCHSIZE - int((labels == 1).sum())
+  bg_inds = (labels == 0).nonzero().view(-1)
+  if bg_inds.numel() > num_bg:
+    disable = torch.randperm(bg_inds.numel(), device=labels.device)[:bg_inds.numel() - num_bg]
+    labels[bg_inds[disable]] = -1
+
+  positive = labels == 1
+  negative = labels == 0
+  if cfg.TRAIN.RPN_POSITIVE_WEIGHT < 0:
+    # uniform weighting of examples (given non-uniform sampling)
+    positive_weight = negative_weight = 1.0 / float((labels >= 0).sum())
+  else:
+    assert ((cfg.TRAIN.RPN_POSITIVE_WEIGHT > 0) &
+            (cfg.TRAIN.RPN_POSITIVE_WEIGHT < 1))
+    positive_weight = cfg.TRAIN.RPN_POSITIVE_WEIGHT / float(positive.sum())
+    negative_weight = (1.0 - cfg.TRAIN.RPN_POSITIVE_WEIGHT) / float(negative.sum())
+
+  if sparse:
+    sampled = (labels >= 0).nonzero().view(-1)
+    labels = labels[sampled]
+    positive = labels == 1
+    bbox_targets = bbox_transform(anchors[sampled], gt_boxes[argmax_overlaps[sampled], :4])
+    bbox_inside_weights = anchors.new_zeros((sampled.numel(), 4))
+    bbox_inside_weights[positive] = anchors.new_tensor(cfg.TRAIN.RPN_BBOX_INSIDE_WEIGHTS)
+    bbox_outside_weights = anchors.new_full((sampled.numel(), 4), negative_weight)
+    bbox_outside_weights[positive] = positive_weight
+    return inds_inside[sampled], labels, bbox_targets, bbox_inside_weights, bbox_outside_weights
+
+  # Outputs over all the anchors, only the inside rows are written
+  rpn_labels = anchors.new_full((total_anchors,), -1)
+  rpn_labels[inds_inside] = labels
+  rpn_bbox_targets = anchors.new_zeros((total_anchors, 4))
+  rpn_bbox_targets[inds_inside] = bbox_transform(anchors, gt_boxes[argmax_overlaps, :4])
+  rpn_bbox_inside_weights = anchors.new_zeros((total_anchors, 4))
+  rpn_bbox_inside_weights[inds_inside[positive]] = \
+    anchors.new_tensor(cfg.TRAIN.RPN_BBOX_INSIDE_WEIGHTS)
+  rpn_bbox_outside_weights = anchors.new_zeros((total_anchors, 4))
+  rpn_bbox_outside_weights[inds_inside[positive]] = positive_weight
+  rpn_bbox_outside_weights[inds_inside[negative]] = negative_weight
+
+  rpn_labels = rpn_labels.view(1, height, width, A).permute(0, 3, 1, 2) \
+    .contiguous().view(1, 1, A * height, width)
+  rpn_bbox_targets = rpn_bbox_targets.view(1, height, width, A * 4)
+  rpn_bbox_inside_weights = rpn_bbox_inside_weights.view(1, height, width, A * 4)
+  rpn_bbox_outside_weights = rpn_bbox_outside_weights.view(1, height, width, A * 4)
+  return rpn_labels, rpn_bbox_targets, rpn_bbox_inside_weights, rpn_bbox_outside_weights
@@ -14,9 +14,11 @@ from model.nms_wrapper import nms
 
 import torch
 
-def proposal_layer(rpn_cls_prob, rpn_bbox_pred, im_info, cfg_key, _feat_stride, anchors, num_anchors):
+def proposal_layer(rpn_cls_prob, rpn_bbox_pred, im_info, cfg_key, _feat_stride, anchors, num_anchors,
+                   anchor_geometry=None):
   """A simplified version compared to fast/er RCNN
      For details please see the technical report
+     anchor_geometry is the geometry of an AnchorGrid, to reuse
   """
   if type(cfg_key) == bytes:
       cfg_key = cfg_key.decode('utf-8')
@@ -27,17 +29,19 @@ def proposal_layer(rpn_cls_prob, rpn_bbox_pred, im_info, cfg_key, _feat_stride,
   # Get the scores and bounding boxes
   scores = rpn_cls_prob[:, :, :, num_anchors:]
   rpn_bbox_pred = rpn_bbox_pred.view((-1, 4))
-  scores = scores.contiguous().view(-1, 1)
-  proposals = bbox_transform_inv(anchors, rpn_bbox_pred)
+  scores = scores.contiguous().view(-1)
+
+  # Pick the top region proposals, only those are decoded
+  if 0 < pre_nms_topN < scores.numel():
+    scores, order = scores.topk(pre_nms_topN)
+  else:
+    scores, order = scores.sort(descending=True)
+  scores = scores.view(-1, 1)
+  if anchor_geometry is not None:
+    anchor_geometry = [g[order] for g in anchor_geometry]
+  proposals = bbox_transform_inv(anchors[order], rpn_bbox_pred[order], anchor_geometry)
   proposals = clip_boxes(proposals, im_info[:2])
 
-  # Pick the top region proposals
-  scores, order = scores.view(-1).sort(descending=True)
-  if pre_nms_topN > 0:
-    order = order[:pre_nms_topN]
-    scores = scores[:pre_nms_topN].view(-1, 1)
-  proposals = proposals[order.data, :]
-
   # Non-maximal suppression
   keep = nms(torch.cat((proposals, scores), 1).data, nms_thresh)
 
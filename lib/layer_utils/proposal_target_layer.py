@@ -8,19 +8,84 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import numpy as np
-import numpy.random as npr
 from model.config import cfg
 from model.bbox_transform import bbox_transform
-from utils.bbox import bbox_overlaps
+from utils.bbox import bbox_overlaps_max
 
 
 import torch
 
-def proposal_target_layer(rpn_rois, rpn_scores, gt_boxes, _num_classes):
+# Generator of the RoI sampling on CPU, seeded with cfg.RNG_SEED on first use.
+_cpu_generator = None
+# States of the RoI sampling on CUDA, by device index. torch 0.4 has no CUDA
+# generator objects, so the state of a device is swapped into its default
+# generator around each draw, and the other users of that generator are not
+# affected. A state is seeded with cfg.RNG_SEED on first use.
+_cuda_states = {}
+
+
+def _get_cpu_generator():
+  global _cpu_generator
+  if _cpu_generator is None:
+    _cpu_generator = torch.Generator()
+    _cpu_generator.manual_seed(cfg.RNG_SEED)
+  return _cpu_generator
+
+
+def _get_cuda_state(device):
+  if device not in _cuda_states:
+    default_state = torch.cuda.get_rng_state(device)
+    with torch.cuda.device(device):
+      torch.cuda.manual_seed(cfg.RNG_SEED)
+    _cuda_states[device] = torch.cuda.get_rng_state(device)
+    torch.cuda.set_rng_state(default_state, device)
+  return _cuda_states[device]
+
+
+def get_sampling_rng_state():
+  """State of the generators of the RoI sampling, to store in snapshots."""
+  return {'cpu': _get_cpu_generator().get_state(),
+          'cuda': dict(_cuda_states)}
+
+
+def set_sampling_rng_state(state):
+  """Restore a state returned by get_sampling_rng_state."""
+  _get_cpu_generator().set_state(state['cpu'])
+  _cuda_states.clear()
+  if isinstance(state['cuda'], dict):
+    _cuda_states.update(state['cuda'])
+  elif state['cuda'] is not None and torch.cuda.is_available():
+    # Snapshots of before the per-device states hold the default generator
+    # state of the current device
+    _cuda_states[torch.cuda.current_device()] = state['cuda']
+
+
+def _choice(inds, size, replace):
+  """Sample size elements of the tensor inds, on its device."""
+  kwargs = {'device': inds.device}
+  if inds.is_cuda:
+    device = inds.get_device()
+    default_state = torch.cuda.get_rng_state(device)
+    torch.cuda.set_rng_state(_get_cuda_state(device), device)
+  else:
+    kwargs['generator'] = _get_cpu_generator()
+  if replace:
+    picks = torch.randint(inds.numel(), (size,), dtype=torch.long, **kwargs)
+  else:
+    picks = torch.randperm(inds.numel(), **kwargs)[:size]
+  if inds.is_cuda:
+    _cuda_states[device] = torch.cuda.get_rng_state(device)
+    torch.cuda.set_rng_state(default_state, device)
+  return inds[picks]
+
+
+def proposal_target_layer(rpn_rois, rpn_scores, gt_boxes, _num_classes, num_images=1):
   """
   Assign object detection proposals to ground-truth targets. Produces proposal
   classification labels and bounding-box regression targets.
+
+  The proposals and gt boxes are those of one image of a minibatch of
+  num_images images, among which cfg.TRAIN.BATCH_SIZE RoIs are split.
   """
 
   # Proposal ROIs (0, x1, y1, x2, y2) coming from RPN
@@ -37,7 +102,6 @@ def proposal_target_layer(rpn_rois, rpn_scores, gt_boxes, _num_classes):
     # not sure if it a wise appending, but anyway i am not using it
     all_scores = torch.cat((all_scores, zeros), 0)
 
-  num_images = 1
   rois_per_image = cfg.TRAIN.BATCH_SIZE / num_images
   fg_rois_per_image = int(round(cfg.TRAIN.FG_FRACTION * rois_per_image))
 
@@ -105,11 +169,10 @@ def _sample_rois(all_rois, all_scores, gt_boxes, fg_rois_per_image, rois_per_ima
   """Generate a random sample of RoIs comprising foreground and background
   examples.
   """
-  # overlaps: (rois x gt_boxes)
-  overlaps = bbox_overlaps(
+  # max overlaps of the rois with the gt boxes, without the (rois x gt_boxes) matrix
+  max_overlaps, gt_assignment = bbox_overlaps_max(
     all_rois[:, 1:5].data,
     gt_boxes[:, :4].data)
-  max_overlaps, gt_assignment = overlaps.max(1)
   labels = gt_boxes[gt_assignment, [4]]
 
   # Select foreground RoIs as those with >= FG_THRESH overlap
@@ -119,23 +182,27 @@ def _sample_rois(all_rois, all_scores, gt_boxes, fg_rois_per_image, rois_per_ima
   bg_inds = ((max_overlaps < cfg.TRAIN.BG_THRESH_HI) + (max_overlaps >= cfg.TRAIN.BG_THRESH_LO) == 2).nonzero().view(-1)
 
   # Small modification to the original version where we ensure a fixed number of regions are sampled
+  rois_per_image = int(rois_per_image)
   if fg_inds.numel() > 0 and bg_inds.numel() > 0:
     fg_rois_per_image = min(fg_rois_per_image, fg_inds.numel())
-    fg_inds = fg_inds[torch.from_numpy(npr.choice(np.arange(0, fg_inds.numel()), size=int(fg_rois_per_image), replace=False)).long().to(gt_boxes.device)]
+    fg_inds = _choice(fg_inds, fg_rois_per_image, replace=False)
     bg_rois_per_image = rois_per_image - fg_rois_per_image
-    to_replace = bg_inds.numel() < bg_rois_per_image
-    bg_inds = bg_inds[torch.from_numpy(npr.choice(np.arange(0, bg_inds.numel()), size=int(bg_rois_per_image), replace=to_replace)).long().to(gt_boxes.device)]
+    bg_inds = _choice(bg_inds, bg_rois_per_image, replace=bg_inds.numel() < bg_rois_per_image)
   elif fg_inds.numel() > 0:
-    to_replace = fg_inds.numel() < rois_per_image
-    fg_inds = fg_inds[torch.from_numpy(npr.choice(np.arange(0, fg_inds.numel()), size=int(rois_per_image), replace=to_replace)).long().to(gt_boxes.device)]
+    fg_inds = _choice(fg_inds, rois_per_image, replace=fg_inds.numel() < rois_per_image)
     fg_rois_per_image = rois_per_image
   elif bg_inds.numel() > 0:
-    to_replace = bg_inds.numel() < rois_per_image
-    bg_inds = bg_inds[torch.from_numpy(npr.choice(np.arange(0, bg_inds.numel()), size=int(rois_per_image), replace=to_replace)).long().to(gt_boxes.device)]
+    bg_inds = _choice(bg_inds, rois_per_image, replace=bg_inds.numel() < rois_per_image)
     fg_rois_per_image = 0
   else:
-    import pdb
-    pdb.set_trace()
+    # No RoI is in the fg or bg overlap ranges, use the first ones as
+    # background, cycling over them if there are too few
+    fg_inds = max_overlaps.new_zeros(0).long()
+    if max_overlaps.numel() > 0:
+      bg_inds = torch.arange(rois_per_image, device=max_overlaps.device).long() % max_overlaps.numel()
+    else:
+      bg_inds = fg_inds
+    fg_rois_per_image = 0
 
   # The indices that we're selecting (both fg and bg)
   keep_inds = torch.cat([fg_inds, bg_inds], 0)
@@ -14,10 +14,12 @@ import numpy.random as npr
 
 import torch
 
-def proposal_top_layer(rpn_cls_prob, rpn_bbox_pred, im_info, _feat_stride, anchors, num_anchors):
+def proposal_top_layer(rpn_cls_prob, rpn_bbox_pred, im_info, _feat_stride, anchors, num_anchors,
+                       anchor_geometry=None):
   """A layer that just selects the top region proposals
      without using non-maximal suppression,
      For details please see the technical report
+     anchor_geometry is the geometry of an AnchorGrid, to reuse
   """
   rpn_top_n = cfg.TEST.RPN_TOP_N
 
@@ -32,17 +34,17 @@ def proposal_top_layer(rpn_cls_prob, rpn_bbox_pred, im_info, _feat_stride, ancho
     # But such case rarely happens
     top_inds = torch.from_numpy(npr.choice(length, size=rpn_top_n, replace=True)).long().to(anchors.device)
   else:
-    top_inds = scores.sort(0, descending=True)[1]
-    top_inds = top_inds[:rpn_top_n]
-    top_inds = top_inds.view(rpn_top_n)
+    top_inds = scores.view(-1).topk(rpn_top_n)[1]
 
   # Do the selection here
   anchors = anchors[top_inds, :].contiguous()
+  if anchor_geometry is not None:
+    anchor_geometry = [g[top_inds] for g in anchor_geometry]
   rpn_bbox_pred = rpn_bbox_pred[top_inds, :].contiguous()
   scores = scores[top_inds].contiguous()
 
   # Convert anchors into proposals via bbox transformations
-  proposals = bbox_transform_inv(anchors, rpn_bbox_pred)
+  proposals = bbox_transform_inv(anchors, rpn_bbox_pred, anchor_geometry)
 
   # Clip predicted boxes to image
   proposals = clip_boxes(proposals, im_info[:2])
@@ -4,7 +4,17 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Function
 
-from ._ext import crop_and_resize as _backend
+try:
+    # Torch C++ extension, built by setup.py
+    from . import _crop_and_resize_cpu
+except ImportError:
+    _crop_and_resize_cpu = None
+
+try:
+    # Legacy ffi extension, needed by the CUDA implementation
+    from ._ext import crop_and_resize as _backend
+except ImportError:
+    _backend = None
 
 
 class CropAndResizeFunction(Function):
@@ -15,7 +25,7 @@ class CropAndResizeFunction(Function):
         self.extrapolation_value = extrapolation_value
 
     def forward(self, image, boxes, box_ind):
-        crops = torch.zeros_like(image)
+        crops = image.new_zeros((boxes.size(0), image.size(1), self.crop_height, self.crop_width))
 
         if image.is_cuda:
             _backend.crop_and_resize_gpu_forward(
@@ -50,6 +60,73 @@ class CropAndResizeFunction(Function):
         return grad_image, None, None
 
 
+class CropAndResizeCPUFunction(Function):
+    """Crop and resize on CPU through the C++ extension."""
+
+    @staticmethod
+    def forward(ctx, image, boxes, box_ind, crop_height, crop_width, extrapolation_value):
+        image = image.float().contiguous()
+        boxes = boxes.float().contiguous()
+        box_ind = box_ind.long().contiguous()
+        crops = image.new_empty((boxes.size(0), image.size(1), crop_height, crop_width))
+        _crop_and_resize_cpu.forward(image, boxes, box_ind, extrapolation_value, crops)
+        ctx.save_for_backward(boxes, box_ind)
+        ctx.im_size = image.size()
+        return crops
+
+    @staticmethod
+    def backward(ctx, grad_outputs):
+        boxes, box_ind = ctx.saved_tensors
+        grad_image = grad_outputs.new_zeros(ctx.im_size)
+        _crop_and_resize_cpu.backward(grad_outputs.float().contiguous(), boxes, box_ind, grad_image)
+        return grad_image, None, None, None, None, None
+
+
+class CropAndResizeMaxPoolCPUFunction(Function):
+    """Crop and resize to twice the pooled size then 2x2 max pool, fused, on CPU."""
+
+    @staticmethod
+    def forward(ctx, image, boxes, box_ind, pooled_height, pooled_width, extrapolation_value):
+        image = image.float().contiguous()
+        boxes = boxes.float().contiguous()
+        box_ind = box_ind.long().contiguous()
+        output = image.new_empty((boxes.size(0), image.size(1), pooled_height, pooled_width))
+        argmax = torch.empty(output.size(), dtype=torch.uint8)
+        _crop_and_resize_cpu.max_pool_forward(image, boxes, box_ind, extrapolation_value, output, argmax)
+        ctx.save_for_backward(boxes, box_ind, argmax)
+        ctx.im_size = image.size()
+        return output
+
+    @staticmethod
+    def backward(ctx, grad_outputs):
+        boxes, box_ind, argmax = ctx.saved_tensors
+        grad_image = grad_outputs.new_zeros(ctx.im_size)
+        _crop_and_resize_cpu.max_pool_backward(grad_outputs.float().contiguous(), argmax, boxes, box_ind,
+                                               grad_image)
+        return grad_image, None, None, None, None, None
+
+
+def crop_and_resize(image, boxes, box_ind, crop_height, crop_width, extrapolation_value=0):
+    """Crop and resize of NCHW image, trainable on CPU when the C++ extension is built."""
+    if image.is_cuda or _crop_and_resize_cpu is None:
+        return CropAndResizeFunction(crop_height, crop_width, extrapolation_value)(image, boxes, box_ind)
+    return CropAndResizeCPUFunction.apply(image, boxes, box_ind, int(crop_height), int(crop_width),
+                                          float(extrapolation_value))
+
+
+def crop_and_resize_max_pool(image, boxes, box_ind, pooled_height, pooled_width, extrapolation_value=0):
+    """Same as crop_and_resize to twice the pooled size followed by a 2x2 max pool.
+
+    On CPU, the crops are max pooled as they are computed, without storing them.
+    """
+    if image.is_cuda or _crop_and_resize_cpu is None:
+        crops = crop_and_resize(image, boxes, box_ind, 2 * pooled_height, 2 * pooled_width,
+                                extrapolation_value)
+        return F.max_pool2d(crops, 2, 2)
+    return CropAndResizeMaxPoolCPUFunction.apply(image, boxes, box_ind, int(pooled_height),
+                                                 int(pooled_width), float(extrapolation_value))
+
+
 class CropAndResize(nn.Module):
     """
     Crop and resize ported from tensorflow
@@ -64,7 +141,7 @@ class CropAndResize(nn.Module):
         self.extrapolation_value = extrapolation_value
 
     def forward(self, image, boxes, box_ind):
-        return CropAndResizeFunction(self.crop_height, self.crop_width, self.extrapolation_value)(image, boxes, box_ind)
+        return crop_and_resize(image, boxes, box_ind, self.crop_height, self.crop_width, self.extrapolation_value)
 
 
 if __name__ == "__main__":
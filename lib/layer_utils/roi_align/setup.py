@@ -0,0 +1,17 @@
+# Build the CPU crop and resize extension next to crop_and_resize.py:
+#   python setup.py build_ext --inplace
+from setuptools import setup
+from torch.utils.cpp_extension import BuildExtension, CppExtension
+
+setup(
+    name='crop_and_resize_cpu',
+    ext_modules=[
+        CppExtension(
+            '_crop_and_resize_cpu',
+            sources=['src/crop_and_resize_cpu.cpp'],
+            extra_compile_args=['-O3', '-fopenmp'],
+            extra_link_args=['-fopenmp'],
+        )
+    ],
+    cmdclass={'build_ext': BuildExtension}
+)
@@ -0,0 +1,274 @@
+// ------------------------------------------------------------------
+// Crop and resize (ported from tensorflow) as a torch C++ extension.
+//
+// Written against the C++ API of torch 0.4, the caller allocates the
+// outputs like for the ffi extensions. The forward passes are parallel over
+// (box, channel) pairs, the backward passes over channels, so that no two
+// threads accumulate into the same plane of the image gradient. A fused
+// variant max pools the crops 2x2 while computing them, and keeps which
+// sample won for the backward pass.
+// ------------------------------------------------------------------
+#include <torch/torch.h>
+
+#include <algorithm>
+#include <cmath>
+#include <cstdint>
+#include <limits>
+
+// AT_CHECK of torch 0.4 is TORCH_CHECK in later versions
+#ifndef AT_CHECK
+#define AT_CHECK TORCH_CHECK
+#endif
+
+namespace {
+
+// Bilinear sampling position of one crop pixel along one axis, -1 if it
+// falls outside of the image
+struct Sample {
+  int low;
+  int high;
+  float lerp;
+};
+
+inline Sample sample_at(float v1, float v2, int i, int crop_size, int image_size) {
+  const float in = (crop_size > 1)
+      ? v1 * (image_size - 1) + i * (v2 - v1) * (image_size - 1) / (crop_size - 1)
+      : 0.5f * (v1 + v2) * (image_size - 1);
+  Sample s;
+  if (in < 0 || in > image_size - 1) {
+    s.low = -1;
+    s.high = -1;
+    s.lerp = 0;
+  } else {
+    s.low = static_cast<int>(std::floor(in));
+    s.high = static_cast<int>(std::ceil(in));
+    s.lerp = in - s.low;
+  }
+  return s;
+}
+
+inline float bilinear(const float* plane, int width, const Sample& y, const Sample& x) {
+  const float top_left = plane[y.low * width + x.low];
+  const float top_right = plane[y.low * width + x.high];
+  const float bottom_left = plane[y.high * width + x.low];
+  const float bottom_right = plane[y.high * width + x.high];
+  const float top = top_left + (top_right - top_left) * x.lerp;
+  const float bottom = bottom_left + (bottom_right - bottom_left) * x.lerp;
+  return top + (bottom - top) * y.lerp;
+}
+
+inline void bilinear_backward(float* plane, int width, const Sample& y, const Sample& x,
+                              float grad) {
+  const float dtop = (1 - y.lerp) * grad;
+  plane[y.low * width + x.low] += (1 - x.lerp) * dtop;
+  plane[y.low * width + x.high] += x.lerp * dtop;
+  const float dbottom = y.lerp * grad;
+  plane[y.high * width + x.low] += (1 - x.lerp) * dbottom;
+  plane[y.high * width + x.high] += x.lerp * dbottom;
+}
+
+void check_inputs(const at::Tensor& image, const at::Tensor& boxes, const at::Tensor& box_ind,
+                  const at::Tensor& output) {
+  AT_CHECK(image.dim() == 4, "image must be NCHW");
+  AT_CHECK(boxes.dim() == 2 && boxes.size(1) == 4, "boxes must be (K, 4)");
+  AT_CHECK(box_ind.size(0) == boxes.size(0), "one box_ind per box");
+  AT_CHECK(output.dim() == 4 && output.size(0) == boxes.size(0) &&
+           output.size(1) == image.size(1), "output must be (K, C, H, W)");
+  AT_CHECK(image.is_contiguous() && boxes.is_contiguous() && box_ind.is_contiguous() &&
+           output.is_contiguous(), "all the tensors must be contiguous");
+  const int64_t batch_size = image.size(0);
+  const int64_t* ind = box_ind.data<int64_t>();
+  for (int64_t b = 0; b < box_ind.size(0); ++b) {
+    AT_CHECK(ind[b] >= 0 && ind[b] < batch_size, "box_ind out of range");
+  }
+}
+
+}  // namespace
+
+// image: (N, C, H, W) float, boxes: (K, 4) float, box_ind: (K,) long,
+// crops: (K, C, crop_height, crop_width) float
+void crop_and_resize_forward(at::Tensor image, at::Tensor boxes, at::Tensor box_ind,
+                             double extrapolation_value, at::Tensor crops) {
+  check_inputs(image, boxes, box_ind, crops);
+
+  const int64_t num_boxes = boxes.size(0);
+  const int64_t depth = image.size(1);
+  const int image_height = image.size(2);
+  const int image_width = image.size(3);
+  const int crop_height = crops.size(2);
+  const int crop_width = crops.size(3);
+
+  const float* image_data = image.data<float>();
+  const float* boxes_data = boxes.data<float>();
+  const int64_t* ind = box_ind.data<int64_t>();
+  float* crops_data = crops.data<float>();
+  const float extrapolation = static_cast<float>(extrapolation_value);
+
+  #pragma omp parallel for
+  for (int64_t k = 0; k < num_boxes * depth; ++k) {
+    const int64_t b = k / depth;
+    const int64_t d = k % depth;
+    const float* box = boxes_data + b * 4;
+    const float* plane = image_data + (ind[b] * depth + d) * image_height * image_width;
+    float* out = crops_data + k * crop_height * crop_width;
+    for (int y = 0; y < crop_height; ++y) {
+      const Sample sy = sample_at(box[0], box[2], y, crop_height, image_height);
+      for (int x = 0; x < crop_width; ++x) {
+        const Sample sx = sample_at(box[1], box[3], x, crop_width, image_width);
+        out[y * crop_width + x] = (sy.low < 0 || sx.low < 0)
+            ? extrapolation : bilinear(plane, image_width, sy, sx);
+      }
+    }
+  }
+}
+
+// grads: (K, C, crop_height, crop_width) float, boxes: (K, 4) float,
+// box_ind: (K,) long, grads_image: (N, C, H, W) float, zeroed by the caller
+void crop_and_resize_backward(at::Tensor grads, at::Tensor boxes, at::Tensor box_ind,
+                              at::Tensor grads_image) {
+  check_inputs(grads_image, boxes, box_ind, grads);
+
+  const int64_t num_boxes = grads.size(0);
+  const int64_t depth = grads.size(1);
+  const int crop_height = grads.size(2);
+  const int crop_width = grads.size(3);
+  const int image_height = grads_image.size(2);
+  const int image_width = grads_image.size(3);
+
+  const float* grads_data = grads.data<float>();
+  const float* boxes_data = boxes.data<float>();
+  const int64_t* ind = box_ind.data<int64_t>();
+  float* image_data = grads_image.data<float>();
+
+  #pragma omp parallel for
+  for (int64_t d = 0; d < depth; ++d) {
+    for (int64_t b = 0; b < num_boxes; ++b) {
+      const float* box = boxes_data + b * 4;
+      float* plane = image_data + (ind[b] * depth + d) * image_height * image_width;
+      const float* grad = grads_data + (b * depth + d) * crop_height * crop_width;
+      for (int y = 0; y < crop_height; ++y) {
+        const Sample sy = sample_at(box[0], box[2], y, crop_height, image_height);
+        if (sy.low < 0) {
+          continue;
+        }
+        for (int x = 0; x < crop_width; ++x) {
+          const Sample sx = sample_at(box[1], box[3], x, crop_width, image_width);
+          if (sx.low < 0) {
+            continue;
+          }
+          bilinear_backward(plane, image_width, sy, sx, grad[y * crop_width + x]);
+        }
+      }
+    }
+  }
+}
+
+// image: (N, C, H, W) float, boxes: (K, 4) float, box_ind: (K,) long,
+// output: (K, C, PH, PW) float, argmax: (K, C, PH, PW) byte
+void crop_and_resize_max_pool_forward(at::Tensor image, at::Tensor boxes, at::Tensor box_ind,
+                                      double extrapolation_value, at::Tensor output,
+                                      at::Tensor argmax) {
+  check_inputs(image, boxes, box_ind, output);
+  AT_CHECK(argmax.numel() == output.numel() && argmax.is_contiguous(),
+           "argmax must be contiguous, of the size of output");
+
+  // Crops of twice the pooled size, max pooled 2x2 with stride 2
+  const int pooled_height = output.size(2);
+  const int pooled_width = output.size(3);
+  const int crop_height = 2 * pooled_height;
+  const int crop_width = 2 * pooled_width;
+  const int64_t num_boxes = boxes.size(0);
+  const int64_t depth = image.size(1);
+  const int image_height = image.size(2);
+  const int image_width = image.size(3);
+
+  const float* image_data = image.data<float>();
+  const float* boxes_data = boxes.data<float>();
+  const int64_t* ind = box_ind.data<int64_t>();
+  float* output_data = output.data<float>();
+  // Position in its 2x2 window of the sample each output comes from
+  uint8_t* argmax_data = argmax.data<uint8_t>();
+  const float extrapolation = static_cast<float>(extrapolation_value);
+
+  #pragma omp parallel for
+  for (int64_t k = 0; k < num_boxes * depth; ++k) {
+    const int64_t b = k / depth;
+    const int64_t d = k % depth;
+    const float* box = boxes_data + b * 4;
+    const float* plane = image_data + (ind[b] * depth + d) * image_height * image_width;
+    float* out = output_data + k * pooled_height * pooled_width;
+    uint8_t* arg = argmax_data + k * pooled_height * pooled_width;
+    for (int py = 0; py < pooled_height; ++py) {
+      for (int px = 0; px < pooled_width; ++px) {
+        float best = -std::numeric_limits<float>::infinity();
+        uint8_t best_pos = 0;
+        for (int pos = 0; pos < 4; ++pos) {
+          const Sample sy = sample_at(box[0], box[2], 2 * py + pos / 2, crop_height, image_height);
+          const Sample sx = sample_at(box[1], box[3], 2 * px + pos % 2, crop_width, image_width);
+          const float v = (sy.low < 0 || sx.low < 0)
+              ? extrapolation : bilinear(plane, image_width, sy, sx);
+          if (v > best) {
+            best = v;
+            best_pos = pos;
+          }
+        }
+        out[py * pooled_width + px] = best;
+        arg[py * pooled_width + px] = best_pos;
+      }
+    }
+  }
+}
+
+// grads: (K, C, PH, PW) float, argmax: (K, C, PH, PW) byte, boxes: (K, 4)
+// float, box_ind: (K,) long, grads_image: (N, C, H, W) float, zeroed by the caller
+void crop_and_resize_max_pool_backward(at::Tensor grads, at::Tensor argmax, at::Tensor boxes,
+                                       at::Tensor box_ind, at::Tensor grads_image) {
+  check_inputs(grads_image, boxes, box_ind, grads);
+  AT_CHECK(argmax.numel() == grads.numel() && argmax.is_contiguous(),
+           "argmax must be contiguous, of the size of grads");
+
+  const int64_t num_boxes = grads.size(0);
+  const int64_t depth = grads.size(1);
+  const int pooled_height = grads.size(2);
+  const int pooled_width = grads.size(3);
+  const int crop_height = 2 * pooled_height;
+  const int crop_width = 2 * pooled_width;
+  const int image_height = grads_image.size(2);
+  const int image_width = grads_image.size(3);
+
+  const float* grads_data = grads.data<float>();
+  const uint8_t* argmax_data = argmax.data<uint8_t>();
+  const float* boxes_data = boxes.data<float>();
+  const int64_t* ind = box_ind.data<int64_t>();
+  float* image_data = grads_image.data<float>();
+
+  #pragma omp parallel for
+  for (int64_t d = 0; d < depth; ++d) {
+    for (int64_t b = 0; b < num_boxes; ++b) {
+      const float* box = boxes_data + b * 4;
+      float* plane = image_data + (ind[b] * depth + d) * image_height * image_width;
+      const int64_t offset = (b * depth + d) * pooled_height * pooled_width;
+      for (int py = 0; py < pooled_height; ++py) {
+        for (int px = 0; px < pooled_width; ++px) {
+          const int pos = argmax_data[offset + py * pooled_width + px];
+          const Sample sy = sample_at(box[0], box[2], 2 * py + pos / 2, crop_height, image_height);
+          const Sample sx = sample_at(box[1], box[3], 2 * px + pos % 2, crop_width, image_width);
+          if (sy.low < 0 || sx.low < 0) {
+            continue;
+          }
+          bilinear_backward(plane, image_width, sy, sx,
+                            grads_data[offset + py * pooled_width + px]);
+        }
+      }
+    }
+  }
+}
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
+  m.def("forward", &crop_and_resize_forward, "Crop and resize forward (CPU)");
+  m.def("backward", &crop_and_resize_backward, "Crop and resize backward (CPU)");
+  m.def("max_pool_forward", &crop_and_resize_max_pool_forward,
+        "Crop and resize to twice the pooled size, then 2x2 max pool (CPU)");
+  m.def("max_pool_backward", &crop_and_resize_max_pool_backward,
+        "Backward of max_pool_forward (CPU)");
+}
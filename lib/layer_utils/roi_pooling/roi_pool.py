@@ -1,6 +1,17 @@
 import torch
 from torch.autograd import Function
-from ._ext import roi_pooling
+
+try:
+    # Torch C++ extension, built by setup.py
+    from . import _roi_pooling_cpu
+except ImportError:
+    _roi_pooling_cpu = None
+
+try:
+    # Legacy ffi extension, needed by the CUDA implementation
+    from ._ext import roi_pooling
+except ImportError:
+    roi_pooling = None
 
 
 class RoIPoolFunction(Function):
@@ -50,6 +61,36 @@ class RoIPoolFunction(Function):
         return grad_input, None
 
 
+class RoIPoolCPUFunction(Function):
+    """RoI max pooling on CPU, with a backward pass, through the C++ extension."""
+
+    @staticmethod
+    def forward(ctx, features, rois, pooled_height, pooled_width, spatial_scale):
+        features = features.float().contiguous()
+        rois = rois.float().contiguous()
+        output = features.new_empty((rois.size(0), features.size(1), pooled_height, pooled_width))
+        argmax = torch.empty(output.size(), dtype=torch.int32)
+        _roi_pooling_cpu.forward(features, rois, spatial_scale, output, argmax)
+        ctx.save_for_backward(rois, argmax)
+        ctx.feature_size = features.size()
+        return output
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        rois, argmax = ctx.saved_tensors
+        grad_input = grad_output.new_zeros(ctx.feature_size)
+        _roi_pooling_cpu.backward(grad_output.float().contiguous(), rois, argmax, grad_input)
+        return grad_input, None, None, None, None
+
+
+def roi_pool(features, rois, pooled_height, pooled_width, spatial_scale):
+    """RoI max pooling of NCHW features, trainable on CPU when the C++ extension is built."""
+    if features.is_cuda or _roi_pooling_cpu is None:
+        return RoIPoolFunction(pooled_height, pooled_width, spatial_scale)(features, rois)
+    return RoIPoolCPUFunction.apply(features, rois, int(pooled_height), int(pooled_width),
+                                    float(spatial_scale))
+
+
 class RoIPool(torch.nn.Module):
     def __init__(self, pooled_height, pooled_width, spatial_scale):
         super(RoIPool, self).__init__()
@@ -59,4 +100,4 @@ class RoIPool(torch.nn.Module):
         self.spatial_scale = float(spatial_scale)
 
     def forward(self, features, rois):
-        return RoIPoolFunction(self.pooled_height, self.pooled_width, self.spatial_scale)(features, rois)
+        return roi_pool(features, rois, self.pooled_height, self.pooled_width, self.spatial_scale)
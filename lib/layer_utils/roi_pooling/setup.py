@@ -0,0 +1,17 @@
+# Build the CPU RoI pooling extension next to roi_pool.py:
+#   python setup.py build_ext --inplace
+from setuptools import setup
+from torch.utils.cpp_extension import BuildExtension, CppExtension
+
+setup(
+    name='roi_pooling_cpu',
+    ext_modules=[
+        CppExtension(
+            '_roi_pooling_cpu',
+            sources=['src/roi_pooling_cpu.cpp'],
+            extra_compile_args=['-O3', '-fopenmp'],
+            extra_link_args=['-fopenmp'],
+        )
+    ],
+    cmdclass={'build_ext': BuildExtension}
+)
@@ -0,0 +1,141 @@
+// ------------------------------------------------------------------
+// RoI max pooling as a torch C++ extension.
+//
+// Written against the C++ API of torch 0.4, the caller allocates the
+// outputs like for the ffi extensions. The forward pass is parallel over
+// (RoI, channel) pairs and keeps the argmax of each output, the backward
+// pass is parallel over channels so that no two threads accumulate into the
+// same plane of the gradient.
+// ------------------------------------------------------------------
+#include <torch/torch.h>
+
+#include <algorithm>
+#include <cfloat>
+#include <cmath>
+#include <cstdint>
+
+// AT_CHECK of torch 0.4 is TORCH_CHECK in later versions
+#ifndef AT_CHECK
+#define AT_CHECK TORCH_CHECK
+#endif
+
+// features: (N, C, H, W) float, rois: (R, 5) float,
+// output: (R, C, PH, PW) float, argmax: (R, C, PH, PW) int
+void roi_pooling_forward(at::Tensor features, at::Tensor rois, double spatial_scale,
+                         at::Tensor output, at::Tensor argmax) {
+  AT_CHECK(features.dim() == 4, "features must be NCHW");
+  AT_CHECK(rois.dim() == 2 && rois.size(1) == 5, "rois must be (R, 5)");
+  AT_CHECK(output.dim() == 4 && output.size(0) == rois.size(0) &&
+           output.size(1) == features.size(1), "output must be (R, C, PH, PW)");
+  AT_CHECK(argmax.numel() == output.numel(), "argmax must have the size of output");
+  AT_CHECK(features.is_contiguous() && rois.is_contiguous() && output.is_contiguous() &&
+           argmax.is_contiguous(), "all the tensors must be contiguous");
+
+  const int64_t num_rois = rois.size(0);
+  const int64_t batch_size = features.size(0);
+  const int64_t channels = features.size(1);
+  const int height = features.size(2);
+  const int width = features.size(3);
+  const int pooled_height = output.size(2);
+  const int pooled_width = output.size(3);
+
+  const float* data = features.data<float>();
+  const float* rois_data = rois.data<float>();
+  float* output_data = output.data<float>();
+  int* argmax_data = argmax.data<int>();
+  const float scale = static_cast<float>(spatial_scale);
+
+  for (int64_t n = 0; n < num_rois; ++n) {
+    const int64_t b = static_cast<int64_t>(rois_data[n * 5]);
+    AT_CHECK(b >= 0 && b < batch_size, "roi batch index out of range");
+  }
+
+  #pragma omp parallel for
+  for (int64_t k = 0; k < num_rois * channels; ++k) {
+    const int64_t n = k / channels;
+    const int64_t c = k % channels;
+    const float* roi = rois_data + n * 5;
+    const int64_t b = static_cast<int64_t>(roi[0]);
+    const int roi_start_w = std::round(roi[1] * scale);
+    const int roi_start_h = std::round(roi[2] * scale);
+    const int roi_end_w = std::round(roi[3] * scale);
+    const int roi_end_h = std::round(roi[4] * scale);
+    // Force malformed ROIs to be 1x1
+    const int roi_width = std::max(roi_end_w - roi_start_w + 1, 1);
+    const int roi_height = std::max(roi_end_h - roi_start_h + 1, 1);
+    const float bin_size_h = static_cast<float>(roi_height) / pooled_height;
+    const float bin_size_w = static_cast<float>(roi_width) / pooled_width;
+
+    const float* plane = data + (b * channels + c) * height * width;
+    float* out = output_data + k * pooled_height * pooled_width;
+    int* arg = argmax_data + k * pooled_height * pooled_width;
+    for (int ph = 0; ph < pooled_height; ++ph) {
+      int hstart = static_cast<int>(std::floor(ph * bin_size_h));
+      int hend = static_cast<int>(std::ceil((ph + 1) * bin_size_h));
+      hstart = std::min(std::max(hstart + roi_start_h, 0), height);
+      hend = std::min(std::max(hend + roi_start_h, 0), height);
+      for (int pw = 0; pw < pooled_width; ++pw) {
+        int wstart = static_cast<int>(std::floor(pw * bin_size_w));
+        int wend = static_cast<int>(std::ceil((pw + 1) * bin_size_w));
+        wstart = std::min(std::max(wstart + roi_start_w, 0), width);
+        wend = std::min(std::max(wend + roi_start_w, 0), width);
+        const bool is_empty = (hend <= hstart) || (wend <= wstart);
+
+        // Define an empty pooling region to be zero
+        float maxval = is_empty ? 0 : -FLT_MAX;
+        int maxidx = -1;
+        for (int h = hstart; h < hend; ++h) {
+          for (int w = wstart; w < wend; ++w) {
+            const int index = h * width + w;
+            if (plane[index] > maxval) {
+              maxval = plane[index];
+              maxidx = index;
+            }
+          }
+        }
+        out[ph * pooled_width + pw] = maxval;
+        arg[ph * pooled_width + pw] = maxidx;
+      }
+    }
+  }
+}
+
+// grad_output: (R, C, PH, PW) float, rois: (R, 5) float, argmax: (R, C, PH, PW)
+// int, grad_input: (N, C, H, W) float, zeroed by the caller
+void roi_pooling_backward(at::Tensor grad_output, at::Tensor rois, at::Tensor argmax,
+                          at::Tensor grad_input) {
+  AT_CHECK(grad_output.dim() == 4 && grad_input.dim() == 4, "gradients must be NCHW");
+  AT_CHECK(argmax.numel() == grad_output.numel(), "argmax must have the size of grad_output");
+  AT_CHECK(grad_output.is_contiguous() && rois.is_contiguous() && argmax.is_contiguous() &&
+           grad_input.is_contiguous(), "all the tensors must be contiguous");
+
+  const int64_t num_rois = grad_output.size(0);
+  const int64_t channels = grad_output.size(1);
+  const int64_t pooled_area = grad_output.size(2) * grad_output.size(3);
+  const int64_t plane_size = grad_input.size(2) * grad_input.size(3);
+
+  const float* grad_data = grad_output.data<float>();
+  const float* rois_data = rois.data<float>();
+  const int* argmax_data = argmax.data<int>();
+  float* grad_input_data = grad_input.data<float>();
+
+  #pragma omp parallel for
+  for (int64_t c = 0; c < channels; ++c) {
+    for (int64_t n = 0; n < num_rois; ++n) {
+      const int64_t b = static_cast<int64_t>(rois_data[n * 5]);
+      float* plane = grad_input_data + (b * channels + c) * plane_size;
+      const int64_t offset = (n * channels + c) * pooled_area;
+      for (int64_t i = 0; i < pooled_area; ++i) {
+        const int index = argmax_data[offset + i];
+        if (index >= 0) {
+          plane[index] += grad_data[offset + i];
+        }
+      }
+    }
+  }
+}
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
+  m.def("forward", &roi_pooling_forward, "RoI max pooling forward (CPU)");
+  m.def("backward", &roi_pooling_backward, "RoI max pooling backward (CPU)");
+}
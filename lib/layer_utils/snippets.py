@@ -7,14 +7,29 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from collections import OrderedDict
 import numpy as np
+import torch
+from model.config import cfg
 from layer_utils.generate_anchors import generate_anchors
 
+# Base anchors by (scales, ratios), there are only a few of them
+_base_anchors = {}
+
+
+def _get_base_anchors(anchor_scales, anchor_ratios):
+  key = (tuple(anchor_scales), tuple(anchor_ratios))
+  if key not in _base_anchors:
+    _base_anchors[key] = generate_anchors(ratios=np.array(anchor_ratios),
+                                          scales=np.array(anchor_scales))
+  return _base_anchors[key]
+
+
 def generate_anchors_pre(height, width, feat_stride, anchor_scales=(8,16,32), anchor_ratios=(0.5,1,2)):
   """ A wrapper function to generate anchors given different scales
     Also return the number of anchors in variable 'length'
   """
-  anchors = generate_anchors(ratios=np.array(anchor_ratios), scales=np.array(anchor_scales))
+  anchors = _get_base_anchors(anchor_scales, anchor_ratios)
   A = anchors.shape[0]
   shift_x = np.arange(0, width) * feat_stride
   shift_y = np.arange(0, height) * feat_stride
@@ -27,3 +42,96 @@ def generate_anchors_pre(height, width, feat_stride, anchor_scales=(8,16,32), an
   length = np.int32(anchors.shape[0])
 
   return anchors, length
+
+
+class AnchorGrid(object):
+  """The anchors of a feature map and the data derived from them.
+
+  anchors_np holds the anchors of generate_anchors_pre, anchors the same
+  anchors as a tensor on the device. geometry is (widths, heights, ctr_x,
+  ctr_y) of the anchors, as bbox_transform_inv computes them. None of them
+  may be modified in place, they are shared by every user of the grid.
+  """
+
+  # Number of image sizes the inside anchor indices are kept for
+  MAX_IMAGE_SIZES = 16
+
+  def __init__(self, anchors, length, device):
+    self.anchors_np = anchors
+    self.length = length
+    self.anchors = torch.from_numpy(anchors).to(device)
+    widths = self.anchors[:, 2] - self.anchors[:, 0] + 1.0
+    heights = self.anchors[:, 3] - self.anchors[:, 1] + 1.0
+    self.geometry = (widths, heights,
+                     self.anchors[:, 0] + 0.5 * widths,
+                     self.anchors[:, 1] + 0.5 * heights)
+    self._inds_inside = OrderedDict()
+
+  def _get_inds_inside(self, im_height, im_width):
+    key = (float(im_height), float(im_width))
+    inds = self._inds_inside.pop(key, None)
+    if inds is None:
+      anchors = self.anchors_np
+      inds = [np.where(
+        (anchors[:, 0] >= 0) &
+        (anchors[:, 1] >= 0) &
+        (anchors[:, 2] < key[1]) &
+        (anchors[:, 3] < key[0]))[0], None]
+      if len(self._inds_inside) >= self.MAX_IMAGE_SIZES:
+        self._inds_inside.popitem(last=False)
+    # Mark as most recently used
+    self._inds_inside[key] = inds
+    return inds
+
+  def inds_inside(self, im_height, im_width):
+    """Indices of the anchors that lie inside an image of the given size."""
+    return self._get_inds_inside(im_height, im_width)[0]
+
+  def inds_inside_tensor(self, im_height, im_width):
+    """Same as inds_inside, as a LongTensor on the device of the anchors."""
+    inds = self._get_inds_inside(im_height, im_width)
+    if inds[1] is None:
+      inds[1] = torch.from_numpy(inds[0]).to(self.anchors.device)
+    return inds[1]
+
+
+class AnchorCache(object):
+  """LRU cache of AnchorGrids, keyed by (height, width, feat_stride, scales,
+  ratios, device), holding at most max_size of them."""
+
+  def __init__(self, max_size):
+    self._max_size = max_size
+    self._grids = OrderedDict()
+
+  def get(self, height, width, feat_stride, anchor_scales, anchor_ratios,
+          device='cpu'):
+    """Return the AnchorGrid of a feature map of size (height, width)."""
+    feat_stride = int(np.asarray(feat_stride).reshape(-1)[0])
+    key = (int(height), int(width), feat_stride, tuple(anchor_scales),
+           tuple(anchor_ratios), str(device))
+    grid = self._grids.pop(key, None)
+    if grid is None:
+      anchors, length = generate_anchors_pre(height, width, feat_stride,
+                                             anchor_scales, anchor_ratios)
+      grid = AnchorGrid(anchors, length, device)
+      while self._grids and len(self._grids) >= self._max_size:
+        self._grids.popitem(last=False)
+    if self._max_size > 0:
+      self._grids[key] = grid
+    return grid
+
+  def clear(self):
+    self._grids.clear()
+
+
+_anchor_cache = None
+
+
+def get_anchor_grid(height, width, feat_stride, anchor_scales=(8,16,32),
+                    anchor_ratios=(0.5,1,2), device='cpu'):
+  """Return the AnchorGrid of a feature map from the cache of this process."""
+  global _anchor_cache
+  if _anchor_cache is None:
+    _anchor_cache = AnchorCache(cfg.ANCHOR_CACHE_SIZE)
+  return _anchor_cache.get(height, width, feat_stride, anchor_scales,
+                           anchor_ratios, device)
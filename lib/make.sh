@@ -12,6 +12,9 @@ echo "Compiling roi_pooling kernels by nvcc..."
 nvcc -c -o roi_pooling_kernel.cu.o roi_pooling_kernel.cu -x cu -Xcompiler -fPIC $CUDA_ARCH 
 cd ../../
 python build.py
+echo "Compiling the CPU roi_pooling extension..."
+python setup.py build_ext --inplace
+rm -rf build
 cd ../../
 
 # Build RoIAlign
@@ -20,6 +23,9 @@ echo 'Compiling crop_and_resize kernels by nvcc...'
 nvcc -c -o crop_and_resize_kernel.cu.o crop_and_resize_kernel.cu -x cu -Xcompiler -fPIC $CUDA_ARCH
 cd ../../
 python build.py
+echo "Compiling the CPU crop_and_resize extension..."
+python setup.py build_ext --inplace
+rm -rf build
 cd ../../
 
 # Build NMS
@@ -28,4 +34,7 @@ echo "Compiling nms kernels by nvcc..."
 nvcc -c -o nms_kernel.cu.o nms_kernel.cu -x cu -Xcompiler -fPIC $CUDA_ARCH
 cd ../../
 python build.py
+echo "Compiling the CPU nms extension..."
+python setup.py build_ext --inplace
+rm -rf build
 cd ../
@@ -32,15 +32,19 @@ def bbox_transform(ex_rois, gt_rois):
   return targets
 
 
-def bbox_transform_inv(boxes, deltas):
+def bbox_transform_inv(boxes, deltas, geometry=None):
   # Input should be both tensor or both Variable and on the same device
+  # geometry is (widths, heights, ctr_x, ctr_y) of boxes if already known
   if len(boxes) == 0:
     return deltas.detach() * 0
 
-  widths = boxes[:, 2] - boxes[:, 0] + 1.0
-  heights = boxes[:, 3] - boxes[:, 1] + 1.0
-  ctr_x = boxes[:, 0] + 0.5 * widths
-  ctr_y = boxes[:, 1] + 0.5 * heights
+  if geometry is not None:
+    widths, heights, ctr_x, ctr_y = geometry
+  else:
+    widths = boxes[:, 2] - boxes[:, 0] + 1.0
+    heights = boxes[:, 3] - boxes[:, 1] + 1.0
+    ctr_x = boxes[:, 0] + 0.5 * widths
+    ctr_y = boxes[:, 1] + 0.5 * heights
 
   dx = deltas[:, 0::4]
   dy = deltas[:, 1::4]
@@ -64,6 +64,13 @@ __C.TRAIN.USE_GT = False
 # GPU memory
 __C.TRAIN.ASPECT_GROUPING = False
 
+# Whether to form minibatches of images with similar resized shapes, to limit the
+# padding of multi-image minibatches; takes precedence over ASPECT_GROUPING
+__C.TRAIN.BUCKET_SAMPLING = False
+
+# Granularity in pixels of the resized shapes of the buckets
+__C.TRAIN.BUCKET_STEP = 64
+
 # The number of snapshots kept, older ones are deleted to save space
 __C.TRAIN.SNAPSHOT_KEPT = 3
 
@@ -171,6 +178,39 @@ __C.TRAIN.RPN_POSITIVE_WEIGHT = -1.0
 # For COCO, setting USE_ALL_GT to False will exclude boxes that are flagged as ''iscrowd''
 __C.TRAIN.USE_ALL_GT = True
 
+# Whether to compute the minibatch blobs in separate worker processes
+__C.TRAIN.USE_PREFETCH = False
+
+# Number of worker processes used for prefetching (USE_PREFETCH must be True)
+__C.TRAIN.PREFETCH_PROCESSES = 4
+
+# Number of minibatches kept ready (or in flight) ahead of the trainer
+__C.TRAIN.PREFETCH_QUEUE_SIZE = 8
+
+# Whether to compute the RPN anchor targets in the data layer (or its
+# prefetching workers) instead of in the forward pass of the network
+__C.TRAIN.PRECOMPUTE_ANCHOR_TARGETS = False
+
+# Whether the network computes the RPN anchor targets with torch on its own
+# device, instead of with numpy on the host
+__C.TRAIN.TORCH_ANCHOR_TARGETS = False
+
+# Whether the RPN losses only gather the predictions of the sampled anchors,
+# whose targets are then computed with torch on the device of the network
+# without the dense maps (PRECOMPUTE_ANCHOR_TARGETS is ignored)
+__C.TRAIN.SPARSE_RPN_LOSS = False
+
+# Budget in bytes of the in-memory cache of decoded and resized training images
+# (per data loading process), 0 disables it
+__C.TRAIN.IMAGE_CACHE_BYTES = 0
+
+# Directory of the on-disk cache of resized training images, '' disables it
+__C.TRAIN.IMAGE_CACHE_DIR = ''
+
+# Directory of packed image shards (see tools/pack_shards.py) to read the
+# training images from, '' to decode them from the image files
+__C.TRAIN.IMAGE_SHARDS_DIR = ''
+
 #
 # Testing options
 #
@@ -219,6 +259,10 @@ __C.TEST.MODE = 'nms'
 # Only useful when TEST.MODE is 'top', specifies the number of top proposals to select
 __C.TEST.RPN_TOP_N = 5000
 
+# Directory of packed image shards (see tools/pack_shards.py) to read the
+# testing images from, '' to decode them from the image files
+__C.TEST.IMAGE_SHARDS_DIR = ''
+
 #
 # ResNet options
 #
@@ -272,12 +316,34 @@ __C.ROOT_DIR = osp.abspath("/media/trans/mnt/")
 # Data directory
 __C.DATA_DIR = osp.abspath(osp.join(__C.ROOT_DIR, 'data'))
 
+# Keep the gt roidb as flat arrays cached in memory-mapped .npy files
+# instead of a pickled list of dicts
+__C.COLUMNAR_ROIDB = False
+
 # Name (or path to) the matlab executable
 __C.MATLAB = 'matlab'
 
 # Place outputs under an experiments directory
 __C.EXP_DIR = 'default'
 
+# Resize the images in uint8 and write them, mean subtracted, into reusable
+# NCHW float buffers that the network takes without transposing them
+__C.FUSED_PREPROCESSING = False
+
+# Hand uint8 image blobs to the network, which converts them to float and
+# subtracts the pixel means on the device; blobs take 4x less memory in the
+# prefetch queue and between processes. With MIX_TRAINING, the blend of the
+# two images is rounded to uint8 too, which quantizes it to whole pixel values
+__C.UINT8_BLOBS = False
+
+# Decode images at 1/2, 1/4 or 1/8 of their resolution when the scale they
+# are resized to allows it, which is much faster for large JPEGs
+__C.REDUCED_DECODE = False
+
+# Number of feature map sizes whose anchors, moved to the device, are kept
+# along with the data derived from them
+__C.ANCHOR_CACHE_SIZE = 32
+
 # Use GPU implementation of non-maximum suppression
 __C.USE_GPU_NMS = True
 
@@ -8,10 +8,46 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from nms.pth_nms import pth_nms
+import numpy as np
+import torch
+from nms.pth_nms import pth_nms, pth_batched_nms
 
 
 def nms(dets, thresh):
   """Dispatch to either CPU or GPU NMS implementations.
   Accept dets as tensor"""
   return pth_nms(dets, thresh)
+
+
+def batched_nms(dets, labels, thresh):
+  """Non-maximum suppression of dets within each label.
+
+  dets is an (N, 5) tensor and labels an (N,) integer tensor. Boxes with
+  different labels are never compared: each label is suppressed on its own
+  block of boxes, so the cost is the sum over the labels of N_c^2. On CPU,
+  the C++ extension does all the labels in one call. Returns the kept indices
+  into dets, by decreasing score.
+  """
+  keep = pth_batched_nms(dets, labels, thresh)
+  return keep[dets[keep, 4].sort(0, descending=True)[1]]
+
+
+def multiclass_nms(cls_dets, thresh):
+  """Non-maximum suppression of the detections of each of several classes.
+
+  cls_dets is a list of (N_c, 5) float32 arrays, one per class. Returns the
+  kept indices into each of them, by decreasing score. All the classes go
+  through one batched_nms call, which never compares boxes of different
+  classes.
+  """
+  cls_dets = [np.ascontiguousarray(dets.reshape(-1, 5), dtype=np.float32)
+              for dets in cls_dets]
+  sizes = [len(dets) for dets in cls_dets]
+  offsets = np.cumsum([0] + sizes)
+  if offsets[-1] == 0:
+    return [np.zeros(0, dtype=np.int64) for _ in cls_dets]
+  dets = torch.from_numpy(np.concatenate(cls_dets))
+  labels = torch.from_numpy(np.repeat(np.arange(len(cls_dets)), sizes))
+  keep = batched_nms(dets, labels, thresh).cpu().numpy().reshape(-1)
+  keep_labels = labels.numpy()[keep]
+  return [keep[keep_labels == c] - offsets[c] for c in range(len(cls_dets))]
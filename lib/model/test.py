@@ -17,14 +17,32 @@ import os
 import math
 
 from utils.timer import Timer
-from model.nms_wrapper import nms
-from utils.blob import im_list_to_blob
+from model.nms_wrapper import multiclass_nms
+from utils.blob import im_list_to_blob, get_im_scale, resize_im, BlobBuffer, \
+  resized_im_list_to_blob, blob_size, imread_reduced, resize_reduced_im
+from utils.image_shards import ImageShards
 
 from model.config import cfg, get_output_dir
 from model.bbox_transform import clip_boxes, bbox_transform_inv
 
 import torch
 
+# Buffer of the fused preprocessing (cfg.FUSED_PREPROCESSING), reused across images
+_blob_buffer = None
+
+def _uint8_preprocessing():
+  """Whether images are resized in uint8, before the mean subtraction."""
+  return cfg.FUSED_PREPROCESSING or cfg.UINT8_BLOBS
+
+def _resized_im_list_to_blob(ims):
+  """Blob of a list of resized uint8 images, see resized_im_list_to_blob."""
+  global _blob_buffer
+  if cfg.FUSED_PREPROCESSING and _blob_buffer is None:
+    _blob_buffer = BlobBuffer()
+  return resized_im_list_to_blob(
+    ims, cfg.PIXEL_MEANS, uint8=cfg.UINT8_BLOBS,
+    blob_buffer=_blob_buffer if cfg.FUSED_PREPROCESSING else None)
+
 def _get_image_blob(im):
   """Converts an image into a network input.
   Arguments:
@@ -34,6 +52,14 @@ def _get_image_blob(im):
     im_scale_factors (list): list of image scales (relative to im) used
       in the image pyramid
   """
+  if _uint8_preprocessing():
+    # Resize in uint8, the mean is subtracted while writing the blob or by
+    # the network
+    im_scale_factors = [get_im_scale(im.shape, target_size, cfg.TEST.MAX_SIZE)
+                        for target_size in cfg.TEST.SCALES]
+    processed_ims = [resize_im(im, im_scale) for im_scale in im_scale_factors]
+    return _resized_im_list_to_blob(processed_ims), np.array(im_scale_factors)
+
   im_orig = im.astype(np.float32, copy=True)
   im_orig -= cfg.PIXEL_MEANS
 
@@ -66,6 +92,38 @@ def _get_blobs(im):
 
   return blobs, im_scale_factors
 
+def _get_shards_blobs(shards, path):
+  """Build the network inputs of an image from its packed, resized versions."""
+  processed_ims = []
+  im_scale_factors = []
+
+  for target_size in cfg.TEST.SCALES:
+    im, im_scale = shards.get(path, target_size, cfg.TEST.MAX_SIZE)
+    assert im is not None, \
+      'Image {} was not packed for scale {}'.format(path, target_size)
+    im_scale_factors.append(im_scale)
+    processed_ims.append(im)
+
+  blobs = {'data': _resized_im_list_to_blob(processed_ims)}
+
+  return blobs, np.array(im_scale_factors)
+
+def _get_reduced_decode_blobs(path, im_shape):
+  """Build the network inputs of the image at path, of shape im_shape.
+
+  The image is decoded once, at the lowest resolution the largest of the
+  scales allows, and resized from there to each scale.
+  """
+  im_scale_factors = [get_im_scale(im_shape, target_size, cfg.TEST.MAX_SIZE)
+                      for target_size in cfg.TEST.SCALES]
+  im = imread_reduced(path, max(im_scale_factors))
+  processed_ims = [resize_reduced_im(im, im_shape, im_scale)
+                   for im_scale in im_scale_factors]
+
+  blobs = {'data': _resized_im_list_to_blob(processed_ims)}
+
+  return blobs, np.array(im_scale_factors)
+
 def _clip_boxes(boxes, im_shape):
   """Clip boxes to image boundaries."""
   # x1 >= 0
@@ -87,21 +145,65 @@ def _rescale_boxes(boxes, inds, scales):
 
 def im_detect(net, im):
   blobs, im_scales = _get_blobs(im)
+  return _im_detect_blobs(net, blobs, im_scales, im.shape)
+
+def _get_batch_blobs(ims):
+  """Convert a list of images into the network inputs of a single batch.
+
+  The images are resized to the single test scale and padded to the largest.
+  """
+  assert len(cfg.TEST.SCALES) == 1, "Only single-scale batches implemented"
+  im_scales = [get_im_scale(im.shape, cfg.TEST.SCALES[0], cfg.TEST.MAX_SIZE)
+               for im in ims]
+  if _uint8_preprocessing():
+    processed_ims = [resize_im(im, im_scale) for im, im_scale in zip(ims, im_scales)]
+    blob = _resized_im_list_to_blob(processed_ims)
+  else:
+    processed_ims = [resize_im(im.astype(np.float32) - cfg.PIXEL_MEANS, im_scale)
+                     for im, im_scale in zip(ims, im_scales)]
+    blob = im_list_to_blob(processed_ims)
+
+  im_infos = np.array([[im.shape[0], im.shape[1], im_scale]
+                       for im, im_scale in zip(processed_ims, im_scales)], dtype=np.float32)
+  return {'data': blob, 'im_info': im_infos}, im_scales
+
+def im_detect_batch(net, ims):
+  """Detect objects in a list of images with a single forward of the network.
+
+  The backbone runs once on the padded batch, the proposals of each image are
+  taken from its own part of the feature map. Returns the (scores, boxes) of
+  each image, as im_detect does.
+  """
+  blobs, im_scales = _get_batch_blobs(ims)
+  _, scores, bbox_pred, rois = net.test_image(blobs['data'], blobs['im_info'])
+
+  detections = []
+  for i, im in enumerate(ims):
+    inds = np.where(rois[:, 0] == i)[0]
+    detections.append(_detections(rois[inds], scores[inds], bbox_pred[inds],
+                                  im_scales[i], im.shape))
+  return detections
+
+def _im_detect_blobs(net, blobs, im_scales, im_shape):
+  """Detect objects from the network inputs of an image of shape im_shape."""
   assert len(im_scales) == 1, "Only single-image batch implemented"
 
-  im_blob = blobs['data']
-  blobs['im_info'] = np.array([im_blob.shape[1], im_blob.shape[2], im_scales[0]], dtype=np.float32)
+  im_height, im_width = blob_size(blobs['data'])
+  blobs['im_info'] = np.array([im_height, im_width, im_scales[0]], dtype=np.float32)
 
   _, scores, bbox_pred, rois = net.test_image(blobs['data'], blobs['im_info'])
-  
-  boxes = rois[:, 1:5] / im_scales[0]
+  return _detections(rois, scores, bbox_pred, im_scales[0], im_shape)
+
+def _detections(rois, scores, bbox_pred, im_scale, im_shape):
+  """Scores and class boxes of the RoIs of an image, from the network outputs."""
+  boxes = rois[:, 1:5] / im_scale
   scores = np.reshape(scores, [scores.shape[0], -1])
   bbox_pred = np.reshape(bbox_pred, [bbox_pred.shape[0], -1])
   if cfg.TEST.BBOX_REG:
     # Apply bounding-box regression deltas
     box_deltas = bbox_pred
     pred_boxes = bbox_transform_inv(torch.from_numpy(boxes), torch.from_numpy(box_deltas)).numpy()
-    pred_boxes = _clip_boxes(pred_boxes, im.shape)
+    pred_boxes = _clip_boxes(pred_boxes, im_shape)
   else:
     # Simply repeat the boxes, once for each class
     pred_boxes = np.tile(boxes, (1, scores.shape[1]))
@@ -115,23 +217,25 @@ def apply_nms(all_boxes, thresh):
   num_classes = len(all_boxes)
   num_images = len(all_boxes[0])
   nms_boxes = [[[] for _ in range(num_images)] for _ in range(num_classes)]
-  for cls_ind in range(num_classes):
-    for im_ind in range(num_images):
+  for im_ind in range(num_images):
+    cls_inds = []
+    cls_dets = []
+    for cls_ind in range(num_classes):
       dets = all_boxes[cls_ind][im_ind]
-      if dets == []:
+      if len(dets) == 0:
         continue
 
       x1 = dets[:, 0]
       y1 = dets[:, 1]
       x2 = dets[:, 2]
       y2 = dets[:, 3]
-      scores = dets[:, 4]
       inds = np.where((x2 > x1) & (y2 > y1))[0]
-      dets = dets[inds,:]
-      if dets == []:
-        continue
+      cls_inds.append(cls_ind)
+      cls_dets.append(dets[inds, :].astype(np.float32, copy=False))
 
-      keep = nms(torch.from_numpy(dets), thresh).numpy()
+    # The classes of the image are suppressed in one call, each on its own boxes
+    for cls_ind, dets, keep in zip(cls_inds, cls_dets,
+                                   multiclass_nms(cls_dets, thresh)):
       if len(keep) == 0:
         continue
       nms_boxes[cls_ind][im_ind] = dets[keep, :].copy()
@@ -151,25 +255,46 @@ def test_net(net, imdb, weights_filename, max_per_image=100, thresh=0.):
   # timers
   _t = {'im_detect' : Timer(), 'misc' : Timer()}
 
-  for i in range(num_images):
-    im = cv2.imread(imdb.image_path_at(i))
+  shards = ImageShards(cfg.TEST.IMAGE_SHARDS_DIR) if cfg.TEST.IMAGE_SHARDS_DIR else None
 
-    _t['im_detect'].tic()
-    scores, boxes = im_detect(net, im)
-    _t['im_detect'].toc()
+  for i in range(num_images):
+    if shards is not None:
+      path = imdb.image_path_at(i)
+      blobs, im_scales = _get_shards_blobs(shards, path)
+
+      _t['im_detect'].tic()
+      scores, boxes = _im_detect_blobs(net, blobs, im_scales, shards.image_size(path))
+      _t['im_detect'].toc()
+    elif cfg.REDUCED_DECODE:
+      # The size of the image is needed before decoding it to pick the factor
+      width, height = imdb.image_size_at(i)
+      im_shape = (height, width, 3)
+      blobs, im_scales = _get_reduced_decode_blobs(imdb.image_path_at(i), im_shape)
+
+      _t['im_detect'].tic()
+      scores, boxes = _im_detect_blobs(net, blobs, im_scales, im_shape)
+      _t['im_detect'].toc()
+    else:
+      im = cv2.imread(imdb.image_path_at(i))
+
+      _t['im_detect'].tic()
+      scores, boxes = im_detect(net, im)
+      _t['im_detect'].toc()
 
     _t['misc'].tic()
 
     # skip j = 0, because it's the background class
+    cls_dets = []
     for j in range(1, imdb.num_classes):
       inds = np.where(scores[:, j] > thresh)[0]
       cls_scores = scores[inds, j]
       cls_boxes = boxes[inds, j*4:(j+1)*4]
-      cls_dets = np.hstack((cls_boxes, cls_scores[:, np.newaxis])) \
-        .astype(np.float32, copy=False)
-      keep = nms(torch.from_numpy(cls_dets), cfg.TEST.NMS).numpy() if cls_dets.size > 0 else []
-      cls_dets = cls_dets[keep, :]
-      all_boxes[j][i] = cls_dets
+      cls_dets.append(np.hstack((cls_boxes, cls_scores[:, np.newaxis])) \
+        .astype(np.float32, copy=False))
+    # The classes are suppressed in one call, each on its own boxes
+    keeps = multiclass_nms(cls_dets, cfg.TEST.NMS)
+    for j in range(1, imdb.num_classes):
+      all_boxes[j][i] = cls_dets[j - 1][keeps[j - 1], :]
 
     # Limit to max_per_image detections *over all classes*
     if max_per_image > 0:
@@ -11,7 +11,9 @@ import tensorboardX as tb
 
 from model.config import cfg, tmp_lam
 import roi_data_layer.roidb as rdl_roidb
+from datasets.columnar_roidb import ColumnarRoidb
 from roi_data_layer.layer import RoIDataLayer
+from layer_utils.proposal_target_layer import get_sampling_rng_state, set_sampling_rng_state
 import utils.timer
 try:
   import cPickle as pickle
@@ -79,6 +81,10 @@ class SolverWrapper(object):
     cur_val = self.data_layer_val._cur
     # current shuffled indexes of the validation database
     perm_val = self.data_layer_val._perm
+    # current state of the generators of the RoI sampling
+    sampling_st0 = get_sampling_rng_state()
+    # current state of the random stream of the prefetched reshuffles
+    perm_rng_st0 = getattr(self.data_layer, '_perm_rng_state', None)
 
     # Dump the meta info
     with open(nfilename, 'wb') as fid:
@@ -88,6 +94,8 @@ class SolverWrapper(object):
       pickle.dump(cur_val, fid, pickle.HIGHEST_PROTOCOL)
       pickle.dump(perm_val, fid, pickle.HIGHEST_PROTOCOL)
       pickle.dump(iter, fid, pickle.HIGHEST_PROTOCOL)
+      pickle.dump(sampling_st0, fid, pickle.HIGHEST_PROTOCOL)
+      pickle.dump(perm_rng_st0, fid, pickle.HIGHEST_PROTOCOL)
 
     return filename, nfilename
 
@@ -105,10 +113,24 @@ class SolverWrapper(object):
       cur_val = pickle.load(fid)
       perm_val = pickle.load(fid)
       last_snapshot_iter = pickle.load(fid)
+      try:
+        sampling_st0 = pickle.load(fid)
+      except EOFError:
+        # Snapshots of before the RoI sampling used torch generators
+        sampling_st0 = None
+      try:
+        perm_rng_st0 = pickle.load(fid)
+      except EOFError:
+        # Snapshots of before the prefetched reshuffles had their own stream
+        perm_rng_st0 = None
 
       np.random.set_state(st0)
+      if sampling_st0 is not None:
+        set_sampling_rng_state(sampling_st0)
       self.data_layer._cur = cur
       self.data_layer._perm = perm
+      if perm_rng_st0 is not None:
+        self.data_layer._perm_rng_state = perm_rng_st0
       self.data_layer_val._cur = cur_val
       self.data_layer_val._perm = perm_val
 
@@ -214,7 +236,9 @@ class SolverWrapper(object):
 
   def train_model(self, max_iters):
     # Build data layers for both training and validation set
-    self.data_layer = RoIDataLayer(self.roidb, self.imdb.num_classes)
+    self.data_layer = RoIDataLayer(self.roidb, self.imdb.num_classes,
+                                   feat_stride=self.net._feat_stride[0],
+                                   feat_map_size=self.net._feat_map_size)
     self.data_layer_val = RoIDataLayer(self.valroidb, self.imdb.num_classes, random=True)
 
     # Construct the computation graph
@@ -301,19 +325,20 @@ class SolverWrapper(object):
 
     self.writer.close()
     self.valwriter.close()
+    self.data_layer.close()
+    self.data_layer_val.close()
 
 
 def get_training_roidb(imdb):
   """Returns a roidb (Region of Interest database) for use in training."""
-  if cfg.TRAIN.USE_FLIPPED:
-    print('Appending horizontally-flipped training examples...')
-    imdb.append_flipped_images()
-    print('done')
-
   print('Preparing training data...')
   rdl_roidb.prepare_roidb(imdb)
   print('done')
 
+  if cfg.TRAIN.USE_FLIPPED:
+    print('Using horizontally-flipped training examples')
+    return rdl_roidb.FlippedRoidb(imdb.roidb)
+
   return imdb.roidb
 
 
@@ -334,8 +359,16 @@ def filter_roidb(roidb):
     valid = len(fg_inds) > 0 or len(bg_inds) > 0
     return valid
 
+  if isinstance(roidb, rdl_roidb.FlippedRoidb):
+    # Flipped entries are valid iff their original entries are
+    return rdl_roidb.FlippedRoidb(filter_roidb(roidb.roidb))
+
   num = len(roidb)
-  filtered_roidb = [entry for entry in roidb if is_valid(entry)]
+  if isinstance(roidb, ColumnarRoidb):
+    filtered_roidb = roidb.take([i for i, entry in enumerate(roidb)
+                                 if is_valid(entry)])
+  else:
+    filtered_roidb = [entry for entry in roidb if is_valid(entry)]
   num_after = len(filtered_roidb)
   print('Filtered {} roidb entries: {} -> {}'.format(num - num_after,
                                                      num, num_after))
@@ -18,15 +18,15 @@ from torch.autograd import Variable
 
 import utils.timer
 
-from layer_utils.snippets import generate_anchors_pre
+from layer_utils.snippets import get_anchor_grid
 from layer_utils.proposal_layer import proposal_layer
 from layer_utils.proposal_top_layer import proposal_top_layer
-from layer_utils.anchor_target_layer import anchor_target_layer
+from layer_utils.anchor_target_layer import anchor_targets_sets, anchor_targets_torch_sets
 from layer_utils.proposal_target_layer import proposal_target_layer
 from utils.visualization import draw_bounding_boxes
 
-from layer_utils.roi_pooling.roi_pool import RoIPoolFunction
-from layer_utils.roi_align.crop_and_resize import CropAndResizeFunction
+from layer_utils.roi_pooling.roi_pool import roi_pool
+from layer_utils.roi_align.crop_and_resize import crop_and_resize, crop_and_resize_max_pool
 
 from model.config import cfg, tmp_lam, tmp_lam2, tprint
 
@@ -166,8 +166,12 @@ class Network(nn.Module):
 
     def _add_gt_image(self):
         # add back mean
-        image = self._image_gt_summaries['image'] + cfg.PIXEL_MEANS
-        image = imresize(image[0], self._im_info[:2] / self._im_info[2])
+        image = self._image_gt_summaries['image']
+        if isinstance(image, torch.Tensor):
+            image = image.permute(0, 2, 3, 1).cpu().numpy()
+        if image.dtype != np.uint8:
+            image = image + cfg.PIXEL_MEANS
+        image = imresize(image[0], self._im_infos[0, :2] / self._im_infos[0, 2])
         # BGR to RGB (opencv uses BGR)
         self._gt_image = image[np.newaxis, :, :, ::-1].copy(order='C')
 
@@ -175,7 +179,7 @@ class Network(nn.Module):
         # use a customized visualization function to visualize the boxes
         self._add_gt_image()
         image = draw_bounding_boxes( \
-            self._gt_image, self._image_gt_summaries['gt_boxes'], self._image_gt_summaries['im_info'])
+            self._gt_image, self._image_gt_summaries['gt_boxes'], self._im_infos[0])
 
         return tb.summary.image('GROUND_TRUTH', image[0].astype('float32') / 255.0)
 
@@ -190,21 +194,55 @@ class Network(nn.Module):
     def _add_train_summary(self, key, var):
         return tb.summary.histogram('TRAIN/' + key, var.data.cpu().numpy(), bins='auto')
 
+    def _image_rpn_outputs(self, rpn_cls_prob, rpn_bbox_pred, i):
+        """RPN outputs and anchor grid of image i of the batch, over its own feature map.
+
+        The positions of the padding of the images smaller than the blob are left out, so that
+        the proposals of an image are those it would get alone.
+        """
+        height, width = rpn_cls_prob.shape[1:3]
+        im_height, im_width = self._feat_map_size(*[int(x) for x in np.round(self._im_infos[i][:2])])
+        if im_height >= height and im_width >= width:
+            return rpn_cls_prob[i:i + 1], rpn_bbox_pred[i:i + 1], self._anchor_grid
+        height, width = min(im_height, height), min(im_width, width)
+        anchor_grid = get_anchor_grid(height, width, self._feat_stride, self._anchor_scales,
+                                      self._anchor_ratios, self._device)
+        return rpn_cls_prob[i:i + 1, :height, :width].contiguous(), \
+            rpn_bbox_pred[i:i + 1, :height, :width].contiguous(), anchor_grid
+
     def _proposal_top_layer(self, rpn_cls_prob, rpn_bbox_pred):
-        rois, rpn_scores = proposal_top_layer( \
-            rpn_cls_prob, rpn_bbox_pred, self._im_info,
-            self._feat_stride, self._anchors, self._num_anchors)
-        return rois, rpn_scores
+        rois, rpn_scores = [], []
+        for i in range(self._num_images):
+            im_cls_prob, im_bbox_pred, anchor_grid = self._image_rpn_outputs(rpn_cls_prob, rpn_bbox_pred, i)
+            im_rois, im_scores = proposal_top_layer( \
+                im_cls_prob, im_bbox_pred, self._im_infos[i],
+                self._feat_stride, anchor_grid.anchors, self._num_anchors, anchor_grid.geometry)
+            # Index of the image in the batch, for the RoI ops
+            im_rois[:, 0] = i
+            rois.append(im_rois)
+            rpn_scores.append(im_scores)
+        return torch.cat(rois, 0), torch.cat(rpn_scores, 0)
 
     def _proposal_layer(self, rpn_cls_prob, rpn_bbox_pred):
-        rois, rpn_scores = proposal_layer( \
-            rpn_cls_prob, rpn_bbox_pred, self._im_info, self._mode,
-            self._feat_stride, self._anchors, self._num_anchors)
-
-        return rois, rpn_scores
+        rois, rpn_scores = [], []
+        for i in range(self._num_images):
+            im_cls_prob, im_bbox_pred, anchor_grid = self._image_rpn_outputs(rpn_cls_prob, rpn_bbox_pred, i)
+            im_rois, im_scores = proposal_layer( \
+                im_cls_prob, im_bbox_pred, self._im_infos[i], self._mode,
+                self._feat_stride, anchor_grid.anchors, self._num_anchors, anchor_grid.geometry)
+            # Index of the image in the batch, for the RoI ops
+            im_rois[:, 0] = i
+            rois.append(im_rois)
+            rpn_scores.append(im_scores)
+
+        return torch.cat(rois, 0), torch.cat(rpn_scores, 0)
+
+    def _gt_boxes_at(self, gt_boxes, i):
+        """The gt boxes of image i of the batch."""
+        return gt_boxes[self._gt_offsets[i]:self._gt_offsets[i + 1]]
 
     def _roi_pool_layer(self, bottom, rois):
-        return RoIPoolFunction(cfg.POOLING_SIZE, cfg.POOLING_SIZE, 1. / 16.)(bottom, rois)
+        return roi_pool(bottom, rois, cfg.POOLING_SIZE, cfg.POOLING_SIZE, 1. / 16.)
 
     def _crop_pool_layer(self, bottom, rois, max_pool=True):
         # implement it using stn
@@ -229,65 +267,117 @@ class Network(nn.Module):
         height = bottom.size(2)
         width = bottom.size(3)
 
-        pre_pool_size = cfg.POOLING_SIZE * 2 if max_pool else cfg.POOLING_SIZE
-        crops = CropAndResizeFunction(pre_pool_size, pre_pool_size)(bottom,
-                                                                    torch.cat([y1 / (height - 1), x1 / (width - 1),
-                                                                               y2 / (height - 1), x2 / (width - 1)], 1),
-                                                                    rois[:, 0].int())
-
+        boxes = torch.cat([y1 / (height - 1), x1 / (width - 1),
+                           y2 / (height - 1), x2 / (width - 1)], 1)
         if max_pool:
-            crops = F.max_pool2d(crops, 2, 2)
-        return crops
+            # Crops of twice the pooling size, max pooled 2x2
+            return crop_and_resize_max_pool(bottom, boxes, rois[:, 0].int(), cfg.POOLING_SIZE, cfg.POOLING_SIZE)
+        return crop_and_resize(bottom, boxes, rois[:, 0].int(), cfg.POOLING_SIZE, cfg.POOLING_SIZE)
 
     def _anchor_target_layer(self, rpn_cls_score):
-        rpn_labels, rpn_bbox_targets, rpn_bbox_inside_weights, rpn_bbox_outside_weights = \
-            anchor_target_layer(
-                rpn_cls_score.data, self._gt_boxes.data.cpu().numpy(), self._im_info, self._feat_stride,
-                self._anchors.data.cpu().numpy(), self._num_anchors)
-
-        rpn_labels = torch.from_numpy(rpn_labels).float().to(self._device)  # .set_shape([1, 1, None, None])
-        rpn_bbox_targets = torch.from_numpy(rpn_bbox_targets).float().to(
-            self._device)  # .set_shape([1, None, None, self._num_anchors * 4])
-        rpn_bbox_inside_weights = torch.from_numpy(rpn_bbox_inside_weights).float().to(
-            self._device)  # .set_shape([1, None, None, self._num_anchors * 4])
-        rpn_bbox_outside_weights = torch.from_numpy(rpn_bbox_outside_weights).float().to(
-            self._device)  # .set_shape([1, None, None, self._num_anchors * 4])
-
-        rpn_labels = rpn_labels.long()
-        self._anchor_targets['rpn_labels'] = rpn_labels
-        self._anchor_targets['rpn_bbox_targets'] = rpn_bbox_targets
-        self._anchor_targets['rpn_bbox_inside_weights'] = rpn_bbox_inside_weights
-        self._anchor_targets['rpn_bbox_outside_weights'] = rpn_bbox_outside_weights
-
-        for k in self._anchor_targets.keys():
+        # Use the targets computed by the data layer if they match the feature map
+        height, width = rpn_cls_score.shape[1:3]
+        if cfg.TRAIN.SPARSE_RPN_LOSS:
+            return self._anchor_target_layer_sparse(height, width)
+
+        if self._blob_anchor_targets is not None and \
+                self._blob_anchor_targets['rpn_labels'].shape[2:] == (self._num_anchors * height, width):
+            for k, v in self._blob_anchor_targets.items():
+                target = torch.from_numpy(v).float().to(self._device)
+                self._anchor_targets[k] = target.long() if k.startswith('rpn_labels') else target
+            for k in self._anchor_targets.keys():
+                self._score_summaries[k] = self._anchor_targets[k]
+            return self._anchor_targets['rpn_labels']
+
+        if cfg.TRAIN.TORCH_ANCHOR_TARGETS:
+            return self._anchor_target_layer_torch(height, width)
+
+        # Targets of the images of the batch, stacked along the first axis. In mix-training,
+        # those of gt_boxes2 are computed in the same pass over the anchors.
+        gt_boxes = self._gt_boxes.data.cpu().numpy()
+        gt_sets = [[self._gt_boxes_at(gt_boxes, i)] for i in range(self._num_images)]
+        if cfg.MIX_TRAINING:
+            gt_sets[0].append(self._gt_boxes2.data.cpu().numpy())
+        im_targets = [anchor_targets_sets(
+            height, width, gt_sets[i], self._im_infos[i], self._anchor_grid.anchors_np, self._num_anchors,
+            self._anchor_grid.inds_inside(*self._im_infos[i][:2])) for i in range(self._num_images)]
+        targets = [torch.from_numpy(np.concatenate(t)).to(self._device) for t in zip(*im_targets)]
+        return self._store_anchor_targets(targets, len(gt_sets[0]))
+
+    def _anchor_target_layer_torch(self, height, width):
+        """Same as _anchor_target_layer, computed on the device of the network."""
+        gt_sets = [[self._gt_boxes_at(self._gt_boxes, i)] for i in range(self._num_images)]
+        if cfg.MIX_TRAINING:
+            gt_sets[0].append(self._gt_boxes2)
+        im_targets = [anchor_targets_torch_sets(
+            height, width, gt_sets[i], self._im_infos[i], self._anchors, self._num_anchors,
+            self._anchor_grid.inds_inside_tensor(*self._im_infos[i][:2])) for i in range(self._num_images)]
+        targets = [torch.cat(t, 0) for t in zip(*im_targets)]
+        return self._store_anchor_targets(targets, len(gt_sets[0]))
+
+    def _anchor_target_layer_sparse(self, height, width):
+        """Targets of the anchors sampled by _anchor_target_layer_torch only.
+
+        For each gt set, 'rpn_inds' are the indices of the sampled anchors among the anchors
+        of all the images of the batch, image after image in the order of self._anchors, and
+        'rpn_labels' and the bbox targets and weights have one row per sampled anchor.
+        """
+        gt_sets = [[self._gt_boxes_at(self._gt_boxes, i)] for i in range(self._num_images)]
+        if cfg.MIX_TRAINING:
+            gt_sets[0].append(self._gt_boxes2)
+        im_targets = [anchor_targets_torch_sets(
+            height, width, gt_sets[i], self._im_infos[i], self._anchors, self._num_anchors,
+            self._anchor_grid.inds_inside_tensor(*self._im_infos[i][:2]), sparse=True)
+            for i in range(self._num_images)]
+
+        names = ['rpn_inds', 'rpn_labels', 'rpn_bbox_targets', 'rpn_bbox_inside_weights',
+                 'rpn_bbox_outside_weights']
+        for j, suffix in enumerate(['', '2'][:len(gt_sets[0])]):
+            set_targets = [list(targets[j]) for targets in im_targets]
+            for i, targets in enumerate(set_targets):
+                targets[0] = targets[0] + i * self._anchor_length
+            for name, target in zip(names, zip(*set_targets)):
+                target = torch.cat(target, 0)
+                self._anchor_targets[name + suffix] = target.long() if name == 'rpn_labels' else target
+
+        for k in names:
             self._score_summaries[k] = self._anchor_targets[k]
 
-        if cfg.MIX_TRAINING:
-            rpn_labels2, rpn_bbox_targets2, rpn_bbox_inside_weights2, rpn_bbox_outside_weights2 = \
-                anchor_target_layer(
-                    rpn_cls_score.data, self._gt_boxes2.data.cpu().numpy(), self._im_info, self._feat_stride,
-                    self._anchors.data.cpu().numpy(), self._num_anchors)
-
-            rpn_labels2 = torch.from_numpy(rpn_labels2).float().to(self._device)  # .set_shape([1, 1, None, None])
-            rpn_bbox_targets2 = torch.from_numpy(rpn_bbox_targets2).float().to(
-                self._device)  # .set_shape([1, None, None, self._num_anchors * 4])
-            rpn_bbox_inside_weights2 = torch.from_numpy(rpn_bbox_inside_weights2).float().to(
-                self._device)  # .set_shape([1, None, None, self._num_anchors * 4])
-            rpn_bbox_outside_weights2 = torch.from_numpy(rpn_bbox_outside_weights2).float().to(
-                self._device)  # .set_shape([1, None, None, self._num_anchors * 4])
-
-            rpn_labels2 = rpn_labels2.long()
-            self._anchor_targets['rpn_labels2'] = rpn_labels2
-            self._anchor_targets['rpn_bbox_targets2'] = rpn_bbox_targets2
-            self._anchor_targets['rpn_bbox_inside_weights2'] = rpn_bbox_inside_weights2
-            self._anchor_targets['rpn_bbox_outside_weights2'] = rpn_bbox_outside_weights2
-
-        return rpn_labels
+        return self._anchor_targets['rpn_labels']
+
+    def _store_anchor_targets(self, targets, num_sets):
+        """Store the stacked (labels, bbox targets, inside weights, outside weights) of the anchors.
+
+        With a single gt set, the rows are the images of the batch. With the two gt sets of
+        mix-training, there is one image and the rows are the sets, the second one getting the
+        '2' suffix.
+        """
+        names = ['rpn_labels', 'rpn_bbox_targets', 'rpn_bbox_inside_weights', 'rpn_bbox_outside_weights']
+        for name, target in zip(names, targets):
+            target = target.float()
+            for j, suffix in enumerate(['', '2'][:num_sets]):
+                set_target = target if num_sets == 1 else target[j:j + 1]
+                self._anchor_targets[name + suffix] = \
+                    set_target.long() if name == 'rpn_labels' else set_target
+
+        for k in names:
+            self._score_summaries[k] = self._anchor_targets[k]
+
+        return self._anchor_targets['rpn_labels']
 
     def _proposal_target_layer(self, rois, roi_scores):
+        # Sample the RoIs of each image of the batch among its own proposals
+        im_targets = []
+        for i in range(self._num_images):
+            inds = (rois[:, 0] == i).nonzero().view(-1)
+            targets = proposal_target_layer(
+                rois[inds], roi_scores[inds], self._gt_boxes_at(self._gt_boxes, i), self._num_classes,
+                self._num_images)
+            # gt boxes appended to the proposals have a zero batch index
+            targets[0][:, 0] = i
+            im_targets.append(targets)
         rois, roi_scores, labels, bbox_targets, bbox_inside_weights, bbox_outside_weights = \
-            proposal_target_layer(
-                rois, roi_scores, self._gt_boxes, self._num_classes)
+            [torch.cat(targets, 0) for targets in zip(*im_targets)]
 
         self._proposal_targets['rois'] = rois
         self._proposal_targets['labels'] = labels.long()
@@ -304,11 +394,22 @@ class Network(nn.Module):
         # just to get the shape right
         # height = int(math.ceil(self._im_info.data[0, 0] / self._feat_stride[0]))
         # width = int(math.ceil(self._im_info.data[0, 1] / self._feat_stride[0]))
-        anchors, anchor_length = generate_anchors_pre( \
+        # The anchors of a feature map size are only generated and moved to the device once
+        self._anchor_grid = get_anchor_grid( \
             height, width,
-            self._feat_stride, self._anchor_scales, self._anchor_ratios)
-        self._anchors = torch.from_numpy(anchors).to(self._device)
-        self._anchor_length = anchor_length
+            self._feat_stride, self._anchor_scales, self._anchor_ratios, self._device)
+        self._anchors = self._anchor_grid.anchors
+        self._anchor_length = self._anchor_grid.length
+
+    def _feat_map_size(self, height, width):
+        """Size of the head feature map for an input image blob of size (height, width).
+
+        Every stride 2 layer of the backbone pads so that the size is rounded up.
+        """
+        for _ in range(int(round(math.log(self._feat_stride[0], 2)))):
+            height = (height + 1) // 2
+            width = (width + 1) // 2
+        return height, width
 
     def _smooth_l1_loss(self, bbox_pred, bbox_targets, bbox_inside_weights, bbox_outside_weights, sigma=1.0, dim=[1]):
         sigma_2 = sigma ** 2
@@ -325,8 +426,43 @@ class Network(nn.Module):
         loss_box = loss_box.mean()
         return loss_box
 
+    def _sparse_rpn_losses(self, suffix='', sigma_rpn=3.0):
+        """RPN class and bbox losses of the sampled anchors of a gt set (cfg.TRAIN.SPARSE_RPN_LOSS).
+
+        Only the predictions of the sampled anchors are gathered, the losses are the same as
+        those computed over the dense maps.
+        """
+        inds = self._anchor_targets['rpn_inds' + suffix]
+
+        # RPN, class loss
+        # The scores are ordered (image, anchor, height, width), the anchors (image, height, width, anchor)
+        image, anchor = inds // self._anchor_length, inds % self._anchor_length
+        score_inds = image * self._anchor_length + \
+            (anchor % self._num_anchors) * (self._anchor_length // self._num_anchors) + anchor // self._num_anchors
+        rpn_cls_score = self._predictions['rpn_cls_score_reshape'].view(-1, 2).index_select(0, score_inds)
+        rpn_cross_entropy = F.cross_entropy(rpn_cls_score, self._anchor_targets['rpn_labels' + suffix])
+
+        # RPN, bbox loss, summed over the anchors of each image and averaged over the images
+        rpn_bbox_pred = self._predictions['rpn_bbox_pred'].view(-1, 4).index_select(0, inds)
+        rpn_loss_box = self._smooth_l1_loss(rpn_bbox_pred, self._anchor_targets['rpn_bbox_targets' + suffix],
+                                            self._anchor_targets['rpn_bbox_inside_weights' + suffix],
+                                            self._anchor_targets['rpn_bbox_outside_weights' + suffix],
+                                            sigma=sigma_rpn, dim=[0, 1]) / self._num_images
+        return rpn_cross_entropy, rpn_loss_box
+
     def _add_losses(self, sigma_rpn=3.0):
-        if self.mix_training == False:
+        if cfg.TRAIN.SPARSE_RPN_LOSS:
+            if self.mix_training == False:
+                rpn_cross_entropy, rpn_loss_box = self._sparse_rpn_losses(sigma_rpn=sigma_rpn)
+            elif cfg.MIX_TEST:
+                print("WARNING: Just for TEST CODE")
+                rpn_cross_entropy, rpn_loss_box = self._sparse_rpn_losses('2', sigma_rpn)
+            else:
+                rpn_cross_entropy1, rpn_loss_box1 = self._sparse_rpn_losses(sigma_rpn=sigma_rpn)
+                rpn_cross_entropy2, rpn_loss_box2 = self._sparse_rpn_losses('2', sigma_rpn)
+                rpn_cross_entropy = tmp_lam * rpn_cross_entropy1 + (1 - tmp_lam) * rpn_cross_entropy2
+                rpn_loss_box = tmp_lam * rpn_loss_box1 + (1 - tmp_lam) * rpn_loss_box2
+        elif self.mix_training == False:
 
             # RPN, class loss
             rpn_cls_score = self._predictions['rpn_cls_score_reshape'].view(-1, 2)
@@ -451,7 +587,7 @@ class Network(nn.Module):
         rpn_cls_score = self.rpn_cls_score_net(rpn)  # batch * (num_anchors * 2) * h * w
 
         # change it so that the score has 2 as its channel size
-        rpn_cls_score_reshape = rpn_cls_score.view(1, 2, -1,
+        rpn_cls_score_reshape = rpn_cls_score.view(rpn_cls_score.size(0), 2, -1,
                                                    rpn_cls_score.size()[-1])  # batch * 2 * (num_anchors*h) * w
         rpn_cls_prob_reshape = F.softmax(rpn_cls_score_reshape, dim=1)
 
@@ -609,18 +745,35 @@ class Network(nn.Module):
         # for k in self._predictions.keys():
         #   self._score_summaries[k] = self._predictions[k]
 
-    def forward(self, image, im_info, gt_boxes=None, gt_boxes2=None, mode='TRAIN'):
+    def forward(self, image, im_info, gt_boxes=None, gt_boxes2=None, mode='TRAIN', anchor_targets=None,
+                num_gt_boxes=None):
+        # A batch holds image.shape[0] images. im_info has one (height, width, scale) row per
+        # image, and the gt boxes of each image follow those of the previous one in gt_boxes,
+        # num_gt_boxes giving their number per image.
+        self._num_images = image.shape[0]
+        self._im_infos = np.asarray(im_info, dtype=np.float32).reshape(-1, 3)
+        assert self._im_infos.shape[0] == self._num_images, "One im_info per image"
+        if gt_boxes is not None:
+            if num_gt_boxes is None:
+                assert self._num_images == 1, "num_gt_boxes is needed for several images"
+                num_gt_boxes = [gt_boxes.shape[0]]
+            self._gt_offsets = np.concatenate(([0], np.cumsum(num_gt_boxes))).astype(np.int64)
+        if cfg.MIX_TRAINING or cfg.RCNN_MIX:
+            assert self._num_images == 1, "Mix-training uses a single image per batch"
 
         ### RPN_mix holder ???
         self._image_gt_summaries['image'] = image
-        self._image_gt_summaries['gt_boxes'] = gt_boxes
+        self._image_gt_summaries['gt_boxes'] = \
+            gt_boxes[:self._gt_offsets[1]] if gt_boxes is not None else None
         self._image_gt_summaries['im_info'] = im_info
 
         # mix-training
-        self._image = torch.from_numpy(image.transpose([0, 3, 1, 2])).to(self._device)
+        self._image = self._image_to_tensor(image, self._im_infos)
         self._im_info = im_info  # No need to change; actually it can be an list
         self._gt_boxes = torch.from_numpy(gt_boxes).to(self._device) if gt_boxes is not None else None
         self._gt_boxes2 = torch.from_numpy(gt_boxes2).to(self._device) if gt_boxes2 is not None else None
+        # Anchor targets precomputed by the data layer, if any
+        self._blob_anchor_targets = anchor_targets
         if cfg.MIX_TEST:
             assert self._gt_boxes == None, "TEST: GT_BOXES 1 is NONE "
             assert self._gt_boxes2 == None, "TEST: GT_BOXES 2 is NONE "
@@ -656,10 +809,36 @@ class Network(nn.Module):
         normal_init(self.cls_score_net, 0, 0.01, cfg.TRAIN.TRUNCATED)
         normal_init(self.bbox_pred_net, 0, 0.001, cfg.TRAIN.TRUNCATED)
 
+    def _image_to_tensor(self, image, im_infos=None):
+        if isinstance(image, torch.Tensor):
+            # NCHW blob of the fused preprocessing, taken as is
+            image = image.to(self._device, non_blocking=True)
+        elif image.dtype == np.uint8:
+            # Copy the uint8 blob to the device before anything else
+            image = torch.from_numpy(image).to(self._device).permute(0, 3, 1, 2)
+        else:
+            return torch.from_numpy(image.transpose([0, 3, 1, 2])).to(self._device)
+        if image.dtype == torch.uint8:
+            image = self._normalize_image(image, im_infos)
+        return image
+
+    def _normalize_image(self, image, im_infos=None):
+        """Float conversion and mean subtraction of a uint8 NCHW blob, the first op of the network.
+
+        The padding of the images, given by im_infos, is zeroed like in float blobs.
+        """
+        means = torch.from_numpy(cfg.PIXEL_MEANS.reshape(1, 3, 1, 1)).to(image.device, torch.float32)
+        image = image.float().sub_(means)
+        if im_infos is not None:
+            for i, (height, width) in enumerate(np.round(im_infos[:, :2]).astype(np.int64)):
+                image[i, :, height:, :] = 0
+                image[i, :, :height, width:] = 0
+        return image
+
     # Extract the head feature maps, for example for vgg16 it is conv5_3
     # only useful during testing mode
     def extract_head(self, image):
-        feat = self._layers["head"](torch.from_numpy(image.transpose([0, 3, 1, 2])).to(self._device))
+        feat = self._layers["head"](self._image_to_tensor(image))
         return feat
 
     # only useful during testing mode
@@ -681,7 +860,7 @@ class Network(nn.Module):
 
     def get_summary(self, blobs):
         self.eval()
-        self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'])
+        self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], num_gt_boxes=blobs.get('num_gt_boxes'))
         # self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['gt_boxes2'])
         self.train()
         summary = self._run_summary_op(True)
@@ -689,7 +868,8 @@ class Network(nn.Module):
         return summary
 
     def train_step(self, blobs, train_op):
-        self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['gt_boxes2'])
+        self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['gt_boxes2'],
+                     anchor_targets=blobs.get('anchor_targets'), num_gt_boxes=blobs.get('num_gt_boxes'))
         if cfg.RPN_MIX_ONLY:
             rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss = self._losses["rpn_cross_entropy"].item(), \
                                                                    self._losses['rpn_loss_box'].item(), \
@@ -714,7 +894,8 @@ class Network(nn.Module):
     def train_step_with_summary(self, blobs, train_op):
         # self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'])
         raise NotImplementedError("[DEBUG] This module is under coding ...")
-        self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['gt_boxes2'])
+        self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['gt_boxes2'],
+                     anchor_targets=blobs.get('anchor_targets'), num_gt_boxes=blobs.get('num_gt_boxes'))
         rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss = self._losses["rpn_cross_entropy"].item(), \
                                                                self._losses['rpn_loss_box'].item(), \
                                                                self._losses['cross_entropy'].item(), \
@@ -731,7 +912,8 @@ class Network(nn.Module):
 
     def train_step_no_return(self, blobs, train_op):
         # self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'])
-        self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['gt_boxes2'])
+        self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['gt_boxes2'],
+                     anchor_targets=blobs.get('anchor_targets'), num_gt_boxes=blobs.get('num_gt_boxes'))
         train_op.zero_grad()
         self._losses['total_loss'].backward()
         train_op.step()
@@ -37,6 +37,13 @@ class vgg16(Network):
     # not using the last maxpool layer
     self._layers['head'] = nn.Sequential(*list(self.vgg.features._modules.values())[:-1])
 
+  def _feat_map_size(self, height, width):
+    # The max-pooling layers round down
+    for _ in range(4):
+      height = height // 2
+      width = width // 2
+    return height, width
+
   def _image_to_head(self):
     net_conv = self._layers['head'](self._image)
     self._act_summaries['conv'] = net_conv
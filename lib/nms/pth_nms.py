@@ -1,28 +1,116 @@
 import torch
-from ._ext import nms
 import numpy as np
 
-def pth_nms(dets, thresh):
+try:
+  # Torch C++ extension, built by setup.py
+  from . import _nms_cpu
+except ImportError:
+  _nms_cpu = None
+
+try:
+  # Legacy ffi extension, built by build.py
+  from ._ext import nms
+except ImportError:
+  nms = None
+
+# Number of rows of the suppression matrix computed at once by torch_nms
+_TORCH_NMS_ROWS = 1024
+
+
+def cpp_cpu_nms(dets, thresh):
   """
-  dets has to be a tensor
+  CPU NMS of the C++ extension, parallel over the boxes
   """
-  if not dets.is_cuda:
-    x1 = dets[:, 0]
-    y1 = dets[:, 1]
-    x2 = dets[:, 2]
-    y2 = dets[:, 3]
-    scores = dets[:, 4]
+  order = dets[:, 4].sort(0, descending=True)[1]
+  boxes = dets[order, :4].float().contiguous()
+  keep = torch.LongTensor(boxes.size(0))
+  num_out = _nms_cpu.cpu_nms(keep, boxes, thresh)
+  return order[keep[:num_out]].contiguous()
 
-    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
-    order = scores.sort(0, descending=True)[1]
-    # order = torch.from_numpy(np.ascontiguousarray(scores.numpy().argsort()[::-1])).long()
 
-    keep = torch.LongTensor(dets.size(0))
-    num_out = torch.LongTensor(1)
-    nms.cpu_nms(keep, num_out, dets, order, areas, thresh)
+def cpp_batched_nms(dets, labels, thresh):
+  """
+  CPU NMS of the C++ extension within each label, in one call
+  """
+  # Blocks of labels, by decreasing score within a block
+  order = torch.from_numpy(np.lexsort((-dets[:, 4].numpy(), labels.numpy())))
+  boxes = dets[order, :4].float().contiguous()
+  keep = torch.LongTensor(boxes.size(0))
+  num_out = _nms_cpu.cpu_batched_nms(keep, boxes, labels[order].long().contiguous(), thresh)
+  return order[keep[:num_out]].contiguous()
+
 
-    return keep[:num_out[0]]
+def ffi_cpu_nms(dets, thresh):
+  """
+  CPU NMS of the ffi extension
+  """
+  x1 = dets[:, 0]
+  y1 = dets[:, 1]
+  x2 = dets[:, 2]
+  y2 = dets[:, 3]
+  scores = dets[:, 4]
+
+  areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+  order = scores.sort(0, descending=True)[1]
+  # order = torch.from_numpy(np.ascontiguousarray(scores.numpy().argsort()[::-1])).long()
+
+  keep = torch.LongTensor(dets.size(0))
+  num_out = torch.LongTensor(1)
+  nms.cpu_nms(keep, num_out, dets, order, areas, thresh)
+
+  return keep[:num_out[0]]
+
+
+def torch_nms(dets, thresh):
+  """
+  Pure torch NMS with the semantics of the extensions, used when none is
+  built. The suppression matrix of the sorted boxes is computed by blocks of
+  rows and swept in order.
+  """
+  scores = dets[:, 4]
+  order = scores.sort(0, descending=True)[1]
+  boxes = dets[order, :4].float().contiguous()
+  x1, y1, x2, y2 = boxes.t()
+  areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+
+  num = boxes.size(0)
+  removed = np.zeros(num, dtype=bool)
+  keep = []
+  for start in range(0, num, _TORCH_NMS_ROWS):
+    end = min(start + _TORCH_NMS_ROWS, num)
+    w = (torch.min(x2[start:end, None], x2[None]) -
+         torch.max(x1[start:end, None], x1[None]) + 1).clamp(min=0)
+    h = (torch.min(y2[start:end, None], y2[None]) -
+         torch.max(y1[start:end, None], y1[None]) + 1).clamp(min=0)
+    inter = w * h
+    ovr = inter / (areas[start:end, None] + areas[None] - inter)
+    suppress = (ovr >= thresh).cpu().numpy()
+    for i in range(start, end):
+      if removed[i]:
+        continue
+      keep.append(i)
+      removed[i + 1:] |= suppress[i - start, i + 1:]
+
+  keep = torch.from_numpy(np.array(keep, dtype=np.int64)).to(order.device)
+  return order[keep].contiguous()
+
+
+def pth_nms(dets, thresh):
+  """
+  dets has to be a tensor
+  """
+  if not dets.is_cuda:
+    if dets.size(0) == 0:
+      return torch.zeros(0, dtype=torch.long)
+    if _nms_cpu is not None:
+      return cpp_cpu_nms(dets, thresh)
+    if nms is not None:
+      return ffi_cpu_nms(dets, thresh)
+    return torch_nms(dets, thresh)
   else:
+    if nms is None:
+      return torch_nms(dets, thresh)
+
     x1 = dets[:, 0]
     y1 = dets[:, 1]
     x2 = dets[:, 2]
@@ -44,3 +132,18 @@ def pth_nms(dets, thresh):
     return order[keep[:num_out[0]].cuda()].contiguous()
     # return order[keep[:num_out[0]]].contiguous()
 
+
+def pth_batched_nms(dets, labels, thresh):
+  """
+  NMS of dets within each of their labels, the kept indices are grouped by
+  label. dets has to be a tensor, labels an integer tensor on its device
+  """
+  if dets.size(0) == 0:
+    return torch.zeros(0, dtype=torch.long, device=dets.device)
+  if not dets.is_cuda and _nms_cpu is not None:
+    return cpp_batched_nms(dets, labels, thresh)
+  keep = []
+  for label in torch.unique(labels):
+    inds = (labels == label).nonzero().view(-1)
+    keep.append(inds[pth_nms(dets[inds].contiguous(), thresh)])
+  return torch.cat(keep, 0)
@@ -0,0 +1,17 @@
+# Build the CPU NMS extension next to pth_nms.py:
+#   python setup.py build_ext --inplace
+from setuptools import setup
+from torch.utils.cpp_extension import BuildExtension, CppExtension
+
+setup(
+    name='nms_cpu',
+    ext_modules=[
+        CppExtension(
+            '_nms_cpu',
+            sources=['src/nms_cpu.cpp'],
+            extra_compile_args=['-O3', '-fopenmp'],
+            extra_link_args=['-fopenmp'],
+        )
+    ],
+    cmdclass={'build_ext': BuildExtension}
+)
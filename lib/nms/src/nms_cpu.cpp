@@ -0,0 +1,138 @@
+// ------------------------------------------------------------------
+// Faster R-CNN
+// Licensed under The MIT License [see fast-rcnn/LICENSE for details]
+// ------------------------------------------------------------------
+// CPU non-maximum suppression as a torch C++ extension.
+//
+// Written against the C++ API of torch 0.4: the caller sorts the boxes by
+// decreasing score and allocates the output, like for the ffi extensions.
+// The boxes are copied once into a contiguous (x1, y1, x2, y2, area) array.
+// The suppression matrix is computed in parallel over the rows with OpenMP,
+// as 64 bit masks of the later boxes each box overlaps like the CUDA kernel
+// does, then swept once in order. cpu_batched_nms does the same within each
+// block of boxes of a label, so boxes of different labels are never compared.
+#include <torch/torch.h>
+
+#include <algorithm>
+#include <cstdint>
+#include <vector>
+
+// AT_CHECK of torch 0.4 is TORCH_CHECK in later versions
+#ifndef AT_CHECK
+#define AT_CHECK TORCH_CHECK
+#endif
+
+namespace {
+
+const int kBlock = 64;
+
+inline float iou(const float* a, const float* b) {
+  float w = std::max(std::min(a[2], b[2]) - std::max(a[0], b[0]) + 1.f, 0.f);
+  float h = std::max(std::min(a[3], b[3]) - std::max(a[1], b[1]) + 1.f, 0.f);
+  float inter = w * h;
+  return inter / (a[4] + b[4] - inter);
+}
+
+// Suppresses the boxes within each block [starts[b], starts[b + 1]) of the
+// sorted boxes. Writes the indices into boxes of the kept boxes to keep, block
+// after block, returns their number.
+int64_t nms_blocks(at::Tensor keep, at::Tensor boxes,
+                   const std::vector<int64_t>& starts, double thresh) {
+  AT_CHECK(boxes.dim() == 2 && boxes.size(1) == 4, "boxes must be (N, 4)");
+  AT_CHECK(boxes.is_contiguous() && keep.is_contiguous(), "boxes and keep must be contiguous");
+  AT_CHECK(keep.numel() >= boxes.size(0), "keep must have a row per box");
+  const int64_t num = boxes.size(0);
+
+  const float* src = boxes.data<float>();
+  std::vector<float> data(num * 5);
+  for (int64_t i = 0; i < num; ++i) {
+    const float* s = src + i * 4;
+    float* b = data.data() + i * 5;
+    std::copy(s, s + 4, b);
+    b[4] = (s[2] - s[0] + 1.f) * (s[3] - s[1] + 1.f);
+  }
+
+  // Block of each box, the masks of a row only cover the boxes of its block
+  const int64_t num_blocks = static_cast<int64_t>(starts.size()) - 1;
+  std::vector<int64_t> block_of(num);
+  int64_t max_len = 0;
+  for (int64_t b = 0; b < num_blocks; ++b) {
+    std::fill(block_of.begin() + starts[b], block_of.begin() + starts[b + 1], b);
+    max_len = std::max(max_len, starts[b + 1] - starts[b]);
+  }
+
+  const float t = static_cast<float>(thresh);
+  const int64_t col_blocks = (max_len + kBlock - 1) / kBlock;
+  std::vector<uint64_t> mask(num * col_blocks, 0);
+  #pragma omp parallel for schedule(dynamic, 16)
+  for (int64_t i = 0; i < num; ++i) {
+    const int64_t start = starts[block_of[i]];
+    const int64_t end = starts[block_of[i] + 1];
+    const float* a = data.data() + i * 5;
+    uint64_t* row = mask.data() + i * col_blocks;
+    for (int64_t j = i + 1; j < end; ++j) {
+      if (iou(a, data.data() + j * 5) >= t) {
+        row[(j - start) / kBlock] |= 1ULL << ((j - start) % kBlock);
+      }
+    }
+  }
+
+  int64_t* keep_data = keep.data<int64_t>();
+  int64_t num_to_keep = 0;
+  std::vector<uint64_t> removed(col_blocks);
+  for (int64_t b = 0; b < num_blocks; ++b) {
+    const int64_t start = starts[b];
+    const int64_t len = starts[b + 1] - start;
+    const int64_t len_blocks = (len + kBlock - 1) / kBlock;
+    std::fill(removed.begin(), removed.end(), 0);
+    for (int64_t r = 0; r < len; ++r) {
+      if (removed[r / kBlock] & (1ULL << (r % kBlock))) {
+        continue;
+      }
+      keep_data[num_to_keep++] = start + r;
+      const uint64_t* row = mask.data() + (start + r) * col_blocks;
+      for (int64_t k = r / kBlock; k < len_blocks; ++k) {
+        removed[k] |= row[k];
+      }
+    }
+  }
+  return num_to_keep;
+}
+
+}  // namespace
+
+// boxes: (N, 4) float boxes sorted by decreasing score, keep: (N,) long.
+// Writes the indices into boxes of the kept boxes to keep, returns their number.
+int64_t cpu_nms(at::Tensor keep, at::Tensor boxes, double thresh) {
+  return nms_blocks(keep, boxes, {0, boxes.size(0)}, thresh);
+}
+
+// boxes: (N, 4) float boxes sorted by label, then by decreasing score within
+// a label, labels: (N,) long labels of the boxes, keep: (N,) long.
+// Writes the indices into boxes of the kept boxes to keep, label after label,
+// returns their number.
+int64_t cpu_batched_nms(at::Tensor keep, at::Tensor boxes, at::Tensor labels,
+                        double thresh) {
+  AT_CHECK(labels.dim() == 1 && labels.size(0) == boxes.size(0),
+           "labels must have a row per box");
+  AT_CHECK(labels.is_contiguous(), "labels must be contiguous");
+  const int64_t num = labels.size(0);
+  const int64_t* label_data = labels.data<int64_t>();
+  std::vector<int64_t> starts(1, 0);
+  for (int64_t i = 1; i < num; ++i) {
+    AT_CHECK(label_data[i - 1] <= label_data[i], "boxes must be sorted by label");
+    if (label_data[i] != label_data[i - 1]) {
+      starts.push_back(i);
+    }
+  }
+  if (num > 0) {
+    starts.push_back(num);
+  }
+  return nms_blocks(keep, boxes, starts, thresh);
+}
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
+  m.def("cpu_nms", &cpu_nms, "Non-maximum suppression of sorted (N, 4) CPU boxes");
+  m.def("cpu_batched_nms", &cpu_batched_nms,
+        "Non-maximum suppression within each label of sorted (N, 4) CPU boxes");
+}
@@ -0,0 +1,70 @@
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Order training images in batches of similar shape to limit padding.
+
+The images of a minibatch are padded to the largest of them, so batches are
+formed among images whose resized shapes fall in the same bucket.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+try:
+  from utils.blob import get_im_scale
+except:
+  from lib.utils.blob import get_im_scale
+
+
+def resized_shapes(heights, widths, target_size, max_size):
+  """Return the (N, 2) shapes of the images once resized for the blob."""
+  shapes = np.empty((len(heights), 2), dtype=np.int64)
+  for i in range(len(heights)):
+    im_scale = get_im_scale((heights[i], widths[i]), target_size, max_size)
+    shapes[i] = np.round(np.array([heights[i], widths[i]]) * im_scale)
+  return shapes
+
+
+def bucket_batches(shapes, ims_per_batch, step):
+  """Return a permutation of the images made of batches of ims_per_batch.
+
+  Images are bucketed by their shapes rounded up to a multiple of step and
+  batches are drawn within a bucket. The images left over by the buckets are
+  sorted by aspect ratio and batched together. The batches are shuffled with
+  np.random, so the permutation is reproducible given its seed. A last,
+  incomplete batch is kept at the end so that batches stay aligned on
+  multiples of ims_per_batch.
+  """
+  keys = (shapes + step - 1) // step
+  batches = []
+  leftovers = []
+  for key in np.unique(keys, axis=0):
+    inds = np.random.permutation(np.where((keys == key).all(axis=1))[0])
+    num_full = len(inds) // ims_per_batch * ims_per_batch
+    batches.extend(inds[:num_full].reshape(-1, ims_per_batch))
+    leftovers.extend(inds[num_full:])
+
+  leftovers = np.array(leftovers, dtype=np.int64)
+  ratios = shapes[leftovers, 1] / shapes[leftovers, 0]
+  leftovers = leftovers[np.argsort(ratios, kind='mergesort')]
+  num_full = len(leftovers) // ims_per_batch * ims_per_batch
+  for start in range(0, num_full, ims_per_batch):
+    batches.append(leftovers[start:start + ims_per_batch])
+
+  order = np.random.permutation(len(batches))
+  return np.concatenate([batches[i] for i in order] +
+                        [leftovers[num_full:]]).astype(np.int64)
+
+
+def padding_waste(shapes, perm, ims_per_batch):
+  """Return the fraction of the padded blobs of perm that is padding."""
+  total = 0
+  used = 0
+  for start in range(0, len(perm), ims_per_batch):
+    batch = shapes[perm[start:start + ims_per_batch]]
+    total += batch[:, 0].max() * batch[:, 1].max() * len(batch)
+    used += (batch[:, 0] * batch[:, 1]).sum()
+  return 1. - float(used) / max(total, 1)
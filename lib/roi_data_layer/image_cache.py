@@ -0,0 +1,95 @@
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Cache of decoded and resized training images."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+
+class ImageCache(object):
+  """Decoded and resized images, keyed by (path, target size, max size, flipped).
+
+  Images are kept as uint8 arrays in an in-memory LRU tier bounded by
+  max_bytes and, if cache_dir is given, in an on-disk tier of .npy files
+  that is shared by the prefetching workers and reused across runs. The
+  on-disk files are also keyed by the size and modification time of the
+  source image (the first element of the key).
+  """
+
+  def __init__(self, max_bytes, cache_dir=None):
+    self._max_bytes = max_bytes
+    self._cache_dir = cache_dir
+    self._images = OrderedDict()
+    self._bytes = 0
+    if self._cache_dir and not os.path.exists(self._cache_dir):
+      try:
+        os.makedirs(self._cache_dir)
+      except OSError:
+        # Created by another worker in the meantime
+        assert os.path.isdir(self._cache_dir)
+
+  def _disk_path(self, key):
+    # The size and modification time of the source image are part of the
+    # name, so that an image replaced since it was cached is read again
+    try:
+      stat = os.stat(key[0])
+      source = (stat.st_size, stat.st_mtime)
+    except OSError:
+      source = None
+    name = hashlib.md5(repr((key, source)).encode('utf-8')).hexdigest()
+    return os.path.join(self._cache_dir, name[:2], name + '.npy')
+
+  def _remember(self, key, im):
+    if im.nbytes > self._max_bytes:
+      return
+    self._images[key] = im
+    self._bytes += im.nbytes
+    # Evict the least recently used images
+    while self._bytes > self._max_bytes:
+      _, old_im = self._images.popitem(last=False)
+      self._bytes -= old_im.nbytes
+
+  def get(self, key):
+    """Return the cached image for key, or None."""
+    if key in self._images:
+      # Mark as most recently used
+      im = self._images.pop(key)
+      self._images[key] = im
+      return im
+
+    if self._cache_dir:
+      path = self._disk_path(key)
+      if os.path.exists(path):
+        im = np.load(path)
+        self._remember(key, im)
+        return im
+
+    return None
+
+  def put(self, key, im):
+    """Add the uint8 image im to the cache."""
+    im = np.ascontiguousarray(im, dtype=np.uint8)
+    self._remember(key, im)
+
+    if self._cache_dir:
+      path = self._disk_path(key)
+      if not os.path.exists(path):
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+          try:
+            os.makedirs(dirname)
+          except OSError:
+            assert os.path.isdir(dirname)
+        # Write then rename, so that other processes never see partial files
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+          np.save(f, im)
+        os.rename(tmp_path, path)
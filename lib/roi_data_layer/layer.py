@@ -14,23 +14,47 @@ from __future__ import division
 from __future__ import print_function
 try:
   from model.config import cfg
-  from roi_data_layer.minibatch import get_minibatch
+  from roi_data_layer.minibatch import get_minibatch, add_anchor_targets, set_blob_buffer_reuse
+  from roi_data_layer.bucket_sampler import resized_shapes, bucket_batches, padding_waste
 except:
   from lib.model.config import cfg
-  from lib.roi_data_layer.minibatch import get_minibatch
+  from lib.roi_data_layer.minibatch import get_minibatch, add_anchor_targets, set_blob_buffer_reuse
+  from lib.roi_data_layer.bucket_sampler import resized_shapes, bucket_batches, padding_waste
 import numpy as np
 import time
+from collections import deque
+from multiprocessing import Process, Queue
+try:
+  import queue
+except ImportError:
+  import Queue as queue
 
 class RoIDataLayer(object):
   """Fast R-CNN data layer used for training."""
 
-  def __init__(self, roidb, num_classes, random=False):
-    """Set the roidb to be used by this layer during training."""
+  def __init__(self, roidb, num_classes, random=False,
+               feat_stride=None, feat_map_size=None):
+    """Set the roidb to be used by this layer during training.
+
+    feat_stride and feat_map_size (a function mapping the size of the data
+    blob to the size of the feature map) describe the network, they are needed
+    to precompute the anchor targets (cfg.TRAIN.PRECOMPUTE_ANCHOR_TARGETS).
+    """
     self._roidb = roidb
     self._num_classes = num_classes
     # Also set a random flag
     self._random = random
+    # Resized shapes of the images, for the bucketed sampling
+    self._shapes = None
+    if cfg.TRAIN.PRECOMPUTE_ANCHOR_TARGETS and feat_map_size is not None:
+      self._anchor_param = (feat_stride, feat_map_size)
+    else:
+      self._anchor_param = None
     self._shuffle_roidb_inds()
+    self._fetchers = []
+    # The validation layer (random flag) is rarely used, do not prefetch for it
+    if cfg.TRAIN.USE_PREFETCH and not self._random:
+      self._start_fetchers()
 
   def _shuffle_roidb_inds(self):
     """Randomly permute the training roidb."""
@@ -42,7 +66,9 @@ class RoIDataLayer(object):
       millis = int(round(time.time() * 1000)) % 4294967295
       np.random.seed(millis)
     
-    if cfg.TRAIN.ASPECT_GROUPING:
+    if cfg.TRAIN.BUCKET_SAMPLING:
+      self._perm = self._bucket_perm()
+    elif cfg.TRAIN.ASPECT_GROUPING:
       widths = np.array([r['width'] for r in self._roidb])
       heights = np.array([r['height'] for r in self._roidb])
       horz = (widths >= heights)
@@ -64,6 +90,23 @@ class RoIDataLayer(object):
       
     self._cur = 0
 
+  def _bucket_perm(self):
+    """Return a permutation of batches of images with similar shapes."""
+    if self._shapes is None:
+      widths = np.array([r['width'] for r in self._roidb])
+      heights = np.array([r['height'] for r in self._roidb])
+      self._shapes = resized_shapes(heights, widths, max(cfg.TRAIN.SCALES),
+                                    cfg.TRAIN.MAX_SIZE)
+    ims_per_batch = cfg.TRAIN.IMS_PER_BATCH
+    perm = bucket_batches(self._shapes, ims_per_batch, cfg.TRAIN.BUCKET_STEP)
+    if ims_per_batch > 1:
+      random_perm = np.random.RandomState(cfg.RNG_SEED).permutation(len(perm))
+      print('Bucketed sampling: padding is {:.1%} of the blobs '
+            '({:.1%} with random batches)'.format(
+              padding_waste(self._shapes, perm, ims_per_batch),
+              padding_waste(self._shapes, random_perm, ims_per_batch)))
+    return perm
+
   def _get_next_minibatch_inds(self):
     """Return the roidb indices for the next minibatch."""
     
@@ -74,29 +117,160 @@ class RoIDataLayer(object):
     if cfg.MIX_TRAINING:
       db_inds = self._perm[self._cur:self._cur + 2]
     else:
-      db_inds = self._perm[self._cur:self._cur + 1]
+      db_inds = self._perm[self._cur:self._cur + cfg.TRAIN.IMS_PER_BATCH]
 
     self._cur += cfg.TRAIN.IMS_PER_BATCH
 
     return db_inds
 
+  def _start_fetchers(self):
+    """Fork the worker processes that compute the minibatch blobs.
+
+    The workers are forked right away (before the network touches the GPU),
+    but they stay idle until the first minibatch is requested, so that
+    _perm and _cur can still be restored from a snapshot.
+    """
+    self._job_queue = Queue()
+    self._blob_queue = Queue(cfg.TRAIN.PREFETCH_QUEUE_SIZE)
+    # Jobs sent to the workers, in order, with the state after each of them
+    self._in_flight = deque()
+    # Blobs that arrived ahead of their turn
+    self._ready = {}
+    self._seq = 0
+    self._prefetch_started = False
+    # State of the random stream of the reshuffles, as consumed by the
+    # trainer (snapshotted along with _perm and _cur)
+    self._perm_rng_state = np.random.RandomState(cfg.RNG_SEED).get_state()
+    for _ in range(cfg.TRAIN.PREFETCH_PROCESSES):
+      fetcher = BlobFetcher(self._job_queue, self._blob_queue,
+                            self._roidb, self._num_classes,
+                            self._anchor_param, cfg.RNG_SEED)
+      fetcher.start()
+      self._fetchers.append(fetcher)
+
+  def _dispatch_minibatch(self):
+    """Send the indices of the next minibatch to the workers."""
+    # _perm and _cur describe what has been consumed by the trainer (this is
+    # what gets snapshotted), the workers run ahead on their own copy. The
+    # reshuffles draw from their own random stream, so that running ahead
+    # does not depend on, nor advance, the global numpy state
+    perm, cur = self._perm, self._cur
+    self._perm, self._cur = self._prefetch_perm, self._prefetch_cur
+    st0 = np.random.get_state()
+    np.random.set_state(self._prefetch_rng_state)
+    db_inds = self._get_next_minibatch_inds()
+    self._prefetch_rng_state = np.random.get_state()
+    np.random.set_state(st0)
+    self._prefetch_perm, self._prefetch_cur = self._perm, self._cur
+    self._perm, self._cur = perm, cur
+
+    self._job_queue.put((self._seq, db_inds))
+    self._in_flight.append((self._seq, self._prefetch_perm, self._prefetch_cur,
+                            self._prefetch_rng_state))
+    self._seq += 1
+
+  def _get_prefetched_minibatch(self):
+    """Return the next minibatch computed by the workers, in order."""
+    if not self._prefetch_started:
+      self._prefetch_perm, self._prefetch_cur = self._perm, self._cur
+      self._prefetch_rng_state = self._perm_rng_state
+      for _ in range(cfg.TRAIN.PREFETCH_QUEUE_SIZE):
+        self._dispatch_minibatch()
+      self._prefetch_started = True
+
+    seq, perm, cur, rng_state = self._in_flight.popleft()
+    while seq not in self._ready:
+      done_seq, blobs = self._blob_queue.get()
+      self._ready[done_seq] = blobs
+    blobs = self._ready.pop(seq)
+    self._perm, self._cur = perm, cur
+    self._perm_rng_state = rng_state
+
+    self._dispatch_minibatch()
+    return blobs
+
+  def close(self, timeout=10.):
+    """Stop the prefetching workers, if any.
+
+    A worker cannot exit before the blobs it queued are read, so the blob
+    queue is drained while they stop. The workers still alive after timeout
+    seconds are terminated.
+    """
+    if not self._fetchers:
+      return
+    for _ in self._fetchers:
+      self._job_queue.put(None)
+    deadline = time.time() + timeout
+    while any(fetcher.is_alive() for fetcher in self._fetchers) and \
+        time.time() < deadline:
+      try:
+        self._blob_queue.get(timeout=0.1)
+      except queue.Empty:
+        pass
+    for fetcher in self._fetchers:
+      if fetcher.is_alive():
+        fetcher.terminate()
+      fetcher.join()
+    self._fetchers = []
+    self._in_flight.clear()
+    self._ready.clear()
+
   def _get_next_minibatch(self):
     """Return the blobs to be used for the next minibatch.
 
     If cfg.TRAIN.USE_PREFETCH is True, then blobs will be computed in a
     separate process and made available through self._blob_queue.
     """
+    if self._fetchers:
+      return self._get_prefetched_minibatch()
+
     db_inds = self._get_next_minibatch_inds()
     if cfg.MIX_TEST:
       print("TEST: db_inds: {}|".format(db_inds))
     minibatch_db = [self._roidb[i] for i in db_inds]
-    return get_minibatch(minibatch_db, self._num_classes)
+    blobs = get_minibatch(minibatch_db, self._num_classes)
+    if self._anchor_param is not None:
+      add_anchor_targets(blobs, *self._anchor_param)
+    return blobs
       
   def forward(self):
     """Get blobs and copy them into this layer's top blob vector."""
     blobs = self._get_next_minibatch()
     return blobs
 
+
+class BlobFetcher(Process):
+  """Worker process computing minibatch blobs for the RoIDataLayer."""
+
+  def __init__(self, job_queue, blob_queue, roidb, num_classes,
+               anchor_param, seed):
+    super(BlobFetcher, self).__init__()
+    self._job_queue = job_queue
+    self._blob_queue = blob_queue
+    self._roidb = roidb
+    self._num_classes = num_classes
+    self._anchor_param = anchor_param
+    self._seed = seed
+    # Do not outlive the trainer
+    self.daemon = True
+
+  def run(self):
+    # The blobs are queued, they cannot share the memory of the next ones
+    set_blob_buffer_reuse(False)
+    while True:
+      job = self._job_queue.get()
+      if job is None:
+        break
+      seq, db_inds = job
+      # The scales are sampled from a stream of the job, not of the worker,
+      # since the jobs reach the workers in no particular order
+      np.random.seed((self._seed + seq) % 4294967295)
+      minibatch_db = [self._roidb[i] for i in db_inds]
+      blobs = get_minibatch(minibatch_db, self._num_classes)
+      if self._anchor_param is not None:
+        add_anchor_targets(blobs, *self._anchor_param)
+      self._blob_queue.put((seq, blobs))
+
 if __name__ == "__main__":
   # one artificial image
   # (375, 500, 3)
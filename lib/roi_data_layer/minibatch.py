@@ -15,10 +15,43 @@ import numpy.random as npr
 import cv2
 try:
   from model.config import cfg, tmp_lam
-  from utils.blob import prep_im_for_blob, im_list_to_blob
+  from utils.blob import prep_im_for_blob, im_list_to_blob, get_im_scale, \
+    resize_im, BlobBuffer, resized_im_list_to_blob, blob_size, \
+    imread_reduced, resize_reduced_im, blend_im_pair_to_blob
+  from layer_utils.snippets import get_anchor_grid
+  from layer_utils.anchor_target_layer import anchor_targets_sets
+  from roi_data_layer.image_cache import ImageCache
+  from roi_data_layer.roidb import FlippedEntry, flip_boxes
+  from utils.image_shards import ImageShards
 except:
   from lib.model.config import cfg, tmp_lam
-  from lib.utils.blob import prep_im_for_blob, im_list_to_blob
+  from lib.utils.blob import prep_im_for_blob, im_list_to_blob, get_im_scale, \
+    resize_im, BlobBuffer, resized_im_list_to_blob, blob_size, \
+    imread_reduced, resize_reduced_im, blend_im_pair_to_blob
+  from lib.layer_utils.snippets import get_anchor_grid
+  from lib.layer_utils.anchor_target_layer import anchor_targets_sets
+  from lib.roi_data_layer.image_cache import ImageCache
+  from lib.roi_data_layer.roidb import FlippedEntry, flip_boxes
+  from lib.utils.image_shards import ImageShards
+
+# Cache of the resized images, created on first use in each process
+_image_cache = None
+# Reader of the packed images, opened on first use in each process
+_image_shards = None
+# Buffer of the fused preprocessing (cfg.FUSED_PREPROCESSING)
+_blob_buffer = None
+_reuse_blob_buffer = True
+
+
+def set_blob_buffer_reuse(reuse):
+  """Whether the image blobs of successive minibatches share their memory.
+
+  Blobs handed over to another process may be serialized after the next
+  minibatch is built, so the prefetching workers must not reuse it.
+  """
+  global _blob_buffer, _reuse_blob_buffer
+  _reuse_blob_buffer = reuse
+  _blob_buffer = None
 
 
 def get_minibatch(roidb, num_classes):
@@ -27,6 +60,9 @@ def get_minibatch(roidb, num_classes):
   # Sample random scales to use for each image in this batch
   random_scale_inds = npr.randint(0, high=len(cfg.TRAIN.SCALES),
                   size=num_images)
+  if cfg.TRAIN.BUCKET_SAMPLING:
+    # The images were batched by resized shape, keep them at the same scale
+    random_scale_inds[:] = random_scale_inds[0]
   assert(cfg.TRAIN.BATCH_SIZE % num_images == 0), \
     'num_images ({}) must divide BATCH_SIZE ({})'. \
     format(num_images, cfg.TRAIN.BATCH_SIZE)
@@ -48,11 +84,11 @@ def get_minibatch(roidb, num_classes):
       gt_inds  = np.where(roidb[0]['gt_classes'] != 0 & np.all(roidb[0]['gt_overlaps'].toarray() > -1.0, axis=1))[0]
       gt_inds2 = np.where(roidb[1]['gt_classes'] != 0 & np.all(roidb[1]['gt_overlaps'].toarray() > -1.0, axis=1))[0]
     gt_boxes          = np.empty((len(gt_inds), 5), dtype=np.float32)
-    gt_boxes[:, 0:4]  = roidb[0]['boxes'][gt_inds, :] * im_scales[0]
+    gt_boxes[:, 0:4]  = _roidb_boxes(roidb[0], gt_inds) * im_scales[0]
     gt_boxes[:, 4]    = roidb[0]['gt_classes'][gt_inds]
 
     gt_boxes2         = np.empty((len(gt_inds2), 5), dtype=np.float32)
-    gt_boxes2[:, 0:4] = roidb[1]['boxes'][gt_inds2, :] * im_scales[1]
+    gt_boxes2[:, 0:4] = _roidb_boxes(roidb[1], gt_inds2) * im_scales[1]
     gt_boxes2[:, 0] *= trans_scales[1]
     gt_boxes2[:, 1] *= trans_scales[0]
     gt_boxes2[:, 2] *= trans_scales[1]
@@ -61,43 +97,186 @@ def get_minibatch(roidb, num_classes):
 
     blobs['gt_boxes'] = gt_boxes
     blobs['gt_boxes2'] = gt_boxes2
+    height, width = blob_size(im_blob)
     blobs['im_info'] = np.array(
-      [im_blob.shape[1], im_blob.shape[2], im_scales[0]],
+      [height, width, im_scales[0]],
       dtype=np.float32)
 
     return blobs
 
   else:
-    im_blob, im_scales = _get_image_blob(roidb, random_scale_inds)
+    im_blob, im_scales, im_shapes = _get_image_blob(roidb, random_scale_inds)
     blobs = {'data': im_blob}
 
-    assert len(im_scales) == 1, "Single batch only"
-    # assert len(roidb) == 1, "Single batch only"
-
-    # gt boxes: (x1, y1, x2, y2, cls)
-    if cfg.TRAIN.USE_ALL_GT:
-      # Include all ground truth boxes
-      gt_inds = np.where(roidb[0]['gt_classes'] != 0)[0]
-      if cfg.MIX_TEST:
-        print("TEST: gt_inds {} ".format(gt_inds))
-    else:
-      # For the COCO ground truth boxes, exclude the ones that are ''iscrowd''
-      gt_inds = np.where(roidb[0]['gt_classes'] != 0 & np.all(roidb[0]['gt_overlaps'].toarray() > -1.0, axis=1))[0]
-    gt_boxes = np.empty((len(gt_inds), 5), dtype=np.float32)
-    gt_boxes[:, 0:4] = roidb[0]['boxes'][gt_inds, :] * im_scales[0]
-    if cfg.MIX_TEST:
-      print("TEST: gt_boxes {} ".format(gt_boxes))
-      print(roidb[0]['gt_classes'][gt_inds])
-    gt_boxes[:, 4] = roidb[0]['gt_classes'][gt_inds]
-    blobs['gt_boxes'] = gt_boxes
+    # gt boxes: (x1, y1, x2, y2, cls), the boxes of each image follow
+    # those of the previous one
+    gt_boxes = [_get_gt_boxes(roidb[i], im_scales[i]) for i in range(num_images)]
+    blobs['gt_boxes'] = np.concatenate(gt_boxes)
+    blobs['num_gt_boxes'] = np.array([len(b) for b in gt_boxes], dtype=np.int64)
     blobs['gt_boxes2'] = None
+    # One (height, width, scale) row per image, the images are padded to
+    # the size of the blob
     blobs['im_info'] = np.array(
-      [im_blob.shape[1], im_blob.shape[2], im_scales[0]],
+      [[im_shapes[i][0], im_shapes[i][1], im_scales[i]]
+       for i in range(num_images)],
       dtype=np.float32)
 
     return blobs
 
 
+def _get_gt_boxes(entry, im_scale):
+  """Return the gt boxes (x1, y1, x2, y2, cls) of a roidb entry, scaled."""
+  if cfg.TRAIN.USE_ALL_GT:
+    # Include all ground truth boxes
+    gt_inds = np.where(entry['gt_classes'] != 0)[0]
+    if cfg.MIX_TEST:
+      print("TEST: gt_inds {} ".format(gt_inds))
+  else:
+    # For the COCO ground truth boxes, exclude the ones that are ''iscrowd''
+    gt_inds = np.where(entry['gt_classes'] != 0 & np.all(entry['gt_overlaps'].toarray() > -1.0, axis=1))[0]
+  gt_boxes = np.empty((len(gt_inds), 5), dtype=np.float32)
+  gt_boxes[:, 0:4] = _roidb_boxes(entry, gt_inds) * im_scale
+  if cfg.MIX_TEST:
+    print("TEST: gt_boxes {} ".format(gt_boxes))
+    print(entry['gt_classes'][gt_inds])
+  gt_boxes[:, 4] = entry['gt_classes'][gt_inds]
+  return gt_boxes
+
+
+def _roidb_boxes(entry, inds):
+  """Return the boxes inds of a roidb entry, mirrored for flipped views."""
+  boxes = entry['boxes'][inds, :]
+  if isinstance(entry, FlippedEntry):
+    boxes = flip_boxes(boxes, entry['width'])
+  return boxes
+
+
+def add_anchor_targets(blobs, feat_stride, feat_map_size):
+  """Compute the RPN anchor targets of a minibatch and add them to the blobs.
+
+  The targets only depend on the gt boxes, im_info and the size of the
+  feature map, which feat_map_size derives from the size of the data blob.
+  The targets of the images of the blob are stacked along the first axis.
+  """
+  height, width = feat_map_size(*blob_size(blobs['data']))
+  anchor_grid = get_anchor_grid(height, width, feat_stride,
+                                cfg.ANCHOR_SCALES, cfg.ANCHOR_RATIOS)
+  num_anchors = len(cfg.ANCHOR_SCALES) * len(cfg.ANCHOR_RATIOS)
+
+  im_info = blobs['im_info'].reshape(-1, 3)
+  num_gt_boxes = blobs.get('num_gt_boxes', [len(blobs['gt_boxes'])])
+  gt_sets = [[gt_boxes] for gt_boxes in
+             np.split(blobs['gt_boxes'], np.cumsum(num_gt_boxes)[:-1])]
+  if blobs['gt_boxes2'] is not None:
+    # Mix-training, the targets of both gt sets are computed in one pass
+    gt_sets[0].append(blobs['gt_boxes2'])
+  suffixes = ['', '2'][:len(gt_sets[0])]
+
+  names = ['rpn_labels', 'rpn_bbox_targets', 'rpn_bbox_inside_weights',
+           'rpn_bbox_outside_weights']
+  im_targets = [anchor_targets_sets(height, width, gt_sets[i], im_info[i],
+                                    anchor_grid.anchors_np, num_anchors,
+                                    anchor_grid.inds_inside(*im_info[i][:2]))
+                for i in range(len(gt_sets))]
+  targets = {}
+  for name, values in zip(names, zip(*im_targets)):
+    values = np.concatenate(values)
+    for j, suffix in enumerate(suffixes):
+      targets[name + suffix] = values if len(suffixes) == 1 else values[j:j + 1]
+  blobs['anchor_targets'] = targets
+
+  return blobs
+
+
+def _get_image_cache():
+  """Return the image cache of this process, None if it is disabled."""
+  global _image_cache
+  if _image_cache is None and (cfg.TRAIN.IMAGE_CACHE_BYTES > 0 or
+                               cfg.TRAIN.IMAGE_CACHE_DIR):
+    _image_cache = ImageCache(cfg.TRAIN.IMAGE_CACHE_BYTES,
+                              cfg.TRAIN.IMAGE_CACHE_DIR)
+  return _image_cache
+
+
+def _get_image_shards():
+  """Return the image shards reader of this process, None if not used."""
+  global _image_shards
+  if _image_shards is None and cfg.TRAIN.IMAGE_SHARDS_DIR:
+    _image_shards = ImageShards(cfg.TRAIN.IMAGE_SHARDS_DIR)
+  return _image_shards
+
+
+def _get_blob_buffer():
+  global _blob_buffer
+  if _blob_buffer is None:
+    _blob_buffer = BlobBuffer(reuse=_reuse_blob_buffer)
+  return _blob_buffer
+
+
+def _read_roidb_image(entry):
+  im = cv2.imread(entry['image'])
+  if entry['flipped']:
+    im = im[:, ::-1, :]
+  return im
+
+
+def _read_resized_roidb_image(entry, im_scale):
+  """Read the image of a roidb entry resized by im_scale."""
+  if not cfg.REDUCED_DECODE:
+    return resize_im(_read_roidb_image(entry), im_scale)
+
+  im = resize_reduced_im(imread_reduced(entry['image'], im_scale),
+                         (entry['height'], entry['width']), im_scale)
+  if entry['flipped']:
+    im = im[:, ::-1, :]
+  return im
+
+
+def _resized_roidb_image(entry, target_size):
+  """Load the uint8 image of a roidb entry, scaled for target_size."""
+  image_shards = _get_image_shards()
+  if image_shards is not None:
+    im, im_scale = image_shards.get(entry['image'], target_size,
+                                    cfg.TRAIN.MAX_SIZE)
+    if im is not None:
+      if entry['flipped']:
+        im = im[:, ::-1, :]
+      return im, im_scale
+
+  image_cache = _get_image_cache()
+  if image_cache is None and not cfg.REDUCED_DECODE:
+    im = _read_roidb_image(entry)
+    im_scale = get_im_scale(im.shape, target_size, cfg.TRAIN.MAX_SIZE)
+    return resize_im(im, im_scale), im_scale
+
+  # The scale only depends on the image size, which the roidb knows
+  im_scale = get_im_scale((entry['height'], entry['width']), target_size,
+                          cfg.TRAIN.MAX_SIZE)
+  if image_cache is None:
+    return _read_resized_roidb_image(entry, im_scale), im_scale
+
+  key = (entry['image'], target_size, cfg.TRAIN.MAX_SIZE, entry['flipped'])
+  im = image_cache.get(key)
+  if im is None:
+    im = _read_resized_roidb_image(entry, im_scale)
+    image_cache.put(key, im)
+  return im, im_scale
+
+
+def _prep_roidb_image(entry, target_size):
+  """Load the image of a roidb entry, mean subtracted and scaled."""
+  if _get_image_shards() is None and _get_image_cache() is None and \
+      not cfg.REDUCED_DECODE:
+    return prep_im_for_blob(_read_roidb_image(entry), cfg.PIXEL_MEANS,
+                            target_size, cfg.TRAIN.MAX_SIZE)
+
+  # Resized before the float conversion
+  im, im_scale = _resized_roidb_image(entry, target_size)
+  im = im.astype(np.float32)
+  im -= cfg.PIXEL_MEANS
+  return im, im_scale
+
+
 def _get_image_blob(roidb, scale_inds):
   """Builds an input blob from the images in the roidb at the specified
   scales.
@@ -106,50 +285,72 @@ def _get_image_blob(roidb, scale_inds):
   processed_ims = []
   im_scales = []
   for i in range(num_images):
-    im = cv2.imread(roidb[i]['image'])
-    if roidb[i]['flipped']:
-      im = im[:, ::-1, :]
     target_size = cfg.TRAIN.SCALES[scale_inds[i]]
-    im, im_scale = prep_im_for_blob(im, cfg.PIXEL_MEANS, target_size,
-                    cfg.TRAIN.MAX_SIZE)
+    if cfg.FUSED_PREPROCESSING or cfg.UINT8_BLOBS:
+      im, im_scale = _resized_roidb_image(roidb[i], target_size)
+    else:
+      im, im_scale = _prep_roidb_image(roidb[i], target_size)
     im_scales.append(im_scale)
     processed_ims.append(im)
 
   # Create a blob to hold the input images
-  blob = im_list_to_blob(processed_ims)
+  if cfg.FUSED_PREPROCESSING or cfg.UINT8_BLOBS:
+    blob = resized_im_list_to_blob(
+      processed_ims, cfg.PIXEL_MEANS, uint8=cfg.UINT8_BLOBS,
+      blob_buffer=_get_blob_buffer() if cfg.FUSED_PREPROCESSING else None)
+  else:
+    blob = im_list_to_blob(processed_ims)
+  im_shapes = [im.shape[:2] for im in processed_ims]
 
-  return blob, im_scales
+  return blob, im_scales, im_shapes
 
-def _get_mix_image_blob(roidb, scale_inds):
-  num_images = len(roidb)
-  processed_ims = []
-  im_scales = []
-  for i in range(num_images):
-    im = cv2.imread(roidb[i]['image'])
-    if roidb[i]['flipped']:
-      im = im[:, ::-1, :]
-    target_size = cfg.TRAIN.SCALES[scale_inds[i]]
-    im, im_scale = prep_im_for_blob(im, cfg.PIXEL_MEANS, target_size,
-                                    cfg.TRAIN.MAX_SIZE)
-    im_scales.append(im_scale)
-    processed_ims.append(im)
+def _mix_roidb_image(entry, target_size, im_shape):
+  """Load the uint8 image of a roidb entry resized to im_shape (height, width).
 
-  # add two image
-  im1 = processed_ims[0]
-  im2_tmp = processed_ims[1]
-  s1, s2 = np.array(im1.shape, dtype=np.float32), np.array(im2_tmp.shape, dtype=np.float32)
-  trans_scales = s1 / s2
-  im2 = cv2.resize(im2_tmp, None, None, fx=trans_scales[1], fy=trans_scales[0],
-             interpolation=cv2.INTER_LINEAR)
-  assert im1.shape == im2.shape, " {}  ?  {}  tr scales {},  s1,s2   {} ? {}".format(im1.shape, im2.shape, trans_scales, s1, s2)
+  Also returns the scale of the image for target_size and the shape it has at
+  that scale, from which the resize to im_shape is measured. Without shards or
+  cache, the decoded image is resized to im_shape directly.
+  """
+  if _get_image_shards() is not None or _get_image_cache() is not None:
+    im, im_scale = _resized_roidb_image(entry, target_size)
+    scaled_shape = im.shape[:2]
+  else:
+    height, width = entry['height'], entry['width']
+    im_scale = get_im_scale((height, width), target_size, cfg.TRAIN.MAX_SIZE)
+    scaled_shape = (int(np.round(height * im_scale)),
+                    int(np.round(width * im_scale)))
+    if cfg.REDUCED_DECODE:
+      im = imread_reduced(entry['image'], max(float(im_shape[0]) / height,
+                                              float(im_shape[1]) / width))
+      if entry['flipped']:
+        im = im[:, ::-1, :]
+    else:
+      im = _read_roidb_image(entry)
+  if im.shape[:2] != tuple(im_shape):
+    im = cv2.resize(im, (im_shape[1], im_shape[0]),
+                    interpolation=cv2.INTER_LINEAR)
+  return im, im_scale, scaled_shape
 
-  lam = tmp_lam
-  im = lam * im1 + (1-lam) * im2
 
-  processed_ims = [im]
-  # im_scales
+def _get_mix_image_blob(roidb, scale_inds):
+  """Builds an input blob blending the two images of the roidb.
 
-  # Create a blob to hold the input images
-  blob = im_list_to_blob(processed_ims)
+  The second image is resized to the shape of the first one, trans_scales is
+  the ratio of that shape to the shape of the second image at its own scale.
+  """
+  assert len(roidb) == 2, "MIX-TRAINING ERROR! Single batch only"
+  im1, im_scale1 = _resized_roidb_image(roidb[0],
+                                        cfg.TRAIN.SCALES[scale_inds[0]])
+  im2, im_scale2, scaled_shape2 = _mix_roidb_image(
+    roidb[1], cfg.TRAIN.SCALES[scale_inds[1]], im1.shape[:2])
+  im_scales = [im_scale1, im_scale2]
+
+  s1 = np.array(im1.shape, dtype=np.float32)
+  s2 = np.array(tuple(scaled_shape2) + im1.shape[2:], dtype=np.float32)
+  trans_scales = s1 / s2
+
+  blob = blend_im_pair_to_blob(
+    im1, im2, tmp_lam, cfg.PIXEL_MEANS, uint8=cfg.UINT8_BLOBS,
+    blob_buffer=_get_blob_buffer() if cfg.FUSED_PREPROCESSING else None)
 
-  return blob, im_scales, trans_scales
\ No newline at end of file
+  return blob, im_scales, trans_scales
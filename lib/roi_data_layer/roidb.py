@@ -12,7 +12,7 @@ from __future__ import print_function
 
 import numpy as np
 from model.config import cfg
-import PIL
+from datasets.columnar_roidb import ColumnarRoidb
 
 def prepare_roidb(imdb):
   """Enrich the imdb's roidb by adding some derived quantities that
@@ -22,9 +22,11 @@ def prepare_roidb(imdb):
   recorded.
   """
   roidb = imdb.roidb
+  if isinstance(roidb, ColumnarRoidb):
+    _prepare_columnar_roidb(imdb, roidb)
+    return
   if not (imdb.name.startswith('coco')):
-    sizes = [PIL.Image.open(imdb.image_path_at(i)).size
-         for i in range(imdb.num_images)]
+    sizes = [imdb.image_size_at(i) for i in range(imdb.num_images)]
   for i in range(len(imdb.image_index)):
     roidb[i]['image'] = imdb.image_path_at(i)
     if not (imdb.name.startswith('coco')):
@@ -45,3 +47,85 @@ def prepare_roidb(imdb):
     # max overlap > 0 => class should not be zero (must be a fg class)
     nonzero_inds = np.where(max_overlaps > 0)[0]
     assert all(max_classes[nonzero_inds] != 0)
+
+
+def _prepare_columnar_roidb(imdb, roidb):
+  """prepare_roidb for a ColumnarRoidb, computed over all the boxes at once."""
+  roidb.set_image_column('image', [imdb.image_path_at(i)
+                                   for i in range(imdb.num_images)])
+  if not (imdb.name.startswith('coco')):
+    sizes = np.array([imdb.image_size_at(i) for i in range(imdb.num_images)],
+                     dtype=np.int32)
+    roidb.set_image_column('width', sizes[:, 0])
+    roidb.set_image_column('height', sizes[:, 1])
+  # stay sparse, the dense overlaps of a whole dataset are large
+  gt_overlaps = roidb.overlaps
+  max_overlaps = gt_overlaps.max(axis=1).toarray().ravel()
+  max_classes = np.asarray(gt_overlaps.argmax(axis=1)).ravel()
+  roidb.set_box_column('max_classes', max_classes)
+  roidb.set_box_column('max_overlaps', max_overlaps)
+  # sanity checks
+  assert all(max_classes[max_overlaps == 0] == 0)
+  assert all(max_classes[max_overlaps > 0] != 0)
+
+
+def flip_boxes(boxes, width):
+  """Mirror boxes horizontally in an image of the given width."""
+  flipped = boxes.copy()
+  flipped[:, 0] = width - boxes[:, 2] - 1
+  flipped[:, 2] = width - boxes[:, 0] - 1
+  return flipped
+
+
+class FlippedEntry(object):
+  """Horizontally-flipped view of a roidb entry.
+
+  Only the flipped flag differs from the original entry: the boxes are the
+  original ones and are mirrored by the minibatch builder.
+  """
+
+  def __init__(self, entry):
+    self._entry = entry
+
+  def __getitem__(self, key):
+    if key == 'flipped':
+      return True
+    return self._entry[key]
+
+  def __contains__(self, key):
+    return key == 'flipped' or key in self._entry
+
+  def get(self, key, default=None):
+    return self[key] if key in self else default
+
+
+class FlippedRoidb(object):
+  """A roidb followed by a virtual flipped copy of each of its entries.
+
+  Index i < len(roidb) is roidb[i] and index len(roidb) + i is its flipped
+  view, so flipping neither copies boxes nor reads image sizes up front.
+  """
+
+  def __init__(self, roidb):
+    self.roidb = roidb
+
+  def __len__(self):
+    return 2 * len(self.roidb)
+
+  def __getitem__(self, i):
+    num_images = len(self.roidb)
+    if i < 0:
+      i += 2 * num_images
+    if not 0 <= i < 2 * num_images:
+      raise IndexError('roidb index out of range')
+    if i < num_images:
+      return self.roidb[i]
+    return FlippedEntry(self.roidb[i - num_images])
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def extend(self, roidb):
+    assert isinstance(roidb, FlippedRoidb)
+    self.roidb.extend(roidb.roidb)
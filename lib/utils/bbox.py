@@ -1,30 +1,95 @@
 import torch
 import numpy as np
 
-def bbox_overlaps(boxes, query_boxes):
+# Maximum number of elements of the (boxes x query_boxes) temporaries of a
+# chunk, which bounds the memory used by the computation regardless of the
+# number of boxes
+CHUNK_SIZE = 1 << 20
+
+
+def _as_tensors(boxes, query_boxes):
+    """The boxes as tensors, and the function turning the results back to the type of boxes."""
+    if isinstance(boxes, np.ndarray):
+        # If input is ndarray, turn the overlaps back to ndarray when return
+        return torch.from_numpy(boxes), torch.from_numpy(query_boxes), lambda x: x.numpy()
+    return boxes, query_boxes, lambda x: x
+
+
+def _areas(boxes):
+    return (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+
+
+def _chunks(num_boxes, num_query_boxes, chunk_size):
+    """(start, end) rows of the chunks of boxes to compute the overlaps of at once."""
+    rows = max(1, (chunk_size or CHUNK_SIZE) // max(num_query_boxes, 1))
+    for start in range(0, num_boxes, rows):
+        yield start, min(start + rows, num_boxes)
+
+
+def _chunk_overlaps(boxes, query_boxes, query_areas):
+    """Overlaps of a chunk of boxes, in two (rows x K) buffers updated in place."""
+    iw = torch.min(boxes[:, 2:3], query_boxes[:, 2:3].t())
+    iw.sub_(torch.max(boxes[:, 0:1], query_boxes[:, 0:1].t())).add_(1).clamp_(min=0)
+    ih = torch.min(boxes[:, 3:4], query_boxes[:, 3:4].t())
+    ih.sub_(torch.max(boxes[:, 1:2], query_boxes[:, 1:2].t())).add_(1).clamp_(min=0)
+    inter = iw.mul_(ih)
+    ua = ih.copy_(_areas(boxes).view(-1, 1)).add_(query_areas.view(1, -1)).sub_(inter)
+    return inter.div_(ua)
+
+
+def bbox_overlaps(boxes, query_boxes, chunk_size=None):
     """
     Parameters
     ----------
     boxes: (N, 4) ndarray or tensor or variable
     query_boxes: (K, 4) ndarray or tensor or variable
+    chunk_size: maximum number of elements of the temporaries, CHUNK_SIZE if None
     Returns
     -------
-    overlaps: (N, K) overlap between boxes and query_boxes
+    overlaps: (N, K) overlap between boxes and query_boxes, of the type of boxes
+
+    The overlaps are computed by chunks of rows, so only the output is N x K.
     """
-    if isinstance(boxes, np.ndarray):
-        boxes = torch.from_numpy(boxes)
-        query_boxes = torch.from_numpy(query_boxes)
-        out_fn = lambda x: x.numpy() # If input is ndarray, turn the overlaps back to ndarray when return
+    boxes, query_boxes, out_fn = _as_tensors(boxes, query_boxes)
+    query_areas = _areas(query_boxes)
+    overlaps = boxes.new_empty((boxes.size(0), query_boxes.size(0)))
+    for start, end in _chunks(boxes.size(0), query_boxes.size(0), chunk_size):
+        overlaps[start:end] = _chunk_overlaps(boxes[start:end], query_boxes, query_areas)
+    return out_fn(overlaps)
+
+
+def bbox_overlaps_max(boxes, query_boxes, dim=1, chunk_size=None):
+    """
+    Parameters
+    ----------
+    boxes: (N, 4) ndarray or tensor or variable
+    query_boxes: (K, 4) ndarray or tensor or variable
+    dim: 1 to reduce over the query boxes, 0 over the boxes
+    chunk_size: maximum number of elements of the temporaries, CHUNK_SIZE if None
+    Returns
+    -------
+    max_overlaps, argmax_overlaps: max of bbox_overlaps(boxes, query_boxes) along
+    dim and its index, of the type of boxes
+
+    The max is reduced chunk after chunk, the N x K overlaps are never stored.
+    """
+    boxes, query_boxes, out_fn = _as_tensors(boxes, query_boxes)
+    query_areas = _areas(query_boxes)
+    if dim == 1:
+        max_overlaps = boxes.new_empty((boxes.size(0),))
+        argmax_overlaps = torch.empty((boxes.size(0),), dtype=torch.long, device=boxes.device)
     else:
-        out_fn = lambda x: x
-
-    box_areas = (boxes[:, 2] - boxes[:, 0] + 1) * \
-            (boxes[:, 3] - boxes[:, 1] + 1)
-    query_areas = (query_boxes[:, 2] - query_boxes[:, 0] + 1) * \
-            (query_boxes[:, 3] - query_boxes[:, 1] + 1)
-
-    iw = (torch.min(boxes[:, 2:3], query_boxes[:, 2:3].t()) - torch.max(boxes[:, 0:1], query_boxes[:, 0:1].t()) + 1).clamp(min=0)
-    ih = (torch.min(boxes[:, 3:4], query_boxes[:, 3:4].t()) - torch.max(boxes[:, 1:2], query_boxes[:, 1:2].t()) + 1).clamp(min=0)
-    ua = box_areas.view(-1, 1) + query_areas.view(1, -1) - iw * ih
-    overlaps = iw * ih / ua
-    return out_fn(overlaps)
\ No newline at end of file
+        max_overlaps = boxes.new_full((query_boxes.size(0),), -1)
+        argmax_overlaps = torch.zeros((query_boxes.size(0),), dtype=torch.long, device=boxes.device)
+
+    for start, end in _chunks(boxes.size(0), query_boxes.size(0), chunk_size):
+        chunk_max, chunk_argmax = _chunk_overlaps(boxes[start:end], query_boxes, query_areas).max(dim)
+        if dim == 1:
+            max_overlaps[start:end] = chunk_max
+            argmax_overlaps[start:end] = chunk_argmax
+        else:
+            # Strictly greater, so that the first box reaching the max is kept
+            better = chunk_max > max_overlaps
+            max_overlaps[better] = chunk_max[better]
+            argmax_overlaps[better] = chunk_argmax[better] + start
+    return out_fn(max_overlaps), out_fn(argmax_overlaps)
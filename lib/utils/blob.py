@@ -12,9 +12,10 @@ from __future__ import print_function
 
 import numpy as np
 import cv2
+import torch
 
 
-def im_list_to_blob(ims):
+def im_list_to_blob(ims, dtype=np.float32):
   """Convert a list of images into a network input.
 
   Assumes images are already prepared (means subtracted, BGR order, ...).
@@ -22,7 +23,7 @@ def im_list_to_blob(ims):
   max_shape = np.array([im.shape for im in ims]).max(axis=0)
   num_images = len(ims)
   blob = np.zeros((num_images, max_shape[0], max_shape[1], 3),
-                  dtype=np.float32)
+                  dtype=dtype)
   for i in range(num_images):
     im = ims[i]
     blob[i, 0:im.shape[0], 0:im.shape[1], :] = im
@@ -30,17 +31,190 @@ def im_list_to_blob(ims):
   return blob
 
 
-def prep_im_for_blob(im, pixel_means, target_size, max_size):
-  """Mean subtract and scale an image for use in a blob."""
-  im = im.astype(np.float32, copy=False)
-  im -= pixel_means
-  im_shape = im.shape
+class BlobBuffer(object):
+  """Reusable NCHW tensor that image blobs are written into.
+
+  The memory is kept across calls and only grows, and it is pinned when CUDA
+  is available so that the copy to the device can be asynchronous. A blob is
+  only valid until the next call to get, unless reuse is False, in which case
+  every blob gets its own (unpinned) memory.
+  """
+
+  def __init__(self, reuse=True):
+    self._reuse = reuse
+    self._storage = None
+
+  def get(self, shape, dtype=torch.float32):
+    """Return a (N, C, H, W) tensor backed by the buffer."""
+    numel = int(np.prod(shape))
+    if not self._reuse or self._storage is None or \
+        self._storage.dtype != dtype or self._storage.numel() < numel:
+      self._storage = torch.empty(
+        numel, dtype=dtype,
+        pin_memory=self._reuse and torch.cuda.is_available())
+    return self._storage[:numel].view(*shape)
+
+
+def im_list_to_nchw_blob(ims, pixel_means, blob_buffer):
+  """Write a list of resized uint8 BGR images into an NCHW float32 blob.
+
+  Mean subtraction, the conversion to float and the move of the channels
+  first happen in a single pass over each image, straight into the tensor
+  given by blob_buffer. The padding is zeroed. If pixel_means is None, the
+  blob is uint8 and the images are only moved channels first.
+  """
+  max_shape = np.array([im.shape for im in ims]).max(axis=0)
+  dtype = torch.uint8 if pixel_means is None else torch.float32
+  blob = blob_buffer.get((len(ims), 3, max_shape[0], max_shape[1]), dtype)
+  data = blob.numpy()
+  if pixel_means is not None:
+    pixel_means = np.asarray(pixel_means, dtype=np.float32).reshape(3)
+  for i, im in enumerate(ims):
+    height, width = im.shape[:2]
+    for c in range(3):
+      if pixel_means is None:
+        data[i, c, :height, :width] = im[:, :, c]
+      else:
+        np.subtract(im[:, :, c], pixel_means[c],
+                    out=data[i, c, :height, :width])
+    data[i, :, height:, :] = 0
+    data[i, :, :height, width:] = 0
+
+  return blob
+
+
+def resized_im_list_to_blob(ims, pixel_means, uint8=False, blob_buffer=None):
+  """Convert a list of resized uint8 images into a network input.
+
+  The blob is uint8 if uint8 is set, the network then subtracts the means
+  itself, and it is mean subtracted float32 otherwise. It is NCHW and backed
+  by blob_buffer if one is given, NHWC otherwise.
+  """
+  if blob_buffer is not None:
+    return im_list_to_nchw_blob(ims, None if uint8 else pixel_means,
+                                blob_buffer)
+  if uint8:
+    return im_list_to_blob(ims, dtype=np.uint8)
+  processed_ims = []
+  for im in ims:
+    im = im.astype(np.float32)
+    im -= pixel_means
+    processed_ims.append(im)
+  return im_list_to_blob(processed_ims)
+
+
+def blend_im_pair_to_blob(im1, im2, lam, pixel_means, uint8=False,
+                          blob_buffer=None):
+  """Blend two uint8 images of the same shape into a one image network input.
+
+  The blob holds lam * im1 + (1 - lam) * im2, mean subtracted. It is computed
+  in place in the blob as lam * (im1 - im2) + im2, with no temporary images.
+  If uint8 is set, the blend is rounded to a uint8 blob instead and the
+  network subtracts the means itself; this goes through a float temporary per
+  channel. The blob is NCHW and backed by blob_buffer if one is given, NHWC
+  otherwise.
+  """
+  assert im1.shape == im2.shape, '{} != {}'.format(im1.shape, im2.shape)
+  height, width = im1.shape[:2]
+  pixel_means = np.asarray(pixel_means, dtype=np.float32).reshape(3)
+  if blob_buffer is not None:
+    blob = blob_buffer.get((1, 3, height, width),
+                           torch.uint8 if uint8 else torch.float32)
+    data = blob.numpy()
+    planes = [(data[0, c], im1[:, :, c], im2[:, :, c], pixel_means[c])
+              for c in range(3)]
+  else:
+    blob = np.empty((1, height, width, 3),
+                    dtype=np.uint8 if uint8 else np.float32)
+    planes = [(blob[0], im1, im2, pixel_means)]
+  for out, a, b, mean in planes:
+    if uint8:
+      # A convex combination of uint8 pixels, rounding keeps it in range
+      mixed = np.subtract(a, b, dtype=np.float32)
+      mixed *= lam
+      np.add(mixed, b, out=mixed)
+      np.rint(mixed, out=mixed)
+      out[...] = mixed
+    else:
+      np.subtract(a, b, out=out, dtype=np.float32)
+      out *= lam
+      np.add(out, b, out=out)
+      out -= mean
+
+  return blob
+
+
+def blob_size(blob):
+  """Return the (height, width) of an image blob.
+
+  Numpy blobs are NHWC, tensors produced by im_list_to_nchw_blob are NCHW.
+  """
+  if isinstance(blob, torch.Tensor):
+    return blob.shape[2], blob.shape[3]
+  return blob.shape[1], blob.shape[2]
+
+
+def resize_im(im, im_scale):
+  """Resize an image by im_scale, in its own dtype."""
+  return cv2.resize(im, None, None, fx=im_scale, fy=im_scale,
+                    interpolation=cv2.INTER_LINEAR)
+
+
+# Decoding flags by reduction factor; libjpeg then only computes a scaled
+# down DCT, so JPEGs decode several times faster
+_REDUCED_DECODE_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2,
+                         4: cv2.IMREAD_REDUCED_COLOR_4,
+                         8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def reduced_decode_factor(im_scale):
+  """Largest factor an image can be decoded reduced by before a resize by
+  im_scale, without the resize having to upsample it."""
+  for factor in (8, 4, 2):
+    if im_scale * factor <= 1.:
+      return factor
+  return 1
+
+
+def imread_reduced(path, max_scale):
+  """Read the BGR image at path, decoded at the lowest resolution that can
+  still be resized by up to max_scale (see resize_reduced_im)."""
+  factor = reduced_decode_factor(max_scale)
+  if factor == 1:
+    return cv2.imread(path)
+  return cv2.imread(path, _REDUCED_DECODE_FLAGS[factor])
+
+
+def resize_reduced_im(im, im_shape, im_scale):
+  """Resize an image read by imread_reduced from an image of shape im_shape.
+
+  The result has the size resize_im would give on the full resolution image,
+  so im_scale stays the scale from the original image, boxes included.
+  """
+  height, width = im_shape[:2]
+  if im.shape[:2] == (height, width):
+    return resize_im(im, im_scale)
+  size = (int(np.round(width * im_scale)), int(np.round(height * im_scale)))
+  return cv2.resize(im, size, interpolation=cv2.INTER_LINEAR)
+
+
+def get_im_scale(im_shape, target_size, max_size):
+  """Scale factor bringing the shortest side of an image to target_size."""
   im_size_min = np.min(im_shape[0:2])
   im_size_max = np.max(im_shape[0:2])
   im_scale = float(target_size) / float(im_size_min)
   # Prevent the biggest axis from being more than MAX_SIZE
   if np.round(im_scale * im_size_max) > max_size:
     im_scale = float(max_size) / float(im_size_max)
+
+  return im_scale
+
+
+def prep_im_for_blob(im, pixel_means, target_size, max_size):
+  """Mean subtract and scale an image for use in a blob."""
+  im = im.astype(np.float32, copy=False)
+  im -= pixel_means
+  im_scale = get_im_scale(im.shape, target_size, max_size)
   im = cv2.resize(im, None, None, fx=im_scale, fy=im_scale,
                   interpolation=cv2.INTER_LINEAR)
 
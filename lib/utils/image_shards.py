@@ -0,0 +1,113 @@
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Packed, memory-mapped shards of pre-resized images.
+
+A shard directory holds a few large binary files of raw uint8 BGR images,
+each of them already resized for one (target size, max size) pair, and an
+index mapping (image path, target size, max size) to a location in the
+shards. See tools/pack_shards.py to write one.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import numpy as np
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+
+INDEX_FILE = 'index.pkl'
+
+
+class ImageShards(object):
+  """Reader of a directory of image shards."""
+
+  def __init__(self, shards_dir):
+    self._shards_dir = shards_dir
+    with open(os.path.join(shards_dir, INDEX_FILE), 'rb') as f:
+      index = pickle.load(f)
+    self._shard_files = index['shards']
+    # (path, target_size, max_size) -> (shard, offset, height, width, scale)
+    self._images = index['images']
+    # path -> (height, width) of the original image
+    self._sizes = index['sizes']
+    # Shards are mapped on first access
+    self._shards = [None] * len(self._shard_files)
+
+  def _shard(self, i):
+    if self._shards[i] is None:
+      self._shards[i] = np.memmap(
+        os.path.join(self._shards_dir, self._shard_files[i]),
+        dtype=np.uint8, mode='r')
+    return self._shards[i]
+
+  def __contains__(self, key):
+    return key in self._images
+
+  def get(self, path, target_size, max_size):
+    """Return the resized uint8 image and its scale, or (None, None).
+
+    The image is a read-only view into the memory-mapped shard, no copy is
+    made.
+    """
+    loc = self._images.get((path, target_size, max_size))
+    if loc is None:
+      return None, None
+    shard, offset, height, width, im_scale = loc
+    im = self._shard(shard)[offset:offset + height * width * 3]
+    return im.reshape((height, width, 3)), im_scale
+
+  def image_size(self, path):
+    """Return the (height, width) of the original image."""
+    return self._sizes[path]
+
+
+class ImageShardsWriter(object):
+  """Writer of a directory of image shards."""
+
+  def __init__(self, shards_dir, shard_bytes):
+    self._shards_dir = shards_dir
+    self._shard_bytes = shard_bytes
+    if not os.path.exists(shards_dir):
+      os.makedirs(shards_dir)
+    self._shard_files = []
+    self._images = {}
+    self._sizes = {}
+    self._f = None
+    self._offset = 0
+
+  def _next_shard(self):
+    if self._f is not None:
+      self._f.close()
+    name = 'shard_{:03d}.bin'.format(len(self._shard_files))
+    self._shard_files.append(name)
+    self._f = open(os.path.join(self._shards_dir, name), 'wb')
+    self._offset = 0
+
+  def add(self, path, target_size, max_size, im, im_scale, orig_size):
+    """Append the resized uint8 image im of path to the shards."""
+    im = np.ascontiguousarray(im, dtype=np.uint8)
+    if self._f is None or self._offset + im.nbytes > self._shard_bytes:
+      self._next_shard()
+    self._f.write(im.tobytes())
+    self._images[(path, target_size, max_size)] = (
+      len(self._shard_files) - 1, self._offset, im.shape[0], im.shape[1],
+      im_scale)
+    self._sizes[path] = tuple(orig_size[:2])
+    self._offset += im.nbytes
+
+  def close(self):
+    """Flush the last shard and write the index."""
+    if self._f is not None:
+      self._f.close()
+      self._f = None
+    index = {'shards': self._shard_files,
+             'images': self._images,
+             'sizes': self._sizes}
+    with open(os.path.join(self._shards_dir, INDEX_FILE), 'wb') as f:
+      pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Compare the speed of the numpy and torch RPN anchor target layers.
+
+Random gt boxes are drawn for a feature map of the given size, and both
+layers are timed with the configured RPN batch size. Their equivalence is
+checked by tools/check_anchor_targets.py.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.config import cfg
+from layer_utils.snippets import get_anchor_grid
+from layer_utils.anchor_target_layer import anchor_targets, \
+  anchor_targets_torch
+from utils.timer import Timer
+import argparse
+import numpy as np
+import torch
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Benchmark anchor targets')
+  parser.add_argument('--iters', dest='iters',
+                      help='number of timed runs of each layer',
+                      default=50, type=int)
+  parser.add_argument('--im_size', dest='im_size',
+                      help='height and width of the image',
+                      default=[600, 1000], nargs=2, type=int)
+  parser.add_argument('--feat_stride', dest='feat_stride',
+                      help='stride of the feature map',
+                      default=16, type=int)
+  parser.add_argument('--num_gt', dest='num_gt',
+                      help='number of gt boxes',
+                      default=20, type=int)
+  parser.add_argument('--device', dest='device',
+                      help='device of the torch layer',
+                      default='cuda' if torch.cuda.is_available() else 'cpu',
+                      type=str)
+  args = parser.parse_args()
+  return args
+
+
+def random_gt_boxes(num_gt, im_height, im_width, rng):
+  x1 = rng.uniform(0, im_width - 32, num_gt)
+  y1 = rng.uniform(0, im_height - 32, num_gt)
+  x2 = np.minimum(x1 + rng.uniform(16, im_width / 2., num_gt), im_width - 1)
+  y2 = np.minimum(y1 + rng.uniform(16, im_height / 2., num_gt), im_height - 1)
+  cls = rng.randint(1, 21, num_gt)
+  return np.stack((x1, y1, x2, y2, cls), 1).astype(np.float32)
+
+
+def bench(iters, fn, sync):
+  timer = Timer()
+  for _ in range(iters):
+    timer.tic()
+    fn()
+    sync()
+    timer.toc()
+  return timer.average_time()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  im_height, im_width = args.im_size
+  im_info = np.array([im_height, im_width, 1.], dtype=np.float32)
+  stride = args.feat_stride
+  height = int(np.ceil(im_height / float(stride)))
+  width = int(np.ceil(im_width / float(stride)))
+  num_anchors = len(cfg.ANCHOR_SCALES) * len(cfg.ANCHOR_RATIOS)
+  grid = get_anchor_grid(height, width, stride, cfg.ANCHOR_SCALES,
+                         cfg.ANCHOR_RATIOS, args.device)
+  gt_boxes = random_gt_boxes(args.num_gt, im_height, im_width,
+                             np.random.RandomState(cfg.RNG_SEED))
+
+  sync = torch.cuda.synchronize if args.device.startswith('cuda') \
+    else lambda: None
+  numpy_time = bench(args.iters, lambda: [
+    torch.from_numpy(t).to(args.device) for t in anchor_targets(
+      height, width, gt_boxes, im_info, grid.anchors.cpu().numpy(),
+      num_anchors)], sync)
+  gt_tensor = torch.from_numpy(gt_boxes).to(args.device)
+  inds_inside = grid.inds_inside_tensor(im_height, im_width)
+  torch_time = bench(args.iters, lambda: anchor_targets_torch(
+    height, width, gt_tensor, im_info, grid.anchors, num_anchors,
+    inds_inside), sync)
+
+  print('{} anchors, {} gt boxes, torch on {}'.format(
+    grid.length, args.num_gt, args.device))
+  print('numpy layer: {:.2f}ms'.format(numpy_time * 1000))
+  print('torch layer: {:.2f}ms'.format(torch_time * 1000))
+  print('speedup: {:.2f}x'.format(numpy_time / torch_time))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Compare batched and sequential detection, in images/sec by batch size.
+
+Without --model, the network is randomly initialized, which is enough to
+time it. Without --imdb, synthetic images of various sizes are used.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.config import cfg
+from model.test import im_detect, im_detect_batch
+from utils.timer import Timer
+import argparse
+import numpy as np
+import cv2
+
+from nets.vgg16 import vgg16
+from nets.resnet_v1 import resnetv1
+
+import torch
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Benchmark batched inference')
+  parser.add_argument('--net', dest='net',
+                      help='vgg16 or res101',
+                      default='res101', type=str)
+  parser.add_argument('--model', dest='model',
+                      help='weights to load, random if None',
+                      default=None, type=str)
+  parser.add_argument('--num_classes', dest='num_classes',
+                      help='number of classes of the network',
+                      default=21, type=int)
+  parser.add_argument('--imdb', dest='imdb_name',
+                      help='dataset to read the images of',
+                      default=None, type=str)
+  parser.add_argument('--num_images', dest='num_images',
+                      help='number of images to detect objects in',
+                      default=16, type=int)
+  parser.add_argument('--batch_sizes', dest='batch_sizes',
+                      help='batch sizes to time',
+                      default=[2, 4, 8], nargs='+', type=int)
+  args = parser.parse_args()
+  return args
+
+
+def synthetic_images(num_images):
+  rng = np.random.RandomState(cfg.RNG_SEED)
+  sizes = [(375, 500), (500, 375), (333, 500), (480, 640)]
+  return [rng.randint(0, 255, sizes[i % len(sizes)] + (3,)).astype(np.uint8)
+          for i in range(num_images)]
+
+
+def bench(net, ims, batch_size):
+  timer = Timer()
+  detections = []
+  for start in range(0, len(ims), batch_size):
+    batch = ims[start:start + batch_size]
+    timer.tic()
+    if batch_size == 1:
+      detections.append(im_detect(net, batch[0]))
+    else:
+      detections.extend(im_detect_batch(net, batch))
+    timer.toc()
+  return detections, timer.total_time()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  if args.imdb_name is not None:
+    from datasets.factory import get_imdb
+    imdb = get_imdb(args.imdb_name)
+    ims = [cv2.imread(imdb.image_path_at(i))
+           for i in range(min(args.num_images, imdb.num_images))]
+  else:
+    ims = synthetic_images(args.num_images)
+
+  if args.net == 'vgg16':
+    net = vgg16()
+  elif args.net == 'res101':
+    net = resnetv1(num_layers=101)
+  else:
+    raise NotImplementedError
+  net.create_architecture(args.num_classes, tag='default', anchor_scales=cfg.ANCHOR_SCALES,
+                          anchor_ratios=cfg.ANCHOR_RATIOS)
+  if args.model is not None:
+    net.load_state_dict(torch.load(args.model, map_location=lambda storage, loc: storage))
+  net.eval()
+  if not torch.cuda.is_available():
+    net._device = 'cpu'
+  net.to(net._device)
+
+  # Warm up
+  im_detect(net, ims[0])
+
+  sequential, total_time = bench(net, ims, 1)
+  print('sequential: {:.2f} images/sec'.format(len(ims) / total_time))
+  for batch_size in args.batch_sizes:
+    if batch_size == 1:
+      continue
+    detections, total_time = bench(net, ims, batch_size)
+    # Differences come from the features near the padding of the smaller images
+    score_diff = max(np.abs(scores - seq_scores).max() if scores.shape == seq_scores.shape else np.inf
+                     for (scores, _), (seq_scores, _) in zip(detections, sequential))
+    print('batch size {:d}: {:.2f} images/sec, max score difference {:.2e}'.format(
+      batch_size, len(ims) / total_time, score_diff))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Time the CPU NMS implementations on random, clustered boxes.
+
+The C++ extension (lib/nms/setup.py) and the ffi one (lib/nms/build.py),
+when built, are compared with the pure torch fallback, and checked to keep
+the same boxes. The batched NMS of the C++ extension is compared with one
+call per label.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from nms import pth_nms as nms_module
+from utils.timer import Timer
+import argparse
+import numpy as np
+import torch
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Benchmark CPU NMS')
+  parser.add_argument('--iters', dest='iters',
+                      help='number of timed runs per size',
+                      default=10, type=int)
+  parser.add_argument('--sizes', dest='sizes',
+                      help='numbers of boxes',
+                      default=[300, 2000, 6000, 12000], nargs='+', type=int)
+  parser.add_argument('--thresh', dest='thresh',
+                      help='overlap threshold',
+                      default=0.7, type=float)
+  args = parser.parse_args()
+  return args
+
+
+def random_dets(num, rng):
+  """Boxes around a few centers, so that many of them overlap, like RPN
+  proposals."""
+  centers = rng.uniform(0, 1000, (max(num // 50, 1), 2))
+  ctr = centers[rng.randint(0, len(centers), num)] + rng.normal(0, 20, (num, 2))
+  size = rng.uniform(16, 200, (num, 2))
+  dets = np.hstack((ctr - size / 2, ctr + size / 2, rng.uniform(0, 1, (num, 1))))
+  return torch.from_numpy(dets.astype(np.float32))
+
+
+def bench(iters, fn):
+  timer = Timer()
+  for _ in range(iters):
+    timer.tic()
+    keep = fn()
+    timer.toc()
+  return timer.average_time(), keep
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  print('{} threads, C++ extension {}, ffi extension {}'.format(
+    torch.get_num_threads(),
+    'built' if nms_module._nms_cpu is not None else 'not built',
+    'built' if nms_module.nms is not None else 'not built'))
+  rng = np.random.RandomState(3)
+  for num in args.sizes:
+    dets = random_dets(num, rng)
+    torch_time, torch_keep = bench(
+      args.iters, lambda: nms_module.torch_nms(dets, args.thresh))
+    line = '{:6d} boxes: torch {:8.2f}ms'.format(num, torch_time * 1000)
+    if nms_module.nms is not None:
+      ffi_time, ffi_keep = bench(
+        args.iters, lambda: nms_module.ffi_cpu_nms(dets, args.thresh))
+      assert torch.equal(ffi_keep, torch_keep)
+      line += ', ffi {:8.2f}ms ({:.2f}x)'.format(
+        ffi_time * 1000, torch_time / ffi_time)
+    if nms_module._nms_cpu is not None:
+      cpp_time, cpp_keep = bench(
+        args.iters, lambda: nms_module.cpp_cpu_nms(dets, args.thresh))
+      assert torch.equal(cpp_keep, torch_keep)
+      line += ', C++ {:8.2f}ms ({:.2f}x)'.format(
+        cpp_time * 1000, torch_time / cpp_time)
+    print(line + ', {} kept'.format(len(torch_keep)))
+
+    if nms_module._nms_cpu is not None:
+      # Within each of 20 labels, in one call and label after label
+      labels = torch.from_numpy(rng.randint(0, 20, num))
+      batched_time, batched_keep = bench(
+        args.iters, lambda: nms_module.cpp_batched_nms(dets, labels, args.thresh))
+      loop_time, loop_keep = bench(
+        args.iters, lambda: torch.cat([
+          inds[nms_module.cpp_cpu_nms(dets[inds].contiguous(), args.thresh)]
+          for inds in [(labels == l).nonzero().view(-1)
+                       for l in torch.unique(labels)]], 0))
+      assert torch.equal(batched_keep.sort()[0], loop_keep.sort()[0])
+      print('{:6d} boxes, 20 labels: per label {:8.2f}ms, batched {:8.2f}ms '
+            '({:.2f}x)'.format(num, loop_time * 1000, batched_time * 1000,
+                               loop_time / batched_time))
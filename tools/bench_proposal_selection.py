@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Compare decoding all the anchors then sorting with selecting the top
+scoring anchors first, as proposal_layer does, on typical feature map sizes.
+
+Only the part before NMS is timed, NMS gets the same boxes either way.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.config import cfg
+from model.bbox_transform import bbox_transform_inv, clip_boxes
+from layer_utils.snippets import get_anchor_grid
+from utils.timer import Timer
+import argparse
+import numpy as np
+import torch
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Benchmark proposal selection')
+  parser.add_argument('--iters', dest='iters',
+                      help='number of timed runs per feature map size',
+                      default=50, type=int)
+  parser.add_argument('--max_size', dest='max_size',
+                      help='maximum size of the longest side',
+                      default=1000, type=int)
+  parser.add_argument('--scales', dest='scales',
+                      help='target sizes of the shortest side',
+                      default=[600, 800], nargs='+', type=int)
+  parser.add_argument('--anchor_scales', dest='anchor_scales',
+                      help='anchor scales',
+                      default=[4, 8, 16, 32], nargs='+', type=int)
+  parser.add_argument('--pre_nms_top_n', dest='pre_nms_top_n',
+                      help='number of proposals kept before NMS',
+                      default=cfg.TEST.RPN_PRE_NMS_TOP_N, type=int)
+  parser.add_argument('--device', dest='device',
+                      help='device to run on',
+                      default='cuda' if torch.cuda.is_available() else 'cpu',
+                      type=str)
+  args = parser.parse_args()
+  return args
+
+
+def decode_then_sort(scores, deltas, anchors, im_info, top_n):
+  """The selection of proposal_layer before the top-k change."""
+  proposals = bbox_transform_inv(anchors, deltas)
+  proposals = clip_boxes(proposals, im_info[:2])
+  scores, order = scores.sort(descending=True)
+  order = order[:top_n]
+  return proposals[order], scores[:top_n]
+
+
+def select_then_decode(scores, deltas, grid, im_info, top_n):
+  """The selection of proposal_layer."""
+  scores, order = scores.topk(top_n)
+  geometry = [g[order] for g in grid.geometry]
+  proposals = bbox_transform_inv(grid.anchors[order], deltas[order], geometry)
+  return clip_boxes(proposals, im_info[:2]), scores
+
+
+def bench(iters, fn, sync):
+  timer = Timer()
+  for _ in range(iters):
+    timer.tic()
+    fn()
+    sync()
+    timer.toc()
+  return timer.average_time()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  sync = torch.cuda.synchronize if args.device.startswith('cuda') \
+    else lambda: None
+  torch.manual_seed(cfg.RNG_SEED)
+  ratios = cfg.ANCHOR_RATIOS
+  num_anchors = len(args.anchor_scales) * len(ratios)
+
+  # Landscape and portrait 4:3 images, the most common COCO shapes
+  for target_size in args.scales:
+    for aspect in (4. / 3., 3. / 4.):
+      short, long_ = target_size, target_size * max(aspect, 1. / aspect)
+      scale = min(1., args.max_size / long_)
+      im_height, im_width = (short * scale, long_ * scale) if aspect > 1 \
+        else (long_ * scale, short * scale)
+      im_info = np.array([im_height, im_width, 1.], dtype=np.float32)
+      height = int(np.ceil(im_height / 16.))
+      width = int(np.ceil(im_width / 16.))
+      grid = get_anchor_grid(height, width, 16, args.anchor_scales, ratios,
+                             args.device)
+      scores = torch.rand(grid.length, device=args.device)
+      deltas = 0.1 * torch.randn(grid.length, 4, device=args.device)
+
+      expected, _ = decode_then_sort(scores, deltas, grid.anchors, im_info,
+                                     args.pre_nms_top_n)
+      actual, _ = select_then_decode(scores, deltas, grid, im_info,
+                                     args.pre_nms_top_n)
+      assert torch.allclose(expected, actual, atol=1e-3)
+
+      sort_time = bench(args.iters, lambda: decode_then_sort(
+        scores, deltas, grid.anchors, im_info, args.pre_nms_top_n), sync)
+      topk_time = bench(args.iters, lambda: select_then_decode(
+        scores, deltas, grid, im_info, args.pre_nms_top_n), sync)
+      print('{:4d}x{:4d} image, {:6d} anchors: decode+sort {:6.2f}ms, '
+            'topk+decode {:6.2f}ms, speedup {:.2f}x'.format(
+              int(im_height), int(im_width), grid.length, sort_time * 1000,
+              topk_time * 1000, sort_time / topk_time))
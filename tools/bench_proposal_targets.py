@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Time the RoI sampling of proposal_target_layer.
+
+The latency of a whole proposal_target_layer step is measured on random
+proposals on the chosen device, and the number of fg RoIs checked not to
+vary. The statistics of the sampling are checked by
+tools/check_proposal_targets.py.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.config import cfg
+from layer_utils.proposal_target_layer import proposal_target_layer
+from utils.timer import Timer
+import argparse
+import numpy as np
+import torch
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Benchmark RoI sampling')
+  parser.add_argument('--iters', dest='iters',
+                      help='number of timed steps',
+                      default=2000, type=int)
+  parser.add_argument('--num_rois', dest='num_rois',
+                      help='number of proposals',
+                      default=2000, type=int)
+  parser.add_argument('--num_gt', dest='num_gt',
+                      help='number of gt boxes',
+                      default=10, type=int)
+  parser.add_argument('--num_classes', dest='num_classes',
+                      help='number of classes',
+                      default=21, type=int)
+  parser.add_argument('--device', dest='device',
+                      help='device to run on',
+                      default='cuda' if torch.cuda.is_available() else 'cpu',
+                      type=str)
+  args = parser.parse_args()
+  return args
+
+
+def random_inputs(num_rois, num_gt, num_classes, device, rng):
+  ctr = rng.uniform(100, 900, (num_gt, 2))
+  size = rng.uniform(30, 200, (num_gt, 2))
+  gt_boxes = np.hstack((ctr - size / 2, ctr + size / 2,
+                        rng.randint(1, num_classes, (num_gt, 1))))
+  # Proposals jittered around the gt boxes, or anywhere
+  jitter = gt_boxes[rng.randint(0, num_gt, num_rois), :4] + \
+    rng.normal(0, 30, (num_rois, 4))
+  anywhere = np.sort(rng.uniform(0, 1000, (num_rois, 4)).reshape(num_rois, 2, 2), 1) \
+    .transpose(0, 2, 1).reshape(num_rois, 4)
+  boxes = np.where(rng.uniform(size=(num_rois, 1)) < 0.5, jitter, anywhere)
+  rois = np.hstack((np.zeros((num_rois, 1)), boxes))
+  scores = rng.uniform(size=(num_rois, 1))
+  to_tensor = lambda a: torch.from_numpy(a.astype(np.float32)).to(device)
+  return to_tensor(rois), to_tensor(scores), to_tensor(gt_boxes)
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  rois, scores, gt_boxes = random_inputs(args.num_rois, args.num_gt,
+                                         args.num_classes, args.device,
+                                         np.random.RandomState(cfg.RNG_SEED))
+
+  timer = Timer()
+  fg_counts = []
+  for _ in range(args.iters):
+    timer.tic()
+    targets = proposal_target_layer(rois, scores, gt_boxes, args.num_classes)
+    fg_counts.append(int((targets[2] > 0).sum()))
+    timer.toc()
+  assert len(set(fg_counts)) == 1, 'the number of fg RoIs must not vary'
+  print('{} RoIs per step, {} fg'.format(targets[0].size(0), fg_counts[0]))
+  print('proposal_target_layer on {}: {:.2f}ms/step'.format(
+    args.device, timer.average_time() * 1000))
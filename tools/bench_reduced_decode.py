@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Compare full and reduced resolution decoding of images resized for a blob.
+
+Without --imdb, a synthetic high resolution JPEG is written to a temporary
+directory and used for every run.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from utils.blob import get_im_scale, resize_im, imread_reduced, \
+  resize_reduced_im, reduced_decode_factor
+from utils.timer import Timer
+import argparse
+import os.path as osp
+import shutil
+import tempfile
+import numpy as np
+import cv2
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Benchmark reduced decoding')
+  parser.add_argument('--imdb', dest='imdb_name',
+                      help='dataset to read the images of',
+                      default=None, type=str)
+  parser.add_argument('--num_images', dest='num_images',
+                      help='number of images to decode',
+                      default=50, type=int)
+  parser.add_argument('--scale', dest='scale',
+                      help='target size of the shortest side',
+                      default=600, type=int)
+  parser.add_argument('--max_size', dest='max_size',
+                      help='maximum size of the longest side',
+                      default=1000, type=int)
+  parser.add_argument('--synthetic_size', dest='synthetic_size',
+                      help='width and height of the synthetic image',
+                      default=[4000, 3000], nargs=2, type=int)
+  args = parser.parse_args()
+  return args
+
+
+def synthetic_image(width, height):
+  """A smooth image with some texture, so that it compresses like a photo."""
+  y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+  im = np.empty((height, width, 3), dtype=np.float32)
+  im[:, :, 0] = 128 + 60 * np.sin(x / 37.) * np.cos(y / 53.)
+  im[:, :, 1] = 255 * x / width
+  im[:, :, 2] = 255 * y / height
+  im += np.random.RandomState(3).randint(-20, 20, im.shape)
+  return np.clip(im, 0, 255).astype(np.uint8)
+
+
+def bench(paths, target_size, max_size):
+  full_timer = Timer()
+  reduced_timer = Timer()
+  diffs = []
+  factors = []
+  for path in paths:
+    full_timer.tic()
+    im = cv2.imread(path)
+    im_scale = get_im_scale(im.shape, target_size, max_size)
+    full = resize_im(im, im_scale)
+    full_timer.toc()
+
+    # The shape is known up front in practice, from the roidb or the index
+    # of image sizes
+    reduced_timer.tic()
+    reduced = resize_reduced_im(imread_reduced(path, im_scale), im.shape,
+                                im_scale)
+    reduced_timer.toc()
+
+    assert full.shape == reduced.shape
+    factors.append(reduced_decode_factor(im_scale))
+    diffs.append(np.abs(full.astype(np.float32) - reduced).mean())
+
+  print('decode factors: {}'.format(sorted(set(factors))))
+  print('full decode:    {:.2f}ms/image'.format(
+    full_timer.average_time() * 1000))
+  print('reduced decode: {:.2f}ms/image'.format(
+    reduced_timer.average_time() * 1000))
+  print('speedup: {:.2f}x, mean absolute pixel difference: {:.2f}'.format(
+    full_timer.average_time() / reduced_timer.average_time(), np.mean(diffs)))
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  tmp_dir = None
+  if args.imdb_name is not None:
+    from datasets.factory import get_imdb
+    imdb = get_imdb(args.imdb_name)
+    paths = [imdb.image_path_at(i)
+             for i in range(min(args.num_images, imdb.num_images))]
+  else:
+    tmp_dir = tempfile.mkdtemp()
+    path = osp.join(tmp_dir, 'synthetic.jpg')
+    cv2.imwrite(path, synthetic_image(*args.synthetic_size),
+                [cv2.IMWRITE_JPEG_QUALITY, 95])
+    paths = [path] * args.num_images
+
+  try:
+    bench(paths, args.scale, args.max_size)
+  finally:
+    if tmp_dir is not None:
+      shutil.rmtree(tmp_dir)
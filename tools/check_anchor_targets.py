@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Check the torch RPN anchor target layer against the numpy one.
+
+With subsampling disabled, both layers must give the same targets, for one
+and several gt sets, with and without clobbered positives, and with gt boxes
+tied for the max overlap. With the configured RPN batch size, the sampled
+labels must be a subset of the unsampled ones, with the same fg/bg counts as
+the numpy layer, and the bbox targets and weights must agree. The sparse
+outputs must match the dense ones on the sampled anchors.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.config import cfg
+from layer_utils.snippets import get_anchor_grid
+from layer_utils.anchor_target_layer import anchor_targets_sets, \
+  anchor_targets_torch_sets
+import argparse
+import numpy as np
+import torch
+
+NAMES = ['labels', 'bbox_targets', 'bbox_inside_weights', 'bbox_outside_weights']
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Check anchor targets')
+  parser.add_argument('--im_size', dest='im_size',
+                      help='height and width of the image',
+                      default=[600, 1000], nargs=2, type=int)
+  parser.add_argument('--feat_stride', dest='feat_stride',
+                      help='stride of the feature map',
+                      default=16, type=int)
+  parser.add_argument('--num_gt', dest='num_gt',
+                      help='number of gt boxes of a set',
+                      default=20, type=int)
+  parser.add_argument('--device', dest='device',
+                      help='device of the torch layer',
+                      default='cuda' if torch.cuda.is_available() else 'cpu',
+                      type=str)
+  args = parser.parse_args()
+  return args
+
+
+def random_gt_boxes(num_gt, im_height, im_width, rng):
+  x1 = rng.uniform(0, im_width - 32, num_gt)
+  y1 = rng.uniform(0, im_height - 32, num_gt)
+  x2 = np.minimum(x1 + rng.uniform(16, im_width / 2., num_gt), im_width - 1)
+  y2 = np.minimum(y1 + rng.uniform(16, im_height / 2., num_gt), im_height - 1)
+  cls = rng.randint(1, 21, num_gt)
+  return np.stack((x1, y1, x2, y2, cls), 1).astype(np.float32)
+
+
+class Problem(object):
+  """The anchors of an image and the layers to compute their targets with."""
+
+  def __init__(self, im_height, im_width, stride, device):
+    self.im_info = np.array([im_height, im_width, 1.], dtype=np.float32)
+    self.height = int(np.ceil(im_height / float(stride)))
+    self.width = int(np.ceil(im_width / float(stride)))
+    self.num_anchors = len(cfg.ANCHOR_SCALES) * len(cfg.ANCHOR_RATIOS)
+    self.grid = get_anchor_grid(self.height, self.width, stride,
+                                cfg.ANCHOR_SCALES, cfg.ANCHOR_RATIOS, device)
+    self.device = device
+
+  def numpy_targets(self, gt_sets):
+    return anchor_targets_sets(self.height, self.width, gt_sets, self.im_info,
+                               self.grid.anchors_np, self.num_anchors)
+
+  def torch_targets(self, gt_sets, sparse=False):
+    targets = anchor_targets_torch_sets(
+      self.height, self.width,
+      [torch.from_numpy(gt_boxes).to(self.device) for gt_boxes in gt_sets],
+      self.im_info, self.grid.anchors, self.num_anchors, sparse=sparse)
+    if sparse:
+      return [[t.cpu().numpy() for t in set_targets] for set_targets in targets]
+    return [t.cpu().numpy() for t in targets]
+
+  def flat_labels(self, labels):
+    """The labels of the (1, 1, A * height, width) map in anchor order."""
+    return labels.reshape((-1, self.num_anchors, self.height, self.width)) \
+      .transpose(0, 2, 3, 1).reshape((-1, self.grid.length))
+
+
+class Unsampled(object):
+  """Context in which the RPN batch size keeps every fg and bg anchor."""
+
+  def __init__(self, num_anchors):
+    self._batch_size = int(np.ceil(num_anchors / cfg.TRAIN.RPN_FG_FRACTION)) + num_anchors
+
+  def __enter__(self):
+    self._saved = cfg.TRAIN.RPN_BATCHSIZE
+    cfg.TRAIN.RPN_BATCHSIZE = self._batch_size
+
+  def __exit__(self, *args):
+    cfg.TRAIN.RPN_BATCHSIZE = self._saved
+
+
+def check_exact(problem, gt_sets, case):
+  with Unsampled(problem.grid.length):
+    expected = problem.numpy_targets(gt_sets)
+    actual = problem.torch_targets(gt_sets)
+  for name, e, a in zip(NAMES, expected, actual):
+    assert e.shape == a.shape, '{}, {}: {} != {}'.format(case, name, e.shape, a.shape)
+    np.testing.assert_allclose(a, e, rtol=1e-5, atol=1e-5,
+                               err_msg='{}, {}'.format(case, name))
+  print('{}: numpy and torch targets match'.format(case))
+
+
+def check_sampled(problem, gt_sets, case):
+  with Unsampled(problem.grid.length):
+    reference = problem.flat_labels(problem.torch_targets(gt_sets)[0])
+  expected = problem.numpy_targets(gt_sets)
+  actual = problem.torch_targets(gt_sets)
+  num_fg = int(cfg.TRAIN.RPN_FG_FRACTION * cfg.TRAIN.RPN_BATCHSIZE)
+  for i, (ref, e, a) in enumerate(zip(reference, problem.flat_labels(expected[0]),
+                                      problem.flat_labels(actual[0]))):
+    assert np.all((a == ref) | (a == -1)), \
+      '{}, set {}: sampled labels not in the unsampled ones'.format(case, i)
+    fg, bg = int((a == 1).sum()), int((a == 0).sum())
+    ref_fg, ref_bg = int((ref == 1).sum()), int((ref == 0).sum())
+    assert fg == min(num_fg, ref_fg), '{}, set {}: {} fg'.format(case, i, fg)
+    assert bg == min(cfg.TRAIN.RPN_BATCHSIZE - fg, ref_bg), \
+      '{}, set {}: {} bg'.format(case, i, bg)
+    assert fg == (e == 1).sum() and bg == (e == 0).sum(), \
+      '{}, set {}: counts differ from numpy'.format(case, i)
+
+  # The targets do not depend on the sampling, the weights only on the counts
+  np.testing.assert_allclose(actual[1], expected[1], rtol=1e-5, atol=1e-5,
+                             err_msg='{}, bbox_targets'.format(case))
+  labels = problem.flat_labels(actual[0]).reshape(-1)
+  inside = actual[2].reshape((-1, 4))
+  assert np.all((inside != 0).any(1) == (labels == 1)), \
+    '{}: bbox_inside_weights not on the fg anchors'.format(case)
+  np.testing.assert_allclose(np.sort(actual[3].reshape(-1)),
+                             np.sort(expected[3].reshape(-1)), rtol=1e-5,
+                             err_msg='{}, bbox_outside_weights'.format(case))
+  print('{}: sampled targets consistent with numpy'.format(case))
+
+
+def check_sparse(problem, gt_sets, case):
+  with Unsampled(problem.grid.length):
+    dense = problem.torch_targets(gt_sets)
+    sparse = problem.torch_targets(gt_sets, sparse=True)
+  labels = problem.flat_labels(dense[0])
+  for i, (inds, set_labels, targets, inside, outside) in enumerate(sparse):
+    assert np.array_equal(np.sort(inds), np.where(labels[i] >= 0)[0]), \
+      '{}, set {}: sparse anchors are not the sampled ones'.format(case, i)
+    for name, s, d in zip(NAMES, [set_labels, targets, inside, outside],
+                          [labels[i]] + [t[i].reshape((-1, 4)) for t in dense[1:]]):
+      np.testing.assert_allclose(s, d[inds], rtol=1e-5, atol=1e-5,
+                                 err_msg='{}, set {}, {}'.format(case, i, name))
+  print('{}: sparse and dense targets match'.format(case))
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  im_height, im_width = args.im_size
+  problem = Problem(im_height, im_width, args.feat_stride, args.device)
+  rng = np.random.RandomState(cfg.RNG_SEED)
+  np.random.seed(cfg.RNG_SEED)
+  torch.manual_seed(cfg.RNG_SEED)
+
+  single = [random_gt_boxes(args.num_gt, im_height, im_width, rng)]
+  pair = [random_gt_boxes(args.num_gt, im_height, im_width, rng),
+          random_gt_boxes(args.num_gt // 2 + 1, im_height, im_width, rng)]
+  # Duplicated boxes tie for the max overlap of every anchor
+  duplicates = single[0].copy()
+  duplicates[:, 4] = duplicates[:, 4] % 20 + 1
+  tied = [np.concatenate([single[0], duplicates])]
+
+  clobber = cfg.TRAIN.RPN_CLOBBER_POSITIVES
+  try:
+    for clobber_positives in [False, True]:
+      cfg.TRAIN.RPN_CLOBBER_POSITIVES = clobber_positives
+      for name, gt_sets in [('one set', single), ('two sets', pair),
+                            ('tied boxes', tied)]:
+        case = '{}{}'.format(name, ', clobbered' if clobber_positives else '')
+        check_exact(problem, gt_sets, case)
+        check_sampled(problem, gt_sets, case)
+        check_sparse(problem, gt_sets, case)
+  finally:
+    cfg.TRAIN.RPN_CLOBBER_POSITIVES = clobber
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Check the CPU RoI pooling and crop and resize C++ extensions.
+
+Each op is run forward and backward through autograd on random features.
+The gradient must reach the features, and keep the sum of the output
+gradient: every pooled output comes from one feature, and the bilinear
+weights of every crop sample sum to one, as all the boxes are inside.
+Build the extensions first (lib/make.sh).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from layer_utils.roi_pooling import roi_pool as roi_pool_module
+from layer_utils.roi_align import crop_and_resize as crop_and_resize_module
+import torch
+
+
+def random_features():
+  torch.manual_seed(3)
+  return torch.rand(2, 8, 24, 32).requires_grad_()
+
+
+def check_backward(name, features, output):
+  grad_output = torch.rand(output.size())
+  output.backward(grad_output)
+  assert features.grad is not None, '{}: no gradient'.format(name)
+  assert features.grad.size() == features.size(), '{}: wrong gradient size'.format(name)
+  total, expected = float(features.grad.sum()), float(grad_output.sum())
+  assert abs(total - expected) < 1e-3 * expected, \
+    '{}: gradient sum {} instead of {}'.format(name, total, expected)
+  print('{}: forward {}, backward ok'.format(name, tuple(output.size())))
+
+
+if __name__ == '__main__':
+  assert roi_pool_module._roi_pooling_cpu is not None, 'RoI pooling extension not built'
+  assert crop_and_resize_module._crop_and_resize_cpu is not None, \
+    'crop and resize extension not built'
+
+  # (batch index, x1, y1, x2, y2) in image pixels, features of stride 16
+  rois = torch.tensor([[0, 0, 0, 160, 112], [1, 64, 32, 496, 368], [1, 200, 100, 260, 300]])
+  features = random_features()
+  check_backward('roi_pool', features, roi_pool_module.roi_pool(features, rois, 7, 7, 1. / 16.))
+
+  # Normalized (y1, x1, y2, x2)
+  boxes = torch.tensor([[0, 0, 0.5, 0.5], [0.1, 0.2, 0.9, 0.7], [0.3, 0.3, 0.4, 0.9]])
+  box_ind = torch.tensor([0, 1, 1], dtype=torch.int32)
+  features = random_features()
+  check_backward('crop_and_resize', features,
+                 crop_and_resize_module.crop_and_resize(features, boxes, box_ind, 7, 7))
+  features = random_features()
+  check_backward('crop_and_resize_max_pool', features,
+                 crop_and_resize_module.crop_and_resize_max_pool(features, boxes, box_ind, 7, 7))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Check the RoI sampling of proposal_target_layer.
+
+The torch sampler is compared with the former numpy one: both must pick
+every candidate equally often, with and without replacement. The sampler
+must also draw the same RoIs again after its state is restored, as when a
+snapshot is resumed, and leave the default torch generators untouched.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.config import cfg
+from layer_utils.proposal_target_layer import _choice, \
+  get_sampling_rng_state, set_sampling_rng_state
+import argparse
+import numpy as np
+import numpy.random as npr
+import torch
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Check RoI sampling')
+  parser.add_argument('--iters', dest='iters',
+                      help='number of sampling runs',
+                      default=2000, type=int)
+  parser.add_argument('--device', dest='device',
+                      help='device to run on',
+                      default='cuda' if torch.cuda.is_available() else 'cpu',
+                      type=str)
+  args = parser.parse_args()
+  return args
+
+
+def numpy_choice(inds, size, replace):
+  """The sampling of proposal_target_layer before it moved to torch."""
+  picks = npr.choice(np.arange(0, inds.numel()), size=int(size), replace=replace)
+  return inds[torch.from_numpy(picks).long().to(inds.device)]
+
+
+def selection_frequencies(choice, inds, size, replace, iters, num):
+  counts = np.zeros(num)
+  for _ in range(iters):
+    np.add.at(counts, choice(inds, size, replace).cpu().numpy(), 1)
+  return counts[inds.cpu().numpy()] / float(iters)
+
+
+def check_statistics(inds, size, replace, iters):
+  """Both samplers pick each candidate with the same, uniform, frequency."""
+  num = int(inds.max()) + 1
+  expected = float(size) / inds.numel()
+  for name, choice in (('numpy', numpy_choice), ('torch', _choice)):
+    freqs = selection_frequencies(choice, inds, size, replace, iters, num)
+    # Binomial standard deviation of the frequency of each candidate
+    std = np.sqrt(expected * max(1. - expected, expected) / iters)
+    assert np.abs(freqs.mean() - expected) < 1e-6 or replace, name
+    assert np.abs(freqs - expected).max() < 6 * std + 1e-6, \
+      '{}: frequencies {} - {} far from {}'.format(name, freqs.min(), freqs.max(), expected)
+  print('{} of {} candidates ({}): same uniform frequencies'.format(
+    size, inds.numel(), 'with replacement' if replace else 'without replacement'))
+
+
+def default_rng_state(inds):
+  if inds.is_cuda:
+    return torch.cuda.get_rng_state(inds.get_device())
+  return torch.get_rng_state()
+
+
+def check_resume(inds, size, replace):
+  """The draws after a restored state repeat, the default generator is kept."""
+  default_state = default_rng_state(inds)
+  state = get_sampling_rng_state()
+  first = [_choice(inds, size, replace) for _ in range(5)]
+  set_sampling_rng_state(state)
+  second = [_choice(inds, size, replace) for _ in range(5)]
+  assert all(torch.equal(a, b) for a, b in zip(first, second)), \
+    'the draws differ after the state is restored'
+  assert torch.equal(default_rng_state(inds), default_state), \
+    'the sampling advanced the default generator'
+  print('{} of {} candidates ({}): same draws after a restore'.format(
+    size, inds.numel(), 'with replacement' if replace else 'without replacement'))
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  npr.seed(cfg.RNG_SEED)
+
+  inds = torch.arange(0, 3 * 50, 3, dtype=torch.long, device=args.device)
+  check_statistics(inds, 16, False, args.iters)
+  check_statistics(inds, 200, True, args.iters)
+  check_resume(inds, 16, False)
+  check_resume(inds, 200, True)
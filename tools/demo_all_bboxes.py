@@ -19,7 +19,7 @@ from __future__ import print_function
 import _init_paths
 from model.config import cfg
 from model.test import im_detect
-from model.nms_wrapper import nms
+from model.nms_wrapper import multiclass_nms
 
 from utils.timer import Timer
 import matplotlib.pyplot as plt
@@ -70,14 +70,18 @@ def demo(net, image_name):
     ax.imshow(im, aspect='equal')
     cntr = -1
 
+    cls_dets = []
     for cls_ind, cls in enumerate(CLASSES[1:]):
         cls_ind += 1  # because we skipped background
         cls_boxes = boxes[:, 4*cls_ind:4*(cls_ind + 1)]
         cls_scores = scores[:, cls_ind]
-        dets = np.hstack((cls_boxes,
-                          cls_scores[:, np.newaxis])).astype(np.float32)
-        keep = nms(torch.from_numpy(dets), NMS_THRESH)
-        dets = dets[keep.numpy(), :]
+        cls_dets.append(np.hstack((cls_boxes,
+                                   cls_scores[:, np.newaxis])).astype(np.float32))
+    # The classes are suppressed in one call, each on its own boxes
+    keeps = multiclass_nms(cls_dets, NMS_THRESH)
+
+    for cls, dets, keep in zip(CLASSES[1:], cls_dets, keeps):
+        dets = dets[keep, :]
         inds = np.where(dets[:, -1] >= thresh)[0]
         if len(inds) == 0:
             continue
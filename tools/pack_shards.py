@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Pack the images of imdbs into memory-mapped shards.
+
+Every image is resized for each of TRAIN.SCALES (with TRAIN.MAX_SIZE) and
+TEST.SCALES (with TEST.MAX_SIZE). Point TRAIN.IMAGE_SHARDS_DIR and/or
+TEST.IMAGE_SHARDS_DIR to the output directory to use the shards.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.config import cfg, cfg_from_file, cfg_from_list
+from datasets.factory import get_imdb
+from utils.blob import get_im_scale
+from utils.image_shards import ImageShardsWriter
+import argparse
+import pprint
+import sys
+import cv2
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Pack images into shards')
+  parser.add_argument('--cfg', dest='cfg_file',
+                      help='optional config file',
+                      default=None, type=str)
+  parser.add_argument('--imdb', dest='imdb_name',
+                      help='dataset(s) to pack, joined by +',
+                      default='voc_2007_trainval', type=str)
+  parser.add_argument('--output', dest='output_dir',
+                      help='directory to write the shards to',
+                      default=None, type=str)
+  parser.add_argument('--shard_mb', dest='shard_mb',
+                      help='maximum size of a shard in MB',
+                      default=1024, type=int)
+  parser.add_argument('--set', dest='set_cfgs',
+                      help='set config keys', default=None,
+                      nargs=argparse.REMAINDER)
+
+  if len(sys.argv) == 1:
+    parser.print_help()
+    sys.exit(1)
+
+  args = parser.parse_args()
+  return args
+
+
+def pack(imdb_names, output_dir, shard_bytes):
+  sizes = set([(s, cfg.TRAIN.MAX_SIZE) for s in cfg.TRAIN.SCALES] +
+              [(s, cfg.TEST.MAX_SIZE) for s in cfg.TEST.SCALES])
+  writer = ImageShardsWriter(output_dir, shard_bytes)
+  for imdb_name in imdb_names.split('+'):
+    imdb = get_imdb(imdb_name)
+    print('Packing {:d} images of `{:s}`'.format(imdb.num_images, imdb.name))
+    for i in range(imdb.num_images):
+      path = imdb.image_path_at(i)
+      im = cv2.imread(path)
+      for target_size, max_size in sorted(sizes):
+        im_scale = get_im_scale(im.shape, target_size, max_size)
+        resized = cv2.resize(im, None, None, fx=im_scale, fy=im_scale,
+                             interpolation=cv2.INTER_LINEAR)
+        writer.add(path, target_size, max_size, resized, im_scale, im.shape)
+      print('\rpacked: {:d}/{:d}'.format(i + 1, imdb.num_images), end='')
+    print('')
+  writer.close()
+  print('Wrote shards to `{:s}`'.format(output_dir))
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  print('Called with args:')
+  print(args)
+
+  if args.cfg_file is not None:
+    cfg_from_file(args.cfg_file)
+  if args.set_cfgs is not None:
+    cfg_from_list(args.set_cfgs)
+
+  print('Using config:')
+  pprint.pprint(cfg)
+
+  assert args.output_dir is not None, 'Please give an --output directory'
+  pack(args.imdb_name, args.output_dir, args.shard_mb * 1024 * 1024)